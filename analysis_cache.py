@@ -0,0 +1,127 @@
+"""
+Content-addressed cache for finished meal analyses.
+
+Results are keyed by the SHA-256 of the decoded image bytes. Optionally,
+when Pillow is available, a 64-bit difference hash (dHash) is also kept per
+entry, so a re-encoded or resized copy of the same photo can be matched
+within a small Hamming distance.
+"""
+
+import hashlib
+import importlib.util
+import threading
+import time
+from collections import OrderedDict
+from io import BytesIO
+
+# Pillow itself is imported on first use
+PILLOW_AVAILABLE = importlib.util.find_spec("PIL") is not None
+
+
+def content_hash(image_bytes):
+    """Return the hex SHA-256 digest of the image bytes"""
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def perceptual_hash(image_bytes):
+    """
+    Return a 64-bit difference hash of the image, or None if it can't be decoded
+
+    Near-flat images produce almost-empty hashes that would match each other,
+    so those get None as well and are only ever matched by content hash.
+    """
+    if not PILLOW_AVAILABLE:
+        return None
+    try:
+        from PIL import Image
+        with Image.open(BytesIO(image_bytes)) as img:
+            # JPEG decoders can shrink while decoding, which is much cheaper
+            img.draft("L", (64, 64))
+            pixels = list(img.convert("L").resize((9, 8), Image.BILINEAR).getdata())
+    except Exception:
+        return None
+
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            value = (value << 1) | (1 if left > right else 0)
+
+    if not 8 <= bin(value).count("1") <= 56:
+        return None
+    return value
+
+
+class AnalysisCache:
+    """
+    Bounded LRU of analysis results with TTL and near-duplicate matching
+    """
+
+    def __init__(self, max_entries=256, ttl=3600, max_distance=4):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_distance = max_distance
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, phash=None):
+        """Return a cached result by exact hash, else by perceptual hash, or None"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] <= now:
+                del self._entries[key]
+                entry = None
+
+            if entry is None and phash is not None:
+                entry = self._find_similar(phash, now)
+                if entry is not None:
+                    self.near_hits += 1
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(entry[3])
+            self.hits += 1
+            return entry[0]
+
+    def _find_similar(self, phash, now):
+        """Scan for the closest live entry within max_distance bits"""
+        best, best_distance = None, self.max_distance + 1
+        for entry in self._entries.values():
+            if entry[1] is None or entry[2] <= now:
+                continue
+            distance = bin(entry[1] ^ phash).count("1")
+            if distance < best_distance:
+                best, best_distance = entry, distance
+        return best
+
+    def set(self, key, result, phash=None):
+        """Store a result, evicting the least recently used entries"""
+        with self._lock:
+            self._entries[key] = (result, phash, time.time() + self.ttl, key)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        """Return hit/miss counters and the current size"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "near_duplicate_hits": self.near_hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+            }
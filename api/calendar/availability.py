@@ -0,0 +1,144 @@
+"""
+Free/busy and conflict queries for the calendar handlers.
+
+Both go through the store's interval index (EventStore.overlapping), so
+they read only the events that overlap the window rather than every event.
+Recurring series that overlap are expanded just for the window.
+
+GET free-busy?from=&to=
+    busy: the merged intervals in [from, to) covered by at least one event
+    free: the gaps between them. Instants (events without an end_time)
+    take no time. The window may be at most MAX_WINDOW long.
+
+GET conflicts?start_time=&end_time=[&exclude=id]
+GET conflicts?id=
+    the events and occurrences overlapping that time, or overlapping an
+    existing event (which is then left out of its own conflicts). The
+    time checked may be at most MAX_WINDOW long.
+"""
+
+import json
+from datetime import datetime, timezone
+
+from api.calendar.intervals import overlaps, time_span
+from api.calendar.listing import send_error
+from api.calendar.recurrence import DEFAULT_HORIZON, Series
+from api.calendar.store import InvalidTime, parse_time
+
+MAX_WINDOW = DEFAULT_HORIZON.total_seconds()
+
+
+def overlapping_events(store, low, high, exclude=None):
+    """Return the events and recurring occurrences overlapping [low, high), by start time"""
+    found = []
+    for event in store.overlapping(low, high):
+        if event['id'] == exclude:
+            continue
+        if not event.get('rrule'):
+            found.append((time_span(event), int(event['id']), event))
+            continue
+        series = Series(event)
+        # Occurrences that started before the window may still run into it
+        for _, occurrence in series.occurrences(low - series.lead(), high):
+            span = time_span(occurrence)
+            if overlaps(*span, low, high):
+                found.append((span, int(event['id']), occurrence))
+    found.sort(key=lambda item: (item[0][0], item[1]))
+    return [event for _, _, event in found]
+
+
+def busy_intervals(store, low, high):
+    """Return the merged [start, end) intervals within [low, high) that some event takes up"""
+    busy = []
+    for event in overlapping_events(store, low, high):
+        start, end = time_span(event)
+        start, end = max(start, low), min(end, high)
+        if end <= start:
+            continue
+        if busy and start <= busy[-1][1]:
+            busy[-1][1] = max(busy[-1][1], end)
+        else:
+            busy.append([start, end])
+    return [tuple(interval) for interval in busy]
+
+
+def free_intervals(busy, low, high):
+    """Return the gaps in [low, high) between merged busy intervals"""
+    free, cursor = [], low
+    for start, end in busy:
+        if start > cursor:
+            free.append((cursor, start))
+        cursor = max(cursor, end)
+    if cursor < high:
+        free.append((cursor, high))
+    return free
+
+
+def _iso(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat().replace('+00:00', 'Z')
+
+
+def _send_json(handler, body):
+    handler.send_response(200)
+    handler.send_header('Content-type', 'application/json')
+    handler.end_headers()
+    handler.wfile.write(json.dumps(body).encode())
+
+
+def handle_free_busy(handler, store, query_params):
+    """Answer a free/busy GET on behalf of a BaseHTTPRequestHandler"""
+    start = query_params.get('from', [None])[0]
+    end = query_params.get('to', [None])[0]
+    if not start or not end:
+        send_error(handler, 400, 'from and to are required')
+        return
+    try:
+        low, high = parse_time(start), parse_time(end)
+    except InvalidTime as e:
+        send_error(handler, 400, str(e))
+        return
+    if not low < high <= low + MAX_WINDOW:
+        send_error(handler, 400, f'to must be after from and at most {DEFAULT_HORIZON.days} days later')
+        return
+
+    busy = busy_intervals(store, low, high)
+    _send_json(handler, {
+        'from': _iso(low),
+        'to': _iso(high),
+        'busy': [{'start': _iso(s), 'end': _iso(e)} for s, e in busy],
+        'free': [{'start': _iso(s), 'end': _iso(e)} for s, e in free_intervals(busy, low, high)],
+    })
+
+
+def handle_conflicts(handler, store, query_params):
+    """Answer a conflicts GET on behalf of a BaseHTTPRequestHandler"""
+    first = {key: values[0] for key, values in query_params.items()}
+    exclude = first.get('exclude')
+    try:
+        if 'id' in first:
+            event = store.get(first['id'])
+            if event is None:
+                send_error(handler, 404, 'Event not found')
+                return
+            if event.get('rrule'):
+                send_error(handler, 400, 'Check a recurring event by start_time and end_time of one occurrence')
+                return
+            low, high = time_span(event)
+            exclude = event['id']
+        elif first.get('start_time'):
+            event = {'start_time': first['start_time']}
+            if first.get('end_time'):
+                event['end_time'] = first['end_time']
+            low, high = time_span(event)
+        else:
+            send_error(handler, 400, 'id or start_time is required')
+            return
+    except InvalidTime as e:
+        send_error(handler, 400, str(e))
+        return
+    if high - low > MAX_WINDOW:
+        send_error(handler, 400, f'end_time must be at most {DEFAULT_HORIZON.days} days after start_time')
+        return
+
+    conflicts = overlapping_events(store, low, high, exclude)
+    _send_json(handler, {'start': _iso(low), 'end': _iso(high), 'conflicts': conflicts})
@@ -0,0 +1,376 @@
+"""
+Bulk import and export of calendar events as NDJSON or iCalendar.
+
+Imports read the request body incrementally (Content-Length or chunked
+transfer encoding), parse one record at a time and insert valid events in
+batches of IMPORT_BATCH_SIZE with the store's add_many. A bad record never
+fails the rest: the response lists each rejected row with its line number
+(NDJSON) or VEVENT number and starting line (iCalendar).
+
+Exports stream straight from the store in start_time order, optionally
+limited with from/to, and are written in chunks as they are encoded.
+"""
+
+import json
+from datetime import datetime, timezone
+
+from api.calendar.listing import send_error, write_buffered
+from api.calendar.store import InvalidTime, check_event, parse_time
+
+IMPORT_BATCH_SIZE = 500
+READ_CHUNK_SIZE = 64 * 1024
+# Errors listed in an import response; the count is always exact
+MAX_REPORTED_ERRORS = 1000
+
+NDJSON = "ndjson"
+ICS = "ics"
+CONTENT_TYPES = {
+    NDJSON: "application/x-ndjson",
+    ICS: "text/calendar; charset=utf-8",
+}
+
+# iCalendar properties mapped to event fields
+ICS_TEXT_FIELDS = {
+    "SUMMARY": "title",
+    "DESCRIPTION": "description",
+    "LOCATION": "location",
+    "UID": "uid",
+    "RRULE": "rrule",
+}
+
+
+class ImportRowError(ValueError):
+    """Raised for a record that can't become an event"""
+
+
+class MalformedBody(ValueError):
+    """Raised when a chunked request body can't be decoded"""
+
+
+def request_format(handler, query_params):
+    """Pick the import/export format from ?format=, then Content-Type/Accept; None if unsupported"""
+    if 'format' in query_params:
+        requested = query_params['format'][0].lower()
+        return requested if requested in CONTENT_TYPES else None
+    header = handler.headers.get('Content-Type') if handler.command == 'POST' else handler.headers.get('Accept')
+    if header and 'calendar' in header:
+        return ICS
+    return NDJSON
+
+
+def _read_blocks(handler):
+    """Yield the request body in blocks without holding all of it"""
+    if handler.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+        while True:
+            size_line = handler.rfile.readline()
+            try:
+                size = int(size_line.split(b';', 1)[0].strip(), 16)
+            except ValueError:
+                raise MalformedBody(f'Invalid chunk size line {size_line[:40]!r}')
+            if size == 0:
+                # Skip trailers up to the blank line that ends the body
+                while handler.rfile.readline() not in (b'\r\n', b'\n', b''):
+                    pass
+                return
+            remaining = size
+            while remaining:
+                block = handler.rfile.read(min(remaining, READ_CHUNK_SIZE))
+                if not block:
+                    return
+                remaining -= len(block)
+                yield block
+            handler.rfile.readline()  # CRLF after the chunk
+    else:
+        remaining = int(handler.headers.get('Content-Length') or 0)
+        while remaining > 0:
+            block = handler.rfile.read(min(remaining, READ_CHUNK_SIZE))
+            if not block:
+                return
+            remaining -= len(block)
+            yield block
+
+
+def iter_body_lines(handler):
+    """Yield (line number, line bytes without the line ending) from the request body"""
+    pending = b''
+    number = 0
+    for block in _read_blocks(handler):
+        lines = (pending + block).split(b'\n')
+        pending = lines.pop()
+        for line in lines:
+            number += 1
+            yield number, line.rstrip(b'\r')
+    if pending:
+        yield number + 1, pending.rstrip(b'\r')
+
+
+def _validated(event):
+    if not isinstance(event, dict):
+        raise ImportRowError('Each event must be a JSON object')
+    missing = [key for key in ('title', 'start_time') if key not in event]
+    if missing:
+        raise ImportRowError(f"Missing required fields: {', '.join(missing)}")
+    try:
+        check_event(event)
+        if 'end_time' in event:
+            parse_time(event['end_time'])
+    except InvalidTime as e:
+        raise ImportRowError(str(e))
+    # Ids are assigned by the store
+    return {key: value for key, value in event.items() if key != 'id'}
+
+
+def parse_ndjson(lines):
+    """Yield (row, event or ImportRowError) for each non-blank NDJSON line"""
+    for number, line in lines:
+        if not line.strip():
+            continue
+        try:
+            yield {'line': number}, _validated(json.loads(line.decode('utf-8')))
+        except (ValueError, ImportRowError) as e:
+            message = str(e) if isinstance(e, ImportRowError) else f'Invalid JSON: {e}'
+            yield {'line': number}, ImportRowError(message)
+
+
+def _unescape_text(value):
+    result, index = [], 0
+    while index < len(value):
+        char = value[index]
+        if char == '\\' and index + 1 < len(value):
+            following = value[index + 1]
+            result.append('\n' if following in 'nN' else following)
+            index += 2
+        else:
+            result.append(char)
+            index += 1
+    return ''.join(result)
+
+
+def _zone(name):
+    """Return the tz database zone for a TZID, or None if it isn't known here"""
+    try:
+        from zoneinfo import ZoneInfo
+        return ZoneInfo(name)
+    except Exception:
+        return None
+
+
+def _ics_time(value, params):
+    """Convert a DTSTART/DTEND value to the ISO 8601 form events use"""
+    try:
+        if params.get('VALUE') == 'DATE' or len(value) == 8:
+            return datetime.strptime(value, '%Y%m%d').date().isoformat()
+        if value.endswith('Z'):
+            parsed = datetime.strptime(value, '%Y%m%dT%H%M%SZ')
+            return parsed.isoformat() + 'Z'
+        parsed = datetime.strptime(value, '%Y%m%dT%H%M%S')
+    except ValueError:
+        raise ImportRowError(f'Invalid date-time {value!r}')
+    # A TZID time gets its UTC offset so it sorts correctly; floating times stay as written
+    zone = _zone(params['TZID']) if 'TZID' in params else None
+    return (parsed.replace(tzinfo=zone) if zone is not None else parsed).isoformat()
+
+
+def _unfolded(lines):
+    """Join folded iCalendar lines, yielding (number of the first line, text)"""
+    current, current_number = None, 0
+    for number, line in lines:
+        text = line.decode('utf-8', errors='replace')
+        if text[:1] in (' ', '\t') and current is not None:
+            current += text[1:]
+            continue
+        if current is not None:
+            yield current_number, current
+        current, current_number = text, number
+    if current is not None:
+        yield current_number, current
+
+
+def parse_ics(lines):
+    """Yield (row, event or ImportRowError) for each VEVENT in an iCalendar stream"""
+    event, start_line, count = None, 0, 0
+    nested = 0  # Depth inside components within a VEVENT, e.g. VALARM
+    for number, text in _unfolded(lines):
+        if not text:
+            continue
+        head, _, value = text.partition(':')
+        name, *param_parts = head.split(';')
+        name = name.upper()
+        params = {}
+        for part in param_parts:
+            key, _, param_value = part.partition('=')
+            params[key.upper()] = param_value.strip('"')
+
+        if name == 'BEGIN' and value.upper() == 'VEVENT':
+            event, start_line, nested = {}, number, 0
+            count += 1
+        elif event is None:
+            continue
+        elif name == 'BEGIN':
+            nested += 1
+        elif nested:
+            nested -= 1 if name == 'END' else 0
+        elif name == 'END' and value.upper() == 'VEVENT':
+            row = {'event': count, 'line': start_line}
+            fields, event = event, None
+            if isinstance(fields, ImportRowError):
+                yield row, fields
+                continue
+            try:
+                yield row, _validated(fields)
+            except ImportRowError as e:
+                yield row, e
+        elif isinstance(event, ImportRowError):
+            continue
+        elif name in ('DTSTART', 'DTEND'):
+            try:
+                event['start_time' if name == 'DTSTART' else 'end_time'] = _ics_time(value.strip(), params)
+                if 'TZID' in params:
+                    event['timezone'] = params['TZID']
+            except ImportRowError as e:
+                event = e  # Reported once the VEVENT ends
+        elif name == 'EXDATE':
+            try:
+                event.setdefault('exdates', []).extend(
+                    _ics_time(item.strip(), params) for item in value.split(',') if item.strip()
+                )
+            except ImportRowError as e:
+                event = e
+        elif name in ICS_TEXT_FIELDS:
+            event[ICS_TEXT_FIELDS[name]] = value if name == 'RRULE' else _unescape_text(value)
+
+
+def import_events(store, records):
+    """Insert valid records in batches and return the import summary"""
+    imported, failed = 0, 0
+    errors, ids, batch = [], [], []
+
+    def flush():
+        nonlocal imported
+        if batch:
+            added = store.add_many(batch)
+            imported += len(added)
+            ids.extend(event['id'] for event in added)
+            batch.clear()
+
+    for row, record in records:
+        if isinstance(record, ImportRowError):
+            failed += 1
+            if len(errors) < MAX_REPORTED_ERRORS:
+                errors.append(dict(row, error=str(record)))
+            continue
+        batch.append(record)
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            flush()
+    flush()
+
+    summary = {'imported': imported, 'failed': failed, 'ids': ids, 'errors': errors}
+    if failed > len(errors):
+        summary['errors_truncated'] = True
+    return summary
+
+
+def handle_bulk_import(handler, store, query_params):
+    """Answer a bulk import POST on behalf of a BaseHTTPRequestHandler"""
+    body_format = request_format(handler, query_params)
+    if body_format is None:
+        send_error(handler, 400, 'format must be ndjson or ics')
+        return
+    parse = parse_ics if body_format == ICS else parse_ndjson
+    try:
+        summary = import_events(store, parse(iter_body_lines(handler)))
+    except MalformedBody as e:
+        send_error(handler, 400, str(e))
+        return
+
+    # A partly valid import still succeeds; only fail when every row was rejected
+    handler.send_response(422 if summary['failed'] and not summary['imported'] else 200)
+    handler.send_header('Content-type', 'application/json')
+    handler.end_headers()
+    handler.wfile.write(json.dumps(summary).encode())
+
+
+def _escape_text(value):
+    return (str(value).replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+            .replace('\r\n', '\\n').replace('\n', '\\n'))
+
+
+def _fold(line):
+    """Fold a content line to 75 octets as RFC 5545 requires"""
+    encoded = line.encode('utf-8')
+    if len(encoded) <= 75:
+        return line + '\r\n'
+    parts, start, limit = [], 0, 75
+    while start < len(encoded):
+        end = min(start + limit, len(encoded))
+        # Don't split a multi-byte character
+        while end < len(encoded) and (encoded[end] & 0xC0) == 0x80:
+            end -= 1
+        parts.append(encoded[start:end].decode('utf-8'))
+        start, limit = end, 74
+    return '\r\n '.join(parts) + '\r\n'
+
+
+def _ics_value(value, tzid=None):
+    """Return (params, value) for an event time in iCalendar form"""
+    if len(value) == 10:
+        return ';VALUE=DATE', value.replace('-', '')
+    timestamp = parse_time(value)
+    zone = _zone(tzid) if tzid else None
+    if zone is not None:
+        return f';TZID={tzid}', datetime.fromtimestamp(timestamp, zone).strftime('%Y%m%dT%H%M%S')
+    return '', datetime.fromtimestamp(timestamp, timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+
+def ics_lines(events, host='cal-ai'):
+    """Yield an iCalendar document for events, one folded line at a time"""
+    stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    yield 'BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//cal-ai//calendar//EN\r\n'
+    for event in events:
+        yield 'BEGIN:VEVENT\r\n'
+        uid = event.get('uid') or f"{event['id']}@{host}"
+        yield _fold(f'UID:{_escape_text(uid)}')
+        yield f'DTSTAMP:{stamp}\r\n'
+        for key, name in (('start_time', 'DTSTART'), ('end_time', 'DTEND')):
+            if event.get(key):
+                params, value = _ics_value(event[key], event.get('timezone'))
+                yield f'{name}{params}:{value}\r\n'
+        for exdate in event.get('exdates') or ():
+            params, value = _ics_value(exdate, event.get('timezone'))
+            yield f'EXDATE{params}:{value}\r\n'
+        for name, key in ICS_TEXT_FIELDS.items():
+            if name != 'UID' and event.get(key):
+                value = event[key] if name == 'RRULE' else _escape_text(event[key])
+                yield _fold(f'{name}:{value}')
+        yield 'END:VEVENT\r\n'
+    yield 'END:VCALENDAR\r\n'
+
+
+def ndjson_lines(events):
+    encode = json.JSONEncoder().encode
+    for event in events:
+        yield encode(event) + '\n'
+
+
+def handle_export(handler, store, query_params):
+    """Answer an export GET on behalf of a BaseHTTPRequestHandler"""
+    body_format = request_format(handler, query_params)
+    if body_format is None:
+        send_error(handler, 400, 'format must be ndjson or ics')
+        return
+    start = query_params.get('from', [None])[0]
+    end = query_params.get('to', [None])[0]
+    try:
+        for bound in (start, end):
+            if bound:
+                parse_time(bound)
+    except InvalidTime as e:
+        send_error(handler, 400, str(e))
+        return
+
+    events = store.scan(start, end, by_start=True)
+    handler.send_response(200)
+    handler.send_header('Content-type', CONTENT_TYPES[body_format])
+    handler.send_header('Content-Disposition', f'attachment; filename="calendar.{body_format}"')
+    handler.end_headers()
+    write_buffered(handler.wfile, ics_lines(events) if body_format == ICS else ndjson_lines(events))
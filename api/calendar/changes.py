@@ -0,0 +1,140 @@
+"""
+Change feed for calendar clients.
+
+Instead of re-fetching the whole collection, a client keeps a sync token
+and asks for what changed since it. Listings return the token for the
+data they contain in an X-Sync-Token header, and every change feed
+response carries the next one.
+
+GET changes?since=<token>[&wait=<seconds>]
+    The events changed since the token: each changed id once, with the
+    event as it is now, or as deleted. A response covers at most
+    MAX_CHANGE_VERSIONS writes; more=true means ask again right away. With
+    wait, an up-to-date client is held until something changes (long
+    polling). Without since, just the current token.
+
+GET changes/stream?since=<token>
+    The same deltas pushed as server-sent events as they happen. The
+    event id is the sync token, so a reconnecting EventSource resumes
+    from Last-Event-ID.
+
+A token older than the change log's retention answers 410 Gone; the client
+lists everything again and continues from that listing's token.
+"""
+
+import json
+from collections import OrderedDict
+
+from api.calendar.listing import send_error
+from api.calendar.store import ExpiredSyncToken, InvalidCursor, decode_sync_token, encode_sync_token
+
+MAX_CHANGE_VERSIONS = 1000
+MAX_WAIT = 60
+# Seconds between keepalive comments on an idle stream
+KEEPALIVE_INTERVAL = 15
+
+
+def read_changes(store, since):
+    """
+    Collapse the changes after version since into one entry per event
+
+    Returns (version covered, more, changes); more is True when writes
+    after that version are left for the next call.
+    """
+    version = store.version()
+    until = min(version, since + MAX_CHANGE_VERSIONS)
+    ops = OrderedDict()  # event id -> [first op, last op], by last change
+    for _, event_id, op in store.changes(since, until):
+        first = ops.pop(event_id, [op, op])[0]
+        ops[event_id] = [first, op]
+
+    changes = []
+    for event_id, (first, last) in ops.items():
+        event = None if last == 'deleted' else store.get(event_id)
+        if event is None:
+            changes.append({'id': event_id, 'change': 'deleted'})
+        else:
+            changes.append({'id': event_id, 'change': 'created' if first == 'created' else 'updated',
+                            'event': event})
+    return until, until < version, changes
+
+
+def _since(store, token):
+    """Return the version a sync token stands for, raising ExpiredSyncToken for another store's token"""
+    epoch, since = decode_sync_token(token)
+    if epoch != store.sync_epoch():
+        raise ExpiredSyncToken("This sync token is from another calendar store")
+    return since
+
+
+def handle_changes(handler, store, query_params):
+    """Answer a change feed GET on behalf of a BaseHTTPRequestHandler"""
+    first = {key: values[0] for key, values in query_params.items()}
+    epoch = store.sync_epoch()
+    try:
+        wait = min(float(first.get('wait', 0)), MAX_WAIT)
+    except ValueError:
+        send_error(handler, 400, 'wait must be a number of seconds')
+        return
+
+    if not first.get('since'):
+        version, more, changes = store.version(), False, []
+    else:
+        try:
+            since = _since(store, first['since'])
+            version, more, changes = read_changes(store, since)
+            if not changes and not more and wait > 0:
+                store.wait(since, wait)
+                version, more, changes = read_changes(store, since)
+        except InvalidCursor as e:
+            send_error(handler, 400, str(e))
+            return
+        except ExpiredSyncToken as e:
+            send_error(handler, 410, str(e))
+            return
+
+    handler.send_response(200)
+    handler.send_header('Content-type', 'application/json')
+    handler.send_header('Cache-Control', 'no-cache')
+    handler.end_headers()
+    handler.wfile.write(json.dumps({
+        'sync_token': encode_sync_token(epoch, version),
+        'more': more,
+        'changes': changes,
+    }).encode())
+
+
+def handle_change_stream(handler, store, query_params):
+    """Push changes as server-sent events until the client goes away"""
+    epoch = store.sync_epoch()
+    token = query_params.get('since', [None])[0] or handler.headers.get('Last-Event-ID')
+    try:
+        since = _since(store, token) if token else store.version()
+        version, more, changes = read_changes(store, since)
+    except InvalidCursor as e:
+        send_error(handler, 400, str(e))
+        return
+    except ExpiredSyncToken as e:
+        send_error(handler, 410, str(e))
+        return
+
+    handler.send_response(200)
+    handler.send_header('Content-type', 'text/event-stream')
+    handler.send_header('Cache-Control', 'no-cache')
+    handler.end_headers()
+    try:
+        while True:
+            if changes:
+                token = encode_sync_token(epoch, version)
+                data = json.dumps({'sync_token': token, 'changes': changes})
+                handler.wfile.write(f'id: {token}\nevent: changes\ndata: {data}\n\n'.encode())
+            if not more and store.wait(version, KEEPALIVE_INTERVAL) == version:
+                # Lets the client (and any proxy) know the stream is alive, and us that the client is
+                handler.wfile.write(b': keepalive\n\n')
+            try:
+                version, more, changes = read_changes(store, version)
+            except ExpiredSyncToken as e:
+                handler.wfile.write(f'event: expired\ndata: {json.dumps({"error": str(e)})}\n\n'.encode())
+                return
+    except (BrokenPipeError, ConnectionResetError):
+        return
@@ -1,10 +1,23 @@
 import json
+import sys
 from http.server import BaseHTTPRequestHandler
+from pathlib import Path
 from urllib.parse import parse_qs, urlparse
 
-# In-memory storage for calendar events (in a real app, this would be a database)
-events = []
+# Make the project root importable when Vercel loads this file on its own
+sys.path.append(str(Path(__file__).parent.parent.parent))
 
+from api.calendar.availability import handle_conflicts, handle_free_busy
+from api.calendar.bulk import handle_bulk_import, handle_export
+from api.calendar.changes import handle_change_stream, handle_changes
+from api.calendar.listing import send_event_listing
+from api.calendar.store import InvalidTime, get_event_store
+from profiling import profile_handler_methods
+
+# Shared with the /api/calendar routes in api/main.py
+events = get_event_store()
+
+@profile_handler_methods
 class handler(BaseHTTPRequestHandler):
     def do_GET(self):
         """Handle GET requests to retrieve events"""
@@ -12,19 +25,31 @@ class handler(BaseHTTPRequestHandler):
         path = url_parts.path
         query_params = parse_qs(url_parts.query)
         
+        # Stream every event out as NDJSON or iCalendar
+        if path == '/export':
+            handle_export(self, events, query_params)
+            return
+
+        # Busy and free time, and events overlapping a time, from the interval index
+        if path == '/free-busy':
+            handle_free_busy(self, events, query_params)
+            return
+        if path == '/conflicts':
+            handle_conflicts(self, events, query_params)
+            return
+
+        # What changed since a sync token, answered once or pushed as server-sent events
+        if path == '/changes':
+            handle_changes(self, events, query_params)
+            return
+        if path == '/changes/stream':
+            handle_change_stream(self, events, query_params)
+            return
+
         # Get all events - Vercel routes to /api/calendar, so we check for / or empty path
         if path == '/' or path == '':
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            
-            # Filter by event_id if provided
-            if 'id' in query_params:
-                event_id = query_params['id'][0]
-                filtered_events = [event for event in events if event.get('id') == event_id]
-                self.wfile.write(json.dumps(filtered_events).encode())
-            else:
-                self.wfile.write(json.dumps(events).encode())
+            # Filter by event_id or by a start_time range, page and project fields if asked
+            send_event_listing(self, events, query_params)
         else:
             self.send_response(404)
             self.send_header('Content-type', 'text/plain')
@@ -33,6 +58,13 @@ class handler(BaseHTTPRequestHandler):
     
     def do_POST(self):
         """Handle POST requests to create new events"""
+        url_parts = urlparse(self.path)
+
+        # Import many events from an NDJSON or iCalendar body
+        if url_parts.path == '/bulk':
+            handle_bulk_import(self, events, parse_qs(url_parts.query))
+            return
+
         if self.path == '/' or self.path == '':
             content_length = int(self.headers['Content-Length'])
             post_data = self.rfile.read(content_length)
@@ -50,9 +82,7 @@ class handler(BaseHTTPRequestHandler):
                     }).encode())
                     return
                 
-                # Generate a simple ID (in a real app, use UUID or database-generated ID)
-                event_data['id'] = str(len(events) + 1)
-                events.append(event_data)
+                event_data = events.add(event_data)
                 
                 self.send_response(201)
                 self.send_header('Content-type', 'application/json')
@@ -63,6 +93,11 @@ class handler(BaseHTTPRequestHandler):
                 self.send_header('Content-type', 'application/json')
                 self.end_headers()
                 self.wfile.write(json.dumps({'error': 'Invalid JSON'}).encode())
+            except InvalidTime as e:
+                self.send_response(400)
+                self.send_header('Content-type', 'application/json')
+                self.end_headers()
+                self.wfile.write(json.dumps({'error': str(e)}).encode())
         else:
             self.send_response(404)
             self.send_header('Content-type', 'text/plain')
@@ -89,19 +124,25 @@ class handler(BaseHTTPRequestHandler):
             
             try:
                 updated_data = json.loads(put_data.decode())
-                
-                # Find the event to update
-                for i, event in enumerate(events):
-                    if event.get('id') == event_id:
-                        # Update the event with new data while preserving the ID
-                        updated_data['id'] = event_id
-                        events[i] = updated_data
-                        
-                        self.send_response(200)
-                        self.send_header('Content-type', 'application/json')
-                        self.end_headers()
-                        self.wfile.write(json.dumps(updated_data).encode())
-                        return
+
+                # Validate required fields
+                if not all(key in updated_data for key in ['title', 'start_time']):
+                    self.send_response(400)
+                    self.send_header('Content-type', 'application/json')
+                    self.end_headers()
+                    self.wfile.write(json.dumps({
+                        'error': 'Missing required fields. Required: title, start_time'
+                    }).encode())
+                    return
+
+                # Update the event with new data while preserving the ID
+                updated_data = events.replace(event_id, updated_data)
+                if updated_data is not None:
+                    self.send_response(200)
+                    self.send_header('Content-type', 'application/json')
+                    self.end_headers()
+                    self.wfile.write(json.dumps(updated_data).encode())
+                    return
                 
                 # If we get here, the event wasn't found
                 self.send_response(404)
@@ -113,6 +154,11 @@ class handler(BaseHTTPRequestHandler):
                 self.send_header('Content-type', 'application/json')
                 self.end_headers()
                 self.wfile.write(json.dumps({'error': 'Invalid JSON'}).encode())
+            except InvalidTime as e:
+                self.send_response(400)
+                self.send_header('Content-type', 'application/json')
+                self.end_headers()
+                self.wfile.write(json.dumps({'error': str(e)}).encode())
         else:
             self.send_response(404)
             self.send_header('Content-type', 'text/plain')
@@ -136,18 +182,16 @@ class handler(BaseHTTPRequestHandler):
             event_id = query_params['id'][0]
             
             # Find and remove the event
-            for i, event in enumerate(events):
-                if event.get('id') == event_id:
-                    removed_event = events.pop(i)
-                    
-                    self.send_response(200)
-                    self.send_header('Content-type', 'application/json')
-                    self.end_headers()
-                    self.wfile.write(json.dumps({
-                        'message': 'Event deleted successfully',
-                        'event': removed_event
-                    }).encode())
-                    return
+            removed_event = events.delete(event_id)
+            if removed_event is not None:
+                self.send_response(200)
+                self.send_header('Content-type', 'application/json')
+                self.end_headers()
+                self.wfile.write(json.dumps({
+                    'message': 'Event deleted successfully',
+                    'event': removed_event
+                }).encode())
+                return
             
             # If we get here, the event wasn't found
             self.send_response(404)
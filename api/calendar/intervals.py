@@ -0,0 +1,138 @@
+"""
+Interval index over the time spans events occupy.
+
+An event spans [start_time, end_time). An event without an end_time is an
+instant, except an all-day event, which takes up its day. A recurring event
+is indexed once, by the span of its whole series, and expanded only when a
+query overlaps it.
+
+IntervalIndex is a treap ordered by span start where each node also keeps
+the latest end in its subtree, so a query skips every subtree that ends
+before the window: O(log n + k) for k matches, and O(log n) per insert or
+removal, so the index is kept up to date as events change.
+"""
+
+import random
+
+from api.calendar.recurrence import Series
+from api.calendar.times import is_date_only, parse_time
+
+DAY = 86400.0
+
+
+def time_span(event):
+    """(start, end) timestamps of one event or occurrence, ignoring any rrule"""
+    start = parse_time(event['start_time'])
+    if event.get('end_time'):
+        return start, max(parse_time(event['end_time']), start)
+    return start, (start + DAY if is_date_only(event['start_time']) else start)
+
+
+def event_span(event):
+    """(start, end) timestamps an event occupies; for a recurring event, its whole series"""
+    start, end = time_span(event)
+    if event.get('rrule'):
+        end = max(end, Series(event).last_end())
+    return start, end
+
+
+def overlaps(start, end, low, high):
+    """Whether the span [start, end) overlaps [low, high); an instant overlaps if it falls inside"""
+    return start < high and (end > low or start == end >= low)
+
+
+class _Node:
+    __slots__ = ('key', 'value', 'end', 'max_end', 'priority', 'left', 'right')
+
+    def __init__(self, key, value, end):
+        self.key = key          # (start, value)
+        self.value = value
+        self.end = end
+        self.max_end = end
+        self.priority = random.random()
+        self.left = None
+        self.right = None
+
+    def update(self):
+        max_end = self.end
+        if self.left is not None and self.left.max_end > max_end:
+            max_end = self.left.max_end
+        if self.right is not None and self.right.max_end > max_end:
+            max_end = self.right.max_end
+        self.max_end = max_end
+
+
+def _split(node, key, inclusive=False):
+    """Split a treap into the nodes before key (or up to and including it) and the rest"""
+    if node is None:
+        return None, None
+    if node.key < key or (inclusive and node.key == key):
+        node.right, right = _split(node.right, key, inclusive)
+        node.update()
+        return node, right
+    left, node.left = _split(node.left, key, inclusive)
+    node.update()
+    return left, node
+
+
+def _merge(left, right):
+    """Join two treaps where every key in left sorts before every key in right"""
+    if left is None:
+        return right
+    if right is None:
+        return left
+    if left.priority > right.priority:
+        left.right = _merge(left.right, right)
+        left.update()
+        return left
+    right.left = _merge(left, right.left)
+    right.update()
+    return right
+
+
+class IntervalIndex:
+    """
+    Spans keyed by a unique, orderable value (an event's id sequence)
+
+    Not thread-safe; the store holding it serializes access.
+    """
+
+    def __init__(self):
+        self._root = None
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def add(self, value, start, end):
+        left, right = _split(self._root, (start, value))
+        self._root = _merge(_merge(left, _Node((start, value), value, end)), right)
+        self._size += 1
+
+    def discard(self, value, start):
+        """Remove the span added for value with this start, if it is there"""
+        left, rest = _split(self._root, (start, value))
+        middle, right = _split(rest, (start, value), inclusive=True)
+        if middle is not None:
+            self._size -= 1
+        self._root = _merge(left, right)
+
+    def overlapping(self, low, high):
+        """Values whose spans overlap [low, high), ordered by span start"""
+        found, stack, node = [], [], self._root
+        while True:
+            while node is not None:
+                # Nothing in this subtree ends late enough to reach the window
+                if node.max_end < low:
+                    node = None
+                    break
+                stack.append(node)
+                node = node.left
+            if not stack:
+                return found
+            node = stack.pop()
+            if node.key[0] >= high:
+                return found
+            if overlaps(node.key[0], node.end, low, high):
+                found.append(node.value)
+            node = node.right
@@ -0,0 +1,165 @@
+"""
+GET responses for calendar event listings, shared by both calendar handlers.
+
+Query parameters:
+    id        return just that event (as a one-element list)
+    from, to  only events starting in [from, to), ordered by start time;
+              recurring events are expanded into their occurrences
+    limit     page size; the next page's cursor comes back in X-Next-Cursor
+              and a Link: rel="next" header
+    cursor    continue a listing from a previous page
+    fields    comma-separated fields to return, e.g. id,start_time (id is
+              always included)
+
+The body is written to the socket as it is encoded, in chunks, so a large
+listing is never held in memory as one string. Every response carries an
+ETag derived from the store's version and the query, so a client polling
+with If-None-Match gets a bodyless 304 until something changes. The same
+version comes back as an X-Sync-Token for following the change feed (see
+api/calendar/changes.py) from this listing on.
+"""
+
+import json
+import zlib
+from itertools import islice
+from urllib.parse import parse_qsl, urlencode, urlparse
+
+from api.calendar.recurrence import expand_window
+from api.calendar.store import (
+    InvalidCursor,
+    InvalidTime,
+    decode_cursor,
+    encode_cursor,
+    encode_sync_token,
+    listing_key,
+    parse_time,
+)
+
+MAX_PAGE_SIZE = 1000
+WRITE_CHUNK_SIZE = 64 * 1024
+
+
+def listing_etag(version, query):
+    """ETag for one listing: the store version plus a checksum of the normalized query"""
+    normalized = urlencode(sorted(parse_qsl(query, keep_blank_values=True)))
+    return f'"{version}-{zlib.crc32(normalized.encode()):08x}"'
+
+
+def etag_matches(header, etag):
+    """Check an If-None-Match header against an ETag, ignoring weak prefixes"""
+    if not header:
+        return False
+    candidates = [candidate.strip() for candidate in header.split(",")]
+    return "*" in candidates or any(candidate.removeprefix("W/") == etag for candidate in candidates)
+
+
+def write_buffered(wfile, pieces):
+    """Write an iterable of strings to wfile, joined into chunks of about WRITE_CHUNK_SIZE"""
+    chunk, size = [], 0
+    for piece in pieces:
+        chunk.append(piece)
+        size += len(piece)
+        if size >= WRITE_CHUNK_SIZE:
+            wfile.write("".join(chunk).encode())
+            chunk, size = [], 0
+    if chunk:
+        wfile.write("".join(chunk).encode())
+
+
+def project(event, fields):
+    """Return only the given fields of an event, or the whole event if fields is None"""
+    if fields is None:
+        return event
+    return {key: event[key] for key in fields if key in event}
+
+
+def write_json_array(wfile, items, fields=None):
+    """Encode items as a JSON array straight to wfile, a chunk at a time"""
+    encode = json.JSONEncoder().encode
+
+    def pieces():
+        yield "["
+        for index, item in enumerate(items):
+            yield ("," if index else "") + encode(project(item, fields))
+        yield "]"
+
+    write_buffered(wfile, pieces())
+
+
+def send_error(handler, status, message):
+    handler.send_response(status)
+    handler.send_header('Content-type', 'application/json')
+    handler.end_headers()
+    handler.wfile.write(json.dumps({'error': message}).encode())
+
+
+def send_event_listing(handler, store, query_params):
+    """Answer a GET for a listing of events from store on behalf of a BaseHTTPRequestHandler"""
+    url_parts = urlparse(handler.path)
+    first = {key: values[0] for key, values in query_params.items()}
+    start, end = first.get('from'), first.get('to')
+    by_start = start is not None or end is not None
+
+    limit = None
+    if 'limit' in first:
+        try:
+            limit = int(first['limit'])
+        except ValueError:
+            limit = 0
+        if not 1 <= limit <= MAX_PAGE_SIZE:
+            send_error(handler, 400, f'limit must be between 1 and {MAX_PAGE_SIZE}')
+            return
+
+    fields = None
+    if first.get('fields'):
+        fields = ['id'] + [field for field in first['fields'].split(',') if field and field != 'id']
+
+    try:
+        # The scan is lazy, so check the range before any headers go out
+        for bound in (start, end):
+            if bound:
+                parse_time(bound)
+        after = decode_cursor(first['cursor'], by_start) if first.get('cursor') else None
+    except (InvalidTime, InvalidCursor) as e:
+        send_error(handler, 400, str(e))
+        return
+
+    # Read the version before the events, so a concurrent write can only
+    # make the ETag older than the body, never newer
+    version = store.version()
+    etag = listing_etag(version, url_parts.query)
+    sync_token = encode_sync_token(store.sync_epoch(), version)
+    if etag_matches(handler.headers.get('If-None-Match'), etag):
+        handler.send_response(304)
+        handler.send_header('ETag', etag)
+        handler.send_header('X-Sync-Token', sync_token)
+        handler.send_header('Cache-Control', 'no-cache')
+        handler.end_headers()
+        return
+
+    if 'id' in first:
+        event = store.get(first['id'])
+        events = [event] if event is not None else []
+    elif by_start:
+        events = expand_window(store, start, end, after)
+    else:
+        events = store.scan(start, end, after)
+    next_cursor = None
+    if limit is not None:
+        events = list(islice(events, limit + 1))
+        if len(events) > limit:
+            events = events[:limit]
+            next_cursor = encode_cursor(listing_key(events[-1], by_start))
+
+    handler.send_response(200)
+    handler.send_header('Content-type', 'application/json')
+    handler.send_header('ETag', etag)
+    handler.send_header('X-Sync-Token', sync_token)
+    handler.send_header('Cache-Control', 'no-cache')
+    if next_cursor is not None:
+        next_query = dict(first, cursor=next_cursor)
+        handler.send_header('X-Next-Cursor', next_cursor)
+        handler.send_header('Link', f'<{url_parts.path}?{urlencode(next_query)}>; rel="next"')
+    handler.end_headers()
+    write_json_array(handler.wfile, events, fields)
+
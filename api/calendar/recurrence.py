@@ -0,0 +1,449 @@
+"""
+Recurring calendar events.
+
+An event with an rrule (RFC 5545 RRULE syntax, e.g.
+"FREQ=WEEKLY;BYDAY=MO,WE,FR;UNTIL=20241231T000000Z") stands for a whole
+series; only that one record is stored. Two optional fields refine it:
+
+    exdates     occurrence start times that are skipped
+    overrides   {original occurrence start: {field: value, ...}} replacing
+                fields of single occurrences, e.g. a moved start_time
+
+Occurrences are generated lazily and only for the window a query asks
+for. Generation jumps straight to the recurrence period holding the window
+start, so the work is proportional to the window, not the series length.
+The exception is COUNT-limited monthly and yearly rules, where the
+occurrences before the window have to be counted: at most COUNT steps.
+
+Supported rule parts: FREQ (DAILY, WEEKLY, MONTHLY, YEARLY), INTERVAL,
+COUNT, UNTIL, BYDAY (with ordinals for MONTHLY/YEARLY, e.g. -1FR),
+BYMONTHDAY, BYMONTH and WKST=MO.
+"""
+
+import calendar
+import heapq
+import re
+import time
+from datetime import date, datetime, timedelta, timezone
+
+from api.calendar.times import InvalidTime, is_date_only, parse_datetime, parse_time
+
+WEEKDAYS = {"MO": 0, "TU": 1, "WE": 2, "TH": 3, "FR": 4, "SA": 5, "SU": 6}
+FREQUENCIES = ("DAILY", "WEEKLY", "MONTHLY", "YEARLY")
+RULE_PARTS = {"FREQ", "INTERVAL", "COUNT", "UNTIL", "BYDAY", "BYMONTHDAY", "BYMONTH", "WKST"}
+
+# How far past `from` a series is expanded when a query gives no `to`
+DEFAULT_HORIZON = timedelta(days=366)
+# Consecutive recurrence periods without a candidate date before a rule is
+# taken to never match again (e.g. BYMONTHDAY=30 every 12 months from February)
+MAX_EMPTY_PERIODS = 1000
+
+BYDAY_PATTERN = re.compile(r'^([+-]?[1-5])?(MO|TU|WE|TH|FR|SA|SU)$')
+
+
+class InvalidRecurrence(InvalidTime):
+    """Raised for a recurrence rule, exception date or override that can't be used"""
+
+
+class Rule:
+    """A parsed RRULE"""
+
+    def __init__(self, freq, interval=1, count=None, until=None, byday=(), bymonthday=(), bymonth=()):
+        self.freq = freq
+        self.interval = interval
+        self.count = count
+        self.until = until
+        self.byday = byday            # (ordinal or None, weekday)
+        self.bymonthday = bymonthday
+        self.bymonth = bymonth
+
+
+def _int_list(name, value, low, high):
+    try:
+        numbers = [int(item) for item in value.split(",")]
+    except ValueError:
+        raise InvalidRecurrence(f"{name} must be a list of numbers")
+    if not all(low <= abs(number) <= high for number in numbers):
+        raise InvalidRecurrence(f"{name} values must be between {low} and {high}")
+    return tuple(numbers)
+
+
+def _parse_until(value):
+    """UNTIL in RRULE form (20241231, 20241231T235959Z) or ISO 8601"""
+    for pattern, as_date, utc in (("%Y%m%d", True, False), ("%Y%m%dT%H%M%SZ", False, True),
+                                  ("%Y%m%dT%H%M%S", False, False)):
+        try:
+            parsed = datetime.strptime(value, pattern)
+        except ValueError:
+            continue
+        if as_date:
+            return parsed.date()
+        return parsed.replace(tzinfo=timezone.utc) if utc else parsed
+    if is_date_only(value):
+        return parse_datetime(value).date()
+    return parse_datetime(value)
+
+
+def parse_rrule(text):
+    """Parse an RRULE string, raising InvalidRecurrence for anything outside the supported subset"""
+    if not isinstance(text, str) or not text.strip():
+        raise InvalidRecurrence("rrule must be a non-empty string")
+    text = text.strip()
+    if text.upper().startswith("RRULE:"):
+        text = text[6:]
+
+    parts = {}
+    for item in text.split(";"):
+        key, _, value = item.partition("=")
+        key = key.strip().upper()
+        if key not in RULE_PARTS:
+            raise InvalidRecurrence(f"Unsupported rrule part {key or item!r}")
+        parts[key] = value.strip()
+
+    freq = parts.get("FREQ", "").upper()
+    if freq not in FREQUENCIES:
+        raise InvalidRecurrence(f"FREQ must be one of {', '.join(FREQUENCIES)}")
+    if parts.get("WKST", "MO").upper() != "MO":
+        raise InvalidRecurrence("Only WKST=MO is supported")
+
+    try:
+        interval = int(parts.get("INTERVAL", "1"))
+        count = int(parts["COUNT"]) if "COUNT" in parts else None
+    except ValueError:
+        raise InvalidRecurrence("INTERVAL and COUNT must be numbers")
+    if interval < 1 or (count is not None and count < 1):
+        raise InvalidRecurrence("INTERVAL and COUNT must be positive")
+    if count is not None and "UNTIL" in parts:
+        raise InvalidRecurrence("COUNT and UNTIL can't be combined")
+    try:
+        until = _parse_until(parts["UNTIL"]) if "UNTIL" in parts else None
+    except InvalidTime:
+        raise InvalidRecurrence(f"Invalid UNTIL {parts['UNTIL']!r}")
+
+    byday = []
+    for item in filter(None, parts.get("BYDAY", "").upper().split(",")):
+        match = BYDAY_PATTERN.match(item)
+        if match is None:
+            raise InvalidRecurrence(f"Invalid BYDAY value {item!r}")
+        ordinal = int(match.group(1)) if match.group(1) else None
+        if ordinal is not None and freq not in ("MONTHLY", "YEARLY"):
+            raise InvalidRecurrence("BYDAY ordinals are only allowed with FREQ=MONTHLY or YEARLY")
+        byday.append((ordinal, WEEKDAYS[match.group(2)]))
+    bymonthday = _int_list("BYMONTHDAY", parts["BYMONTHDAY"], 1, 31) if parts.get("BYMONTHDAY") else ()
+    bymonth = _int_list("BYMONTH", parts["BYMONTH"], 1, 12) if parts.get("BYMONTH") else ()
+    if any(month < 0 for month in bymonth):
+        raise InvalidRecurrence("BYMONTH values must be between 1 and 12")
+
+    if freq == "DAILY" and (byday or bymonthday):
+        raise InvalidRecurrence("BYDAY and BYMONTHDAY aren't supported with FREQ=DAILY")
+    if freq == "WEEKLY" and bymonthday:
+        raise InvalidRecurrence("BYMONTHDAY isn't supported with FREQ=WEEKLY")
+    if freq == "YEARLY" and (byday or bymonthday) and not bymonth:
+        raise InvalidRecurrence("FREQ=YEARLY with BYDAY or BYMONTHDAY needs BYMONTH")
+    if bymonth and freq != "YEARLY":
+        raise InvalidRecurrence("BYMONTH is only supported with FREQ=YEARLY")
+
+    return Rule(freq, interval, count, until, tuple(byday), bymonthday, bymonth)
+
+
+def _zone(name):
+    """Return the tz database zone for a name, or None if it isn't known here"""
+    try:
+        from zoneinfo import ZoneInfo
+        return ZoneInfo(name)
+    except Exception:
+        return None
+
+
+class Series:
+    """
+    One recurring event and the arithmetic to enumerate its occurrences
+
+    Occurrences are computed in the series' wall-clock time: the event's
+    timezone (an IANA name) if it has one, else the offset of its
+    start_time. So a 09:00 meeting stays at 09:00 across DST changes.
+    """
+
+    def __init__(self, event):
+        self.event = event
+        self.rule = parse_rrule(event.get("rrule"))
+        self.all_day = is_date_only(event["start_time"])
+
+        start = parse_datetime(event["start_time"])
+        self.zone = None
+        if start.tzinfo is not None:
+            zone = _zone(event["timezone"]) if event.get("timezone") else None
+            self.zone = zone or start.tzinfo
+            start = start.astimezone(self.zone).replace(tzinfo=None)
+        self.start = start    # naive wall-clock time of the first occurrence
+        self._monday = start.date() - timedelta(days=start.weekday())
+
+        self.duration = None
+        if event.get("end_time"):
+            self.duration = timedelta(seconds=parse_time(event["end_time"]) - parse_time(event["start_time"]))
+
+        self.exdates = {self._key_for(value) for value in event.get("exdates") or ()}
+        overrides = event.get("overrides") or {}
+        if not isinstance(overrides, dict) or not all(isinstance(fields, dict) for fields in overrides.values()):
+            raise InvalidRecurrence("overrides must map occurrence start times to objects")
+        self.overrides = {}
+        for original, fields in overrides.items():
+            if "start_time" in fields:
+                parse_time(fields["start_time"])
+            self.overrides[self._key_for(original)] = (self._wall(original), fields)
+
+    # Conversions between wall-clock datetimes, timestamps and strings
+
+    def _aware(self, wall):
+        return wall.replace(tzinfo=self.zone or timezone.utc)
+
+    def _timestamp(self, wall):
+        return self._aware(wall).timestamp()
+
+    def _wall_from_timestamp(self, timestamp):
+        return datetime.fromtimestamp(timestamp, self.zone or timezone.utc).replace(tzinfo=None)
+
+    def _wall(self, value):
+        parsed = parse_datetime(value)
+        if parsed.tzinfo is not None:
+            parsed = parsed.astimezone(self.zone or timezone.utc).replace(tzinfo=None)
+        return parsed
+
+    def _key(self, wall):
+        """Identity of an occurrence: its date for all-day series, else its timestamp"""
+        return wall.date() if self.all_day else self._timestamp(wall)
+
+    def _key_for(self, value):
+        try:
+            return self._key(self._wall(value))
+        except InvalidTime:
+            raise InvalidRecurrence(f"Invalid occurrence time {value!r}")
+
+    def _format(self, wall):
+        if self.all_day:
+            return wall.date().isoformat()
+        if self.zone is None:
+            return wall.isoformat()
+        return self._aware(wall).isoformat()
+
+    # Recurrence periods: day, week, month or year number `period` of the series
+
+    def _month_days(self, year, month):
+        days_in_month = calendar.monthrange(year, month)[1]
+        rule = self.rule
+        if rule.byday:
+            days = set()
+            for ordinal, weekday in rule.byday:
+                first = (weekday - date(year, month, 1).weekday()) % 7 + 1
+                matching = list(range(first, days_in_month + 1, 7))
+                if ordinal is None:
+                    days.update(matching)
+                elif -len(matching) <= ordinal <= len(matching) and ordinal != 0:
+                    days.add(matching[ordinal - 1 if ordinal > 0 else ordinal])
+            if rule.bymonthday:
+                days &= {day if day > 0 else days_in_month + day + 1 for day in rule.bymonthday}
+        elif rule.bymonthday:
+            days = {day if day > 0 else days_in_month + day + 1 for day in rule.bymonthday}
+        else:
+            days = {self.start.day}
+        return [date(year, month, day) for day in sorted(days) if 1 <= day <= days_in_month]
+
+    def _period_floor(self, period):
+        """The earliest wall-clock time any occurrence of the period could have"""
+        rule, start = self.rule, self.start
+        if rule.freq == "DAILY":
+            return start + timedelta(days=period * rule.interval)
+        if rule.freq == "WEEKLY":
+            return datetime.combine(self._monday + timedelta(weeks=period * rule.interval), datetime.min.time())
+        if rule.freq == "MONTHLY":
+            year, month = divmod(start.year * 12 + start.month - 1 + period * rule.interval, 12)
+            return datetime(year, month + 1, 1)
+        return datetime(start.year + period * rule.interval, 1, 1)
+
+    def _candidates(self, period):
+        """Sorted wall-clock times of the period's occurrences, ignoring COUNT and UNTIL"""
+        rule, start = self.rule, self.start
+        if rule.freq == "DAILY":
+            return [start + timedelta(days=period * rule.interval)]
+        if rule.freq == "WEEKLY":
+            week = self._monday + timedelta(weeks=period * rule.interval)
+            weekdays = sorted({weekday for _, weekday in rule.byday}) or [start.weekday()]
+            days = [week + timedelta(days=weekday) for weekday in weekdays]
+        elif rule.freq == "MONTHLY":
+            year, month = divmod(start.year * 12 + start.month - 1 + period * rule.interval, 12)
+            days = self._month_days(year, month + 1)
+        else:
+            year = start.year + period * rule.interval
+            days = [day for month in (rule.bymonth or (start.month,)) for day in self._month_days(year, month)]
+        times = [datetime.combine(day, start.time()) for day in days]
+        return [moment for moment in times if moment >= start]
+
+    def _period_of(self, wall):
+        """The period holding a wall-clock time at or after the series start"""
+        rule, start = self.rule, self.start
+        if rule.freq == "DAILY":
+            return (wall.date() - start.date()).days // rule.interval
+        if rule.freq == "WEEKLY":
+            return (wall.date() - self._monday).days // 7 // rule.interval
+        if rule.freq == "MONTHLY":
+            return ((wall.year - start.year) * 12 + wall.month - start.month) // rule.interval
+        return (wall.year - start.year) // rule.interval
+
+    def _count_before(self, period):
+        """Occurrences in the periods before `period`, capped once COUNT is reached"""
+        rule = self.rule
+        if period <= 0:
+            return 0
+        if rule.freq == "DAILY":
+            return period
+        if rule.freq == "WEEKLY":
+            per_week = len({weekday for _, weekday in rule.byday}) or 1
+            return len(self._candidates(0)) + (period - 1) * per_week
+        total, empty = 0, 0
+        for earlier in range(period):
+            found = len(self._candidates(earlier))
+            total += found
+            empty = 0 if found else empty + 1
+            if total >= rule.count or empty >= MAX_EMPTY_PERIODS:
+                break
+        return total
+
+    def _within_until(self, wall):
+        until = self.rule.until
+        if until is None:
+            return True
+        if isinstance(until, datetime):
+            if until.tzinfo is not None:
+                return self._timestamp(wall) <= until.timestamp()
+            return wall <= until
+        return wall.date() <= until
+
+    def _regular(self, start, end):
+        """Yield (timestamp, wall) of non-overridden, non-excluded occurrences in [start, end)"""
+        period = 0
+        if start is not None:
+            period = max(0, self._period_of(self._wall_from_timestamp(max(start, self._timestamp(self.start)))))
+        seen = self._count_before(period) if self.rule.count is not None else 0
+        end_wall = self._wall_from_timestamp(end)
+        empty = 0
+
+        while self._period_floor(period) < end_wall:
+            candidates = self._candidates(period)
+            empty = 0 if candidates else empty + 1
+            if empty >= MAX_EMPTY_PERIODS:
+                return
+            for wall in candidates:
+                seen += 1
+                if self.rule.count is not None and seen > self.rule.count:
+                    return
+                if not self._within_until(wall):
+                    return
+                timestamp = self._timestamp(wall)
+                if timestamp >= end:
+                    return
+                if start is not None and timestamp < start:
+                    continue
+                key = self._key(wall)
+                if key in self.exdates or key in self.overrides:
+                    continue
+                yield timestamp, wall
+            period += 1
+
+    def _occurrence(self, wall, fields=None):
+        occurrence = {key: value for key, value in self.event.items() if key not in ("exdates", "overrides")}
+        occurrence["start_time"] = self._format(wall)
+        if self.duration is not None:
+            occurrence["end_time"] = self._format(wall + self.duration)
+        occurrence["recurrence_id"] = self._format(wall)
+        if fields:
+            occurrence.update(fields)
+            # An override can't change which series or occurrence it belongs to
+            occurrence["id"] = self.event["id"]
+            occurrence["recurrence_id"] = self._format(wall)
+            if "start_time" in fields and "end_time" not in fields and self.duration is not None:
+                occurrence["end_time"] = self._format(self._wall(fields["start_time"]) + self.duration)
+        return occurrence
+
+    def lead(self):
+        """Seconds an occurrence lasts: its duration, a whole day for all-day events, else 0"""
+        if self.duration is not None:
+            return max(self.duration.total_seconds(), 0.0)
+        return 86400.0 if self.all_day else 0.0
+
+    def last_end(self):
+        """Latest time any occurrence can end; infinity unless the rule has an UNTIL"""
+        until = self.rule.until
+        if until is None:
+            return float("inf")
+        if isinstance(until, datetime):
+            last = until.timestamp() if until.tzinfo is not None else self._timestamp(until)
+        else:
+            last = self._timestamp(datetime.combine(until, datetime.max.time()))
+        moved = [parse_time(fields[key]) for _, fields in self.overrides.values()
+                 for key in ("start_time", "end_time") if key in fields]
+        return max([last + self.lead()] + moved)
+
+    def occurrences(self, start=None, end=None):
+        """
+        Yield (timestamp, occurrence) for occurrences starting in [start, end), in order
+
+        start and end are UTC timestamps; start may be None for the beginning
+        of the series, end is required.
+        """
+        regular = ((timestamp, self._occurrence(wall)) for timestamp, wall in self._regular(start, end))
+
+        # Overrides may move an occurrence in or out of the window, so they are placed by their new time
+        moved = []
+        for key, (wall, fields) in self.overrides.items():
+            if key in self.exdates:
+                continue
+            occurrence = self._occurrence(wall, fields)
+            timestamp = parse_time(occurrence["start_time"])
+            if (start is None or timestamp >= start) and timestamp < end:
+                moved.append((timestamp, occurrence))
+        moved.sort(key=lambda item: item[0])
+
+        return heapq.merge(regular, moved, key=lambda item: item[0])
+
+
+def validate_recurrence(event):
+    """Raise InvalidRecurrence if the event's rrule, exdates or overrides can't be expanded"""
+    if event.get("exdates") is not None and not isinstance(event["exdates"], list):
+        raise InvalidRecurrence("exdates must be a list of start times")
+    if event.get("rrule") is not None:
+        Series(dict(event, id=event.get("id", "0")))
+    elif event.get("exdates") or event.get("overrides"):
+        raise InvalidRecurrence("exdates and overrides need an rrule")
+
+
+def expand_window(store, start=None, end=None, after=None):
+    """
+    Yield the events and recurring occurrences that start in [start, end), by start time
+
+    start and end are ISO 8601 strings. Without end, recurring series are
+    expanded DEFAULT_HORIZON past start (or past now). after is a listing
+    key (start timestamp, id sequence); only later entries are yielded.
+    """
+    low = parse_time(start) if start else None
+    high = parse_time(end) if end else None
+    horizon = high if high is not None else (low if low is not None else time.time()) + DEFAULT_HORIZON.total_seconds()
+    if after is not None:
+        low = after[0] if low is None else max(low, after[0])
+
+    def keyed(entries, sequence):
+        for timestamp, event in entries:
+            key = (timestamp, sequence)
+            if after is None or key > after:
+                yield key, event
+
+    singles = (
+        ((parse_time(event["start_time"]), int(event["id"])), event)
+        for event in store.scan(start, end, after, by_start=True)
+        if not event.get("rrule")
+    )
+    streams = [singles]
+    for master in store.recurring(before=horizon):
+        streams.append(keyed(Series(master).occurrences(low, horizon), int(master["id"])))
+
+    for _, event in heapq.merge(*streams, key=lambda item: item[0]):
+        yield event
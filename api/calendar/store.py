@@ -0,0 +1,753 @@
+"""
+Event storage for the calendar API.
+
+Both calendar handlers go through the EventStore interface. The default
+SQLiteEventStore keeps events in a WAL-mode SQLite file, so every handler
+process pointed at the same CALENDAR_DB_PATH reads and writes one dataset
+and nothing is lost on a cold start. MemoryEventStore keeps them in the
+process: a dict by id plus a bisect-sorted (start, id) index.
+
+Each store also keeps an interval index of the span every event occupies
+(see api/calendar/intervals.py), updated with every write, for overlap
+queries such as free/busy and conflict checks: a treap in memory and an
+R*Tree virtual table in SQLite.
+
+Every write also appends (version, event id, created/updated/deleted) to
+a change log, so clients can sync just what changed since a version (see
+api/calendar/changes.py). Changes older than change_retention seconds are
+compacted away every COMPACT_INTERVAL seconds as writes come in; a sync
+token from before that gets ExpiredSyncToken.
+
+In both, ids come from a counter that never reuses values, a start time
+range is found through an index rather than a scan, and every write bumps
+a version number that listings use as their ETag.
+"""
+
+import base64
+import importlib
+import itertools
+import json
+import os
+import sqlite3
+import threading
+import time
+from bisect import bisect_left, bisect_right, insort
+from contextlib import contextmanager
+
+from api.calendar.intervals import IntervalIndex, event_span, overlaps
+from api.calendar.recurrence import validate_recurrence
+from api.calendar.times import InvalidTime, parse_time
+from structured_logging import get_logger
+
+log = get_logger('calendar')
+
+# Events read per lock acquisition / query while scanning
+SCAN_BATCH_SIZE = 256
+
+# How long the change log keeps a change, and how often it is compacted
+CHANGE_RETENTION = 7 * 24 * 3600
+COMPACT_INTERVAL = 300
+# How often wait() re-reads the version when it can't be notified
+CHANGE_POLL_INTERVAL = 0.25
+
+
+class InvalidCursor(ValueError):
+    """Raised for a pagination cursor or sync token that this store didn't produce"""
+
+
+class ExpiredSyncToken(ValueError):
+    """Raised when the changes after a sync token are no longer in the change log"""
+
+
+def check_event(event):
+    """Raise InvalidTime (or InvalidRecurrence) if the event can't be stored and indexed; return its span"""
+    validate_recurrence(event)
+    return event_span(event)
+
+
+def _stored_span(sequence, event):
+    """
+    Span for an event written before spans were indexed, or None to leave it out
+
+    Those writes didn't check end_time, so an event whose span can't be
+    worked out is logged and left out of the index (and so out of free/busy
+    and conflicts) rather than failing the upgrade; it is indexed again once
+    it is replaced.
+    """
+    try:
+        return event_span(event)
+    except (ValueError, KeyError, TypeError) as e:
+        log.warning("calendar_span_skipped", event_id=sequence, error=str(e))
+        return None
+
+
+def _range_bounds(start, end):
+    return (parse_time(start) if start else None, parse_time(end) if end else None)
+
+
+def _sequence(event_id):
+    """Return the numeric sequence behind an id string, or None if it isn't one"""
+    try:
+        return int(event_id)
+    except (TypeError, ValueError):
+        return None
+
+
+def listing_key(event, by_start):
+    """
+    Return an event's position in a listing
+
+    Listings are ordered by id, or by (start timestamp, id) when they are
+    limited to a time range.
+    """
+    if by_start:
+        return (parse_time(event['start_time']), int(event['id']))
+    return int(event['id'])
+
+
+def encode_cursor(key):
+    """Turn a listing key into an opaque cursor for the next page"""
+    value = list(key) if isinstance(key, tuple) else key
+    return base64.urlsafe_b64encode(json.dumps(value).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor, by_start):
+    """Turn a cursor back into a listing key, checking it fits the listing's order"""
+    try:
+        value = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError:
+        raise InvalidCursor("Invalid cursor")
+    if by_start:
+        if (isinstance(value, list) and len(value) == 2 and isinstance(value[0], (int, float))
+                and isinstance(value[1], int)):
+            return (float(value[0]), value[1])
+    elif isinstance(value, int) and not isinstance(value, bool):
+        return value
+    raise InvalidCursor("Invalid cursor")
+
+
+def encode_sync_token(epoch, version):
+    """Turn a store's change log epoch and a version into an opaque sync token"""
+    return base64.urlsafe_b64encode(json.dumps([epoch, version]).encode()).decode().rstrip("=")
+
+
+def decode_sync_token(token):
+    """Turn a sync token back into (epoch, version)"""
+    try:
+        value = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+    except ValueError:
+        raise InvalidCursor("Invalid sync token")
+    if (isinstance(value, list) and len(value) == 2 and isinstance(value[0], str)
+            and isinstance(value[1], int) and not isinstance(value[1], bool)):
+        return value[0], value[1]
+    raise InvalidCursor("Invalid sync token")
+
+
+class EventStore:
+    """
+    Interface every event store implements
+
+    Events are dicts with at least title and start_time; the store adds a
+    string id. Methods that take an id return None when it is unknown.
+    """
+
+    def add(self, event):
+        """Store a new event under a fresh id and return it"""
+        return self.add_many([event])[0]
+
+    def add_many(self, events):
+        """Store several events in one batch and return them with their ids"""
+        raise NotImplementedError
+
+    def get(self, event_id):
+        raise NotImplementedError
+
+    def replace(self, event_id, event):
+        """Replace an event, keeping its id"""
+        raise NotImplementedError
+
+    def delete(self, event_id):
+        """Remove an event and return it"""
+        raise NotImplementedError
+
+    def scan(self, start=None, end=None, after=None, by_start=False):
+        """
+        Yield events in listing order, reading them in batches
+
+        Events come in id (creation) order, or by start time with by_start
+        or when start or end is given; then only events starting at or
+        after start and before end are yielded. start and end are ISO 8601
+        strings. after is a listing_key(); the scan resumes right after that
+        position.
+        """
+        raise NotImplementedError
+
+    def version(self):
+        """Return a number that changes whenever any event is written"""
+        raise NotImplementedError
+
+    def recurring(self, before=None):
+        """Return the recurring events (those with an rrule) whose series starts before a UTC timestamp"""
+        raise NotImplementedError
+
+    def sync_epoch(self):
+        """Return the id of this store's change log; versions from another log mean nothing here"""
+        raise NotImplementedError
+
+    def changes(self, since, until=None):
+        """
+        Return (version, event id, op) for each change in versions (since, until], oldest first
+
+        op is "created", "updated" or "deleted". Raises ExpiredSyncToken if
+        some of those changes were compacted away, or since is ahead of the
+        store.
+        """
+        raise NotImplementedError
+
+    def compact(self, before=None):
+        """Drop changes logged before a UTC timestamp (default: change_retention ago) and return how many"""
+        raise NotImplementedError
+
+    def wait(self, version, timeout):
+        """Wait up to timeout seconds for the store to move past version, then return the current version"""
+        deadline = time.monotonic() + timeout
+        current = self.version()
+        while current == version and time.monotonic() < deadline:
+            time.sleep(min(CHANGE_POLL_INTERVAL, max(deadline - time.monotonic(), 0)))
+            current = self.version()
+        return current
+
+    def overlapping(self, low, high):
+        """
+        Return the events whose span overlaps [low, high), by span start
+
+        low and high are UTC timestamps. A recurring event is returned
+        once, as its series, when the series' span overlaps; expanding it
+        is up to the caller.
+        """
+        spans = [(event_span(event), int(event['id']), event) for event in self.scan()]
+        return [event for (span, _, event) in sorted(spans, key=lambda item: (item[0][0], item[1]))
+                if overlaps(*span, low, high)]
+
+    def all(self):
+        """Return every event in the order they were created"""
+        return list(self.scan())
+
+    def between(self, start=None, end=None):
+        """Return events starting at or after start and before end, ordered by start time"""
+        return list(self.scan(start, end))
+
+    def __len__(self):
+        raise NotImplementedError
+
+
+class MemoryEventStore(EventStore):
+    """
+    Events held in this process, indexed by id and by start time
+    """
+
+    def __init__(self, change_retention=CHANGE_RETENTION):
+        self.change_retention = change_retention
+        self._events = {}       # id -> event
+        self._by_id = []        # sorted sequences; ids only grow, so adds append
+        self._by_start = []     # sorted (start timestamp, sequence)
+        self._recurring = {}    # id -> event, for events with an rrule
+        self._spans = IntervalIndex()   # sequence -> event span
+        self._ids = itertools.count(1)
+        self._version = 0
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+
+        self._epoch = os.urandom(6).hex()
+        self._changes = []              # (version, sequence, op, changed_at), by version
+        self._change_versions = []      # the versions alone, for bisect
+        self._changes_floor = 0         # oldest version a sync can start from
+        self._compacted_at = time.time()
+
+    def __len__(self):
+        return len(self._events)
+
+    def _log(self, sequence, op):
+        """Record a change made by the write in progress (caller holds the lock)"""
+        self._changes.append((self._version + 1, sequence, op, time.time()))
+        self._change_versions.append(self._version + 1)
+
+    def _committed(self):
+        """Finish a write: bump the version, wake waiters and compact now and then (caller holds the lock)"""
+        self._version += 1
+        self._changed.notify_all()
+        if time.time() - self._compacted_at >= COMPACT_INTERVAL:
+            self._compact(time.time() - self.change_retention)
+
+    def _compact(self, before):
+        self._compacted_at = time.time()
+        dropped = 0
+        while dropped < len(self._changes) and self._changes[dropped][3] < before:
+            dropped += 1
+        if dropped:
+            self._changes_floor = max(self._changes_floor, self._changes[dropped - 1][0])
+            del self._changes[:dropped]
+            del self._change_versions[:dropped]
+        return dropped
+
+    def _index(self, event, span):
+        insort(self._by_start, listing_key(event, by_start=True))
+        self._spans.add(int(event['id']), *span)
+        if event.get('rrule'):
+            self._recurring[event['id']] = event
+
+    def _unindex(self, event):
+        key = listing_key(event, by_start=True)
+        position = bisect_left(self._by_start, key)
+        if position < len(self._by_start) and self._by_start[position] == key:
+            del self._by_start[position]
+        self._spans.discard(key[1], key[0])
+        self._recurring.pop(event['id'], None)
+
+    def add_many(self, events):
+        # Every span is worked out before anything changes, so a bad event leaves the store as it was
+        spans = [check_event(event) for event in events]
+        added = []
+        with self._lock:
+            for event, span in zip(events, spans):
+                sequence = next(self._ids)
+                event = dict(event, id=str(sequence))
+                self._events[event['id']] = event
+                self._by_id.append(sequence)
+                self._index(event, span)
+                self._log(sequence, 'created')
+                added.append(event)
+            self._committed()
+        return added
+
+    def get(self, event_id):
+        return self._events.get(event_id)
+
+    def replace(self, event_id, event):
+        span = check_event(event)
+        with self._lock:
+            existing = self._events.get(event_id)
+            if existing is None:
+                return None
+            event = dict(event, id=event_id)
+            self._unindex(existing)
+            self._events[event_id] = event
+            self._index(event, span)
+            self._log(int(event_id), 'updated')
+            self._committed()
+        return event
+
+    def delete(self, event_id):
+        with self._lock:
+            event = self._events.pop(event_id, None)
+            if event is not None:
+                self._unindex(event)
+                position = bisect_left(self._by_id, int(event_id))
+                del self._by_id[position]
+                self._log(int(event_id), 'deleted')
+                self._committed()
+        return event
+
+    def version(self):
+        return self._version
+
+    def recurring(self, before=None):
+        with self._lock:
+            events = list(self._recurring.values())
+        if before is None:
+            return events
+        return [event for event in events if parse_time(event['start_time']) < before]
+
+    def overlapping(self, low, high):
+        with self._lock:
+            return [self._events[str(sequence)] for sequence in self._spans.overlapping(low, high)]
+
+    def sync_epoch(self):
+        return self._epoch
+
+    def changes(self, since, until=None):
+        with self._lock:
+            if not self._changes_floor <= since <= self._version:
+                raise ExpiredSyncToken("Changes since this sync token are no longer available")
+            first = bisect_right(self._change_versions, since)
+            last = len(self._changes) if until is None else bisect_right(self._change_versions, until)
+            return [(version, str(sequence), op) for version, sequence, op, _ in self._changes[first:last]]
+
+    def compact(self, before=None):
+        with self._lock:
+            return self._compact(time.time() - self.change_retention if before is None else before)
+
+    def wait(self, version, timeout):
+        with self._changed:
+            self._changed.wait_for(lambda: self._version != version, timeout)
+            return self._version
+
+    def scan(self, start=None, end=None, after=None, by_start=False):
+        by_start = by_start or start is not None or end is not None
+        low, high = _range_bounds(start, end)
+        while True:
+            # Re-find the position each batch so concurrent writes can't skip or repeat events
+            with self._lock:
+                if by_start:
+                    index = self._by_start
+                    first = bisect_right(index, after) if after is not None else 0
+                    if low is not None:
+                        first = max(first, bisect_left(index, (low,)))
+                    last = len(index) if high is None else bisect_left(index, (high,))
+                    keys = index[first:min(last, first + SCAN_BATCH_SIZE)]
+                    batch = [self._events[str(sequence)] for _, sequence in keys]
+                else:
+                    index = self._by_id
+                    first = bisect_right(index, after) if after is not None else 0
+                    keys = index[first:first + SCAN_BATCH_SIZE]
+                    batch = [self._events[str(sequence)] for sequence in keys]
+            yield from batch
+            if len(keys) < SCAN_BATCH_SIZE:
+                return
+            after = keys[-1]
+
+
+class SQLiteEventStore(EventStore):
+    """
+    Events in a SQLite file shared by every process that opens it
+
+    Each process holds one connection, opened on first use (and again
+    after a fork). The database runs in WAL mode so readers never wait for
+    the writer, and writes that read first take the write lock up front.
+    The SQL text is constant, so sqlite3's statement cache keeps every
+    statement prepared after its first use.
+    """
+
+    def __init__(self, path, timeout=5.0, change_retention=CHANGE_RETENTION):
+        self.path = path
+        self.timeout = timeout
+        self.change_retention = change_retention
+        self._conn = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._compacted_at = time.time()
+
+    def _connect(self):
+        """Open this process's connection and create the schema on first use (caller holds the lock)"""
+        if self._conn is None or self._pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # Autocommit mode; transactions are started explicitly below
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=self.timeout,
+                                   isolation_level=None, cached_statements=64)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            # Under the write lock, so processes opening an older database don't race to migrate it
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._create_schema(conn)
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+            self._conn = conn
+            self._pid = os.getpid()
+        return self._conn
+
+    @staticmethod
+    def _create_schema(conn):
+        """Create the tables, or add what a database from an earlier release is missing"""
+        # AUTOINCREMENT keeps ids from being reused after the newest event is deleted
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS calendar_events ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " start_ts REAL NOT NULL,"
+            " data TEXT NOT NULL)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS calendar_events_start "
+            "ON calendar_events (start_ts, id)"
+        )
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(calendar_events)")}
+        if "recurring" not in columns:
+            # 1 for events with an rrule
+            conn.execute("ALTER TABLE calendar_events ADD COLUMN recurring INTEGER NOT NULL DEFAULT 0")
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS calendar_events_recurring "
+            "ON calendar_events (start_ts) WHERE recurring = 1"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS calendar_meta ("
+            " key TEXT PRIMARY KEY,"
+            " value INTEGER NOT NULL)"
+        )
+        conn.execute("INSERT OR IGNORE INTO calendar_meta (key, value) VALUES ('version', 0)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS calendar_changes ("
+            " version INTEGER NOT NULL,"
+            " event_id INTEGER NOT NULL,"
+            " op TEXT NOT NULL,"
+            " changed_at REAL NOT NULL)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS calendar_changes_version "
+            "ON calendar_changes (version)"
+        )
+        conn.execute(
+            "INSERT OR IGNORE INTO calendar_meta (key, value) VALUES ('epoch', ?)",
+            (int.from_bytes(os.urandom(6), "big"),)
+        )
+        # Writes from before the change log existed can't be synced from
+        conn.execute(
+            "INSERT OR IGNORE INTO calendar_meta (key, value)"
+            " SELECT 'changes_floor', value FROM calendar_meta WHERE key = 'version'"
+        )
+        # R*Tree coordinates are 32-bit floats rounded outwards, so it can return
+        # a few extra candidates but never misses one; overlapping() checks exact spans
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'calendar_spans'").fetchone() is None:
+            conn.execute("CREATE VIRTUAL TABLE calendar_spans USING rtree(id, start_ts, end_ts)")
+            rows = conn.execute("SELECT id, data FROM calendar_events").fetchall()
+            spans = [(row[0], _stored_span(row[0], json.loads(row[1]))) for row in rows]
+            conn.executemany(
+                "INSERT INTO calendar_spans (id, start_ts, end_ts) VALUES (?, ?, ?)",
+                [(sequence, *span) for sequence, span in spans if span is not None]
+            )
+
+    @contextmanager
+    def _transaction(self):
+        """
+        Run a write transaction holding SQLite's write lock from the start
+
+        The version is bumped inside the same transaction, so a reader never
+        sees new data under an old version.
+        """
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            changes = conn.total_changes
+            try:
+                yield conn
+                if conn.total_changes != changes:
+                    conn.execute("UPDATE calendar_meta SET value = value + 1 WHERE key = 'version'")
+                    if time.time() - self._compacted_at >= COMPACT_INTERVAL:
+                        self._compact(conn, time.time() - self.change_retention)
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    @staticmethod
+    def _log(conn, sequence, op):
+        """Record a change under the version the current transaction will commit"""
+        conn.execute(
+            "INSERT INTO calendar_changes (version, event_id, op, changed_at)"
+            " SELECT value + 1, ?, ?, ? FROM calendar_meta WHERE key = 'version'",
+            (sequence, op, time.time())
+        )
+
+    def _compact(self, conn, before):
+        """Drop changes from before a timestamp inside a write transaction"""
+        self._compacted_at = time.time()
+        # Changes are logged in time order, so walk the version index up to the first one to keep
+        row = conn.execute(
+            "SELECT version FROM calendar_changes WHERE changed_at >= ? ORDER BY version LIMIT 1", (before,)
+        ).fetchone()
+        if row is None:
+            row = conn.execute("SELECT value + 1 FROM calendar_meta WHERE key = 'version'").fetchone()
+        cursor = conn.execute("DELETE FROM calendar_changes WHERE version < ?", (row[0],))
+        if cursor.rowcount:
+            conn.execute(
+                "UPDATE calendar_meta SET value = MAX(value, ?) WHERE key = 'changes_floor'", (row[0] - 1,)
+            )
+        return cursor.rowcount
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._connect().execute(sql, params).fetchall()
+
+    @staticmethod
+    def _encode(event):
+        return json.dumps({key: value for key, value in event.items() if key != 'id'})
+
+    @staticmethod
+    def _decode(row):
+        return dict(json.loads(row[1]), id=str(row[0]))
+
+    def __len__(self):
+        return self._query("SELECT COUNT(*) FROM calendar_events")[0][0]
+
+    def add_many(self, events):
+        spans = [check_event(event) for event in events]
+        rows = [(parse_time(event['start_time']), self._encode(event), int(bool(event.get('rrule'))))
+                for event in events]
+        added = []
+        with self._transaction() as conn:
+            for event, row, span in zip(events, rows, spans):
+                cursor = conn.execute(
+                    "INSERT INTO calendar_events (start_ts, data, recurring) VALUES (?, ?, ?)", row
+                )
+                conn.execute(
+                    "INSERT INTO calendar_spans (id, start_ts, end_ts) VALUES (?, ?, ?)",
+                    (cursor.lastrowid, *span)
+                )
+                self._log(conn, cursor.lastrowid, 'created')
+                added.append(dict(event, id=str(cursor.lastrowid)))
+        return added
+
+    def get(self, event_id):
+        sequence = _sequence(event_id)
+        if sequence is None:
+            return None
+        rows = self._query("SELECT id, data FROM calendar_events WHERE id = ?", (sequence,))
+        return self._decode(rows[0]) if rows else None
+
+    def replace(self, event_id, event):
+        start_ts, end_ts = check_event(event)
+        sequence = _sequence(event_id)
+        if sequence is None:
+            return None
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE calendar_events SET start_ts = ?, data = ?, recurring = ? WHERE id = ?",
+                (start_ts, self._encode(event), int(bool(event.get('rrule'))), sequence)
+            )
+            if cursor.rowcount == 0:
+                return None
+            conn.execute(
+                "INSERT OR REPLACE INTO calendar_spans (id, start_ts, end_ts) VALUES (?, ?, ?)",
+                (sequence, start_ts, end_ts)
+            )
+            self._log(conn, sequence, 'updated')
+        return dict(event, id=event_id)
+
+    def delete(self, event_id):
+        sequence = _sequence(event_id)
+        if sequence is None:
+            return None
+        with self._transaction() as conn:
+            row = conn.execute("SELECT id, data FROM calendar_events WHERE id = ?", (sequence,)).fetchone()
+            if row is None:
+                return None
+            conn.execute("DELETE FROM calendar_events WHERE id = ?", (sequence,))
+            conn.execute("DELETE FROM calendar_spans WHERE id = ?", (sequence,))
+            self._log(conn, sequence, 'deleted')
+        return self._decode(row)
+
+    def version(self):
+        return self._query("SELECT value FROM calendar_meta WHERE key = 'version'")[0][0]
+
+    def recurring(self, before=None):
+        rows = self._query(
+            "SELECT id, data FROM calendar_events WHERE recurring = 1 AND start_ts < ?",
+            (float("inf") if before is None else before,)
+        )
+        return [self._decode(row) for row in rows]
+
+    def overlapping(self, low, high):
+        rows = self._query(
+            "SELECT e.id, e.data FROM calendar_spans s JOIN calendar_events e ON e.id = s.id"
+            " WHERE s.start_ts <= ? AND s.end_ts >= ?",
+            (high, low)
+        )
+        spans = [(event_span(event), int(event['id']), event) for event in map(self._decode, rows)]
+        return [event for (span, _, event) in sorted(spans, key=lambda item: (item[0][0], item[1]))
+                if overlaps(*span, low, high)]
+
+    def sync_epoch(self):
+        return format(self._query("SELECT value FROM calendar_meta WHERE key = 'epoch'")[0][0], "x")
+
+    def changes(self, since, until=None):
+        with self._lock:
+            conn = self._connect()
+            # One read transaction, so the floor and the log come from the same snapshot
+            conn.execute("BEGIN")
+            try:
+                floor, version = conn.execute(
+                    "SELECT MAX(CASE key WHEN 'changes_floor' THEN value END),"
+                    " MAX(CASE key WHEN 'version' THEN value END) FROM calendar_meta"
+                ).fetchone()
+                if not floor <= since <= version:
+                    raise ExpiredSyncToken("Changes since this sync token are no longer available")
+                rows = conn.execute(
+                    "SELECT version, event_id, op FROM calendar_changes"
+                    " WHERE version > ? AND version <= ? ORDER BY version, rowid",
+                    (since, version if until is None else until)
+                ).fetchall()
+            finally:
+                conn.execute("COMMIT")
+        return [(row[0], str(row[1]), row[2]) for row in rows]
+
+    def compact(self, before=None):
+        before = time.time() - self.change_retention if before is None else before
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Not a change to any event, so the version stays
+                dropped = self._compact(conn, before)
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+        return dropped
+
+    def scan(self, start=None, end=None, after=None, by_start=False):
+        by_start = by_start or start is not None or end is not None
+        low, high = _range_bounds(start, end)
+        low = float("-inf") if low is None else low
+        high = float("inf") if high is None else high
+        while True:
+            # Keyset pagination: each batch is one indexed query that starts after the last row
+            if by_start:
+                after_ts, after_id = after if after is not None else (float("-inf"), 0)
+                rows = self._query(
+                    "SELECT id, data, start_ts FROM calendar_events"
+                    " WHERE start_ts >= ? AND start_ts < ?"
+                    " AND (start_ts > ? OR (start_ts = ? AND id > ?))"
+                    " ORDER BY start_ts, id LIMIT ?",
+                    (low, high, after_ts, after_ts, after_id, SCAN_BATCH_SIZE)
+                )
+            else:
+                rows = self._query(
+                    "SELECT id, data FROM calendar_events WHERE id > ? ORDER BY id LIMIT ?",
+                    (after if after is not None else 0, SCAN_BATCH_SIZE)
+                )
+            for row in rows:
+                yield self._decode(row)
+            if len(rows) < SCAN_BATCH_SIZE:
+                return
+            after = (rows[-1][2], rows[-1][0]) if by_start else rows[-1][0]
+
+
+def load_event_store(spec, **options):
+    """
+    Build a store from "sqlite" (the default), "memory" or a "module:ClassName" spec
+    """
+    if not spec or spec == "sqlite":
+        return SQLiteEventStore(**options)
+    if spec == "memory":
+        return MemoryEventStore(change_retention=options.get("change_retention", CHANGE_RETENTION))
+    module_name, _, class_name = spec.partition(":")
+    store_class = getattr(importlib.import_module(module_name), class_name)
+    return store_class(**options)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_event_store():
+    """
+    Return the process-wide event store shared by the calendar handlers
+
+    CALENDAR_STORE picks the backend and CALENDAR_DB_PATH the SQLite file;
+    point every instance at the same path to share one dataset.
+    CALENDAR_CHANGE_RETENTION is how many seconds the change log keeps.
+    """
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                default_path = os.path.join("/tmp" if os.environ.get("VERCEL_ENV") else "data", "calendar.sqlite3")
+                _store = load_event_store(
+                    os.environ.get("CALENDAR_STORE", "sqlite"),
+                    path=os.environ.get("CALENDAR_DB_PATH", default_path),
+                    change_retention=float(os.environ.get("CALENDAR_CHANGE_RETENTION", CHANGE_RETENTION)),
+                )
+    return _store
@@ -0,0 +1,40 @@
+"""
+ISO 8601 parsing shared by the calendar store and recurrence expansion.
+"""
+
+from datetime import datetime, timezone
+
+
+class InvalidTime(ValueError):
+    """Raised for a start_time or range bound that isn't an ISO 8601 date-time"""
+
+
+def is_date_only(value):
+    """True for an all-day value like 2024-06-01"""
+    return isinstance(value, str) and len(value.strip()) == 10
+
+
+def parse_datetime(value):
+    """Return an ISO 8601 date or date-time as a datetime, naive if it has no offset"""
+    if not isinstance(value, str):
+        raise InvalidTime(f"Expected an ISO 8601 date-time, got {value!r}")
+    text = value.strip()
+    if text.endswith(("Z", "z")):
+        # fromisoformat only accepts a Z suffix from Python 3.11
+        text = text[:-1] + "+00:00"
+    try:
+        return datetime.fromisoformat(text)
+    except ValueError:
+        raise InvalidTime(f"Expected an ISO 8601 date-time, got {value!r}")
+
+
+def parse_time(value):
+    """
+    Return an ISO 8601 date or date-time as a UTC timestamp
+
+    Values without an offset are taken to be UTC.
+    """
+    parsed = parse_datetime(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
@@ -1,10 +1,23 @@
 import json
+import sys
 from http.server import BaseHTTPRequestHandler
+from pathlib import Path
 from urllib.parse import parse_qs, urlparse
 
-# In-memory storage for calendar events (in a real app, this would be a database)
-events = []
+# Make the project root importable when Vercel loads this file on its own
+sys.path.append(str(Path(__file__).parent.parent))
 
+from api.calendar.availability import handle_conflicts, handle_free_busy
+from api.calendar.bulk import handle_bulk_import, handle_export
+from api.calendar.changes import handle_change_stream, handle_changes
+from api.calendar.listing import send_event_listing
+from api.calendar.store import InvalidTime, get_event_store
+from profiling import profile_handler_methods
+
+# Shared with the handler in api/calendar/index.py
+events = get_event_store()
+
+@profile_handler_methods
 class handler(BaseHTTPRequestHandler):
     def do_GET(self):
         """Handle GET requests"""
@@ -21,24 +34,42 @@ class handler(BaseHTTPRequestHandler):
                 'message': 'API is working!',
                 'endpoints': [
                     '/api',
-                    '/api/calendar'
+                    '/api/calendar',
+                    '/api/calendar/bulk',
+                    '/api/calendar/export',
+                    '/api/calendar/free-busy',
+                    '/api/calendar/conflicts',
+                    '/api/calendar/changes',
+                    '/api/calendar/changes/stream'
                 ]
             }).encode())
             return
             
+        # Stream every event out as NDJSON or iCalendar
+        if path == '/calendar/export':
+            handle_export(self, events, query_params)
+            return
+
+        # Busy and free time, and events overlapping a time, from the interval index
+        if path == '/calendar/free-busy':
+            handle_free_busy(self, events, query_params)
+            return
+        if path == '/calendar/conflicts':
+            handle_conflicts(self, events, query_params)
+            return
+
+        # What changed since a sync token, answered once or pushed as server-sent events
+        if path == '/calendar/changes':
+            handle_changes(self, events, query_params)
+            return
+        if path == '/calendar/changes/stream':
+            handle_change_stream(self, events, query_params)
+            return
+
         # Calendar endpoint
         if path == '/calendar':
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            
-            # Filter by event_id if provided
-            if 'id' in query_params:
-                event_id = query_params['id'][0]
-                filtered_events = [event for event in events if event.get('id') == event_id]
-                self.wfile.write(json.dumps(filtered_events).encode())
-            else:
-                self.wfile.write(json.dumps(events).encode())
+            # Filter by event_id or by a start_time range, page and project fields if asked
+            send_event_listing(self, events, query_params)
             return
             
         # Default: Not found
@@ -54,7 +85,12 @@ class handler(BaseHTTPRequestHandler):
         """Handle POST requests"""
         url_parts = urlparse(self.path)
         path = url_parts.path
-        
+
+        # Import many events from an NDJSON or iCalendar body
+        if path == '/calendar/bulk':
+            handle_bulk_import(self, events, parse_qs(url_parts.query))
+            return
+
         # Calendar endpoint
         if path == '/calendar':
             content_length = int(self.headers['Content-Length'])
@@ -73,9 +109,7 @@ class handler(BaseHTTPRequestHandler):
                     }).encode())
                     return
                 
-                # Generate a simple ID (in a real app, use UUID or database-generated ID)
-                event_data['id'] = str(len(events) + 1)
-                events.append(event_data)
+                event_data = events.add(event_data)
                 
                 self.send_response(201)
                 self.send_header('Content-type', 'application/json')
@@ -88,6 +122,12 @@ class handler(BaseHTTPRequestHandler):
                 self.end_headers()
                 self.wfile.write(json.dumps({'error': 'Invalid JSON'}).encode())
                 return
+            except InvalidTime as e:
+                self.send_response(400)
+                self.send_header('Content-type', 'application/json')
+                self.end_headers()
+                self.wfile.write(json.dumps({'error': str(e)}).encode())
+                return
         
         # Default: Not found
         self.send_response(404)
@@ -1,54 +1,107 @@
 import os
-import json
-import subprocess
+import shutil
+import threading
 from flask import Blueprint, request, jsonify
+from metrics import REGISTRY
+from profiling import profile_flask_view
+from api.mcp_cache import McpResponseCache, load_method_classes, parse_ttls
+from api.mcp_pool import McpTimeout, McpWorkerError, get_worker_pool
 
 mcp_blueprint = Blueprint('mcp', __name__, url_prefix='/api')
 
+CACHE_STATS = REGISTRY.gauge("calai_cache_stat", "Counters and sizes reported by the caches", ("cache", "stat"))
+
+_mcp_cache = None
+_mcp_cache_lock = threading.Lock()
+
+
+def get_mcp_pool():
+    """
+    Return the pool of MCP worker processes, configured from the environment.
+    """
+    mcp_node_path = os.environ.get('MCP_NODE_PATH') or shutil.which('node') or '/usr/local/bin/node'
+    mcp_script_path = os.environ.get('VERCEL_MCP_SCRIPT', 'vercel-mcp/dist/index.js')
+    return get_worker_pool(
+        [mcp_node_path, mcp_script_path],
+        size=int(os.environ.get('MCP_POOL_SIZE', '2')),
+        request_timeout=float(os.environ.get('MCP_REQUEST_TIMEOUT', '30')),
+        health_interval=float(os.environ.get('MCP_HEALTH_INTERVAL', '30')),
+        health_timeout=float(os.environ.get('MCP_HEALTH_TIMEOUT', '5')),
+    )
+
+
+def get_mcp_cache():
+    """
+    Return the MCP response cache, classifying tools from the schema next to the MCP script.
+    """
+    global _mcp_cache
+    if _mcp_cache is None:
+        with _mcp_cache_lock:
+            if _mcp_cache is None:
+                mcp_script_path = os.environ.get('VERCEL_MCP_SCRIPT', 'vercel-mcp/dist/index.js')
+                schema_path = os.environ.get('MCP_SCHEMA_PATH') or os.path.join(os.path.dirname(mcp_script_path), 'schema.json')
+                _mcp_cache = McpResponseCache(
+                    load_method_classes(schema_path),
+                    default_ttl=float(os.environ.get('MCP_CACHE_TTL', '30')),
+                    ttls=parse_ttls(os.environ.get('MCP_CACHE_TTLS')),
+                    max_entries=int(os.environ.get('MCP_CACHE_MAX_ENTRIES', '512')),
+                )
+    return _mcp_cache
+
+
+@REGISTRY.on_collect
+def collect_mcp_cache_metrics():
+    """Copy MCP cache stats into gauges at scrape time"""
+    if _mcp_cache is not None:
+        for stat, value in _mcp_cache.stats().items():
+            CACHE_STATS.set(value, cache="mcp", stat=stat)
+
+
 @mcp_blueprint.route('/mcp', methods=['POST'])
+@profile_flask_view
 def handle_mcp_request():
     """
-    Handle MCP requests and forward them to the MCP script.
+    Handle MCP requests and forward them to a pooled MCP worker.
     """
     try:
-        # Get the MCP script path from environment variables
-        mcp_node_path = os.environ.get('MCP_NODE_PATH', '/usr/local/bin/node')
-        mcp_script_path = os.environ.get('VERCEL_MCP_SCRIPT', 'vercel-mcp/dist/index.js')
-        
         # Get the request data
         request_data = request.get_json()
         if not request_data:
             return jsonify({"error": "No request data provided"}), 400
-        
-        # Convert the request data to a JSON string
-        request_json = json.dumps(request_data)
-        
-        # Execute the MCP script with the request data
-        result = subprocess.run(
-            [mcp_node_path, mcp_script_path],
-            input=request_json.encode(),
-            capture_output=True,
-            text=True
-        )
-        
-        # Check if the script executed successfully
-        if result.returncode != 0:
-            return jsonify({
-                "error": "MCP script execution failed",
-                "stderr": result.stderr
-            }), 500
-        
-        # Parse the response
+        if not isinstance(request_data, dict) or not request_data.get('method'):
+            return jsonify({"error": "MCP request must be an object with a method"}), 400
+
         try:
-            response_data = json.loads(result.stdout)
-            return jsonify(response_data)
-        except json.JSONDecodeError:
+            response_data, cache_outcome = get_mcp_cache().call(request_data, get_mcp_pool().request)
+        except McpTimeout as e:
+            return jsonify({"error": str(e)}), 504
+        except McpWorkerError as e:
             return jsonify({
-                "error": "Failed to parse MCP response",
-                "stdout": result.stdout
+                "error": "MCP script execution failed",
+                "stderr": e.stderr
             }), 500
-    
+
+        response = jsonify(response_data)
+        response.headers['X-MCP-Cache'] = cache_outcome
+        return response
+
     except Exception as e:
         return jsonify({
             "error": f"MCP request failed: {str(e)}"
-        }), 500 
\ No newline at end of file
+        }), 500
+
+
+@mcp_blueprint.route('/mcp/workers', methods=['GET'])
+def mcp_worker_stats():
+    """
+    Report the state of the MCP worker pool.
+    """
+    return jsonify(get_mcp_pool().stats())
+
+
+@mcp_blueprint.route('/mcp/cache', methods=['GET'])
+def mcp_cache_stats():
+    """
+    Report MCP response cache hit/miss stats.
+    """
+    return jsonify(get_mcp_cache().stats())
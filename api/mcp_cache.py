@@ -0,0 +1,172 @@
+"""
+Response cache for read-only MCP tool calls.
+
+Tool methods are classified from the MCP schema by their verb: list_* and
+get_* only read from Vercel and are cached, every other tool changes
+something, as does any method the schema doesn't list. A cached entry is keyed by the method plus its canonicalized
+params and lives for the method's TTL. Any mutating call drops every cached
+entry, since e.g. deleting a project also changes its deployments, domains
+and environment variables.
+"""
+
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from structured_logging import get_logger
+
+log = get_logger('mcp')
+
+CACHEABLE_VERBS = ("list", "get")
+METHOD_PREFIX = "mcp__"
+
+CACHEABLE = "cacheable"
+MUTATING = "mutating"
+
+
+def load_method_classes(schema_path):
+    """
+    Map each tool in the MCP schema to CACHEABLE or MUTATING
+
+    Returns an empty map if the schema can't be read, which leaves every
+    call uncached.
+    """
+    try:
+        with open(schema_path, encoding="utf-8") as f:
+            functions = json.load(f).get("functions", [])
+    except (OSError, ValueError, AttributeError) as e:
+        log.warning("mcp_schema_unavailable", path=schema_path, error=str(e))
+        return {}
+
+    classes = {}
+    for function in functions:
+        name = function.get("name")
+        if not name:
+            continue
+        verb = name[len(METHOD_PREFIX):] if name.startswith(METHOD_PREFIX) else name
+        verb = verb.split("_", 1)[0]
+        classes[name] = CACHEABLE if verb in CACHEABLE_VERBS else MUTATING
+    return classes
+
+
+def parse_ttls(value):
+    """Parse per-method TTL overrides, e.g. "mcp__list_env=10,mcp__list_projects=120" """
+    ttls = {}
+    for item in (value or "").split(","):
+        method, _, seconds = item.partition("=")
+        try:
+            ttls[method.strip()] = float(seconds)
+        except ValueError:
+            continue
+    return ttls
+
+
+def cache_key(method, params):
+    """Canonical key for a call: key order, whitespace and a missing params don't matter"""
+    return json.dumps([method, params or {}], sort_keys=True, separators=(",", ":"))
+
+
+class McpResponseCache:
+    """
+    Bounded LRU of successful responses to cacheable MCP calls
+    """
+
+    def __init__(self, method_classes, default_ttl=30, ttls=None, max_entries=512):
+        self.method_classes = method_classes
+        self.default_ttl = default_ttl
+        self.ttls = ttls or {}
+        self.max_entries = max_entries
+
+        self._entries = OrderedDict()  # key -> (response, expires_at)
+        self._lock = threading.Lock()
+        # Bumped by every mutation; a read that overlapped one isn't stored
+        self._generation = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.mutations = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    def classify(self, method):
+        """Return CACHEABLE or MUTATING; a method the schema doesn't mark as cacheable may change anything"""
+        return CACHEABLE if self.method_classes.get(method) == CACHEABLE else MUTATING
+
+    def ttl_for(self, method):
+        return self.ttls.get(method, self.default_ttl)
+
+    def call(self, request_data, send):
+        """
+        Answer request_data from the cache or by calling send(request_data)
+
+        Returns (response, outcome) where outcome is "hit", "miss" or "bypass".
+        The cached response is returned with the caller's id.
+        """
+        method = request_data.get("method")
+        kind = self.classify(method)
+
+        if kind == MUTATING:
+            with self._lock:
+                self.mutations += 1
+            self.invalidate(method)
+            try:
+                return send(request_data), "bypass"
+            finally:
+                # Reads that started while the mutation ran may have seen the old state
+                self.invalidate(method)
+
+        if self.ttl_for(method) <= 0:
+            with self._lock:
+                self.bypassed += 1
+            return send(request_data), "bypass"
+
+        key = cache_key(method, request_data.get("params"))
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return dict(entry[0], id=request_data.get("id")), "hit"
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            generation = self._generation
+
+        response = send(request_data)
+        # Errors (including "not found") are not cached
+        if isinstance(response, dict) and "result" in response and "error" not in response:
+            with self._lock:
+                if generation == self._generation:
+                    self._entries[key] = (response, time.time() + self.ttl_for(method))
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+                        self.evictions += 1
+        return response, "miss"
+
+    def invalidate(self, method=None):
+        """Drop every cached response"""
+        with self._lock:
+            self._generation += 1
+            if self._entries:
+                self.invalidations += 1
+                log.debug("mcp_cache_invalidated", method=method, entries=len(self._entries))
+            self._entries.clear()
+
+    def stats(self):
+        """Return hit/miss counters and the current size"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "bypassed": self.bypassed,
+                "mutations": self.mutations,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "invalidations": self.invalidations,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+            }
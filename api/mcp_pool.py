@@ -0,0 +1,322 @@
+"""
+Pool of long-lived MCP worker processes.
+
+Each worker runs the Vercel MCP script once and keeps talking to it over
+stdio, one JSON message per line. Requests from concurrent callers share a
+worker: each gets an internal id, and a reader thread hands every response
+line to the caller waiting on that id. Workers that exit are replaced; a
+worker that lets a request time out and then fails a health check
+("mcp.init") is killed and replaced as well.
+"""
+
+import atexit
+import itertools
+import json
+import subprocess
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+from metrics import REGISTRY
+from structured_logging import get_logger
+
+log = get_logger('mcp')
+
+WORKER_RESTARTS = REGISTRY.counter(
+    "calai_mcp_worker_restarts_total", "MCP worker processes replaced", ("reason",)
+)
+MCP_REQUESTS = REGISTRY.counter(
+    "calai_mcp_requests_total", "Requests sent to MCP workers", ("outcome",)
+)
+
+# The MCP script always answers mcp.init with this id
+HEALTH_CHECK_ID = "init"
+
+
+class McpWorkerError(Exception):
+    """Raised when a worker dies or can't be written to while a request is pending"""
+
+    def __init__(self, message, stderr=""):
+        super().__init__(message)
+        self.stderr = stderr
+
+
+class McpTimeout(Exception):
+    """Raised when a worker doesn't answer a request in time"""
+
+
+class McpWorker:
+    """
+    One MCP process plus the threads that read its stdout and stderr
+    """
+
+    def __init__(self, command):
+        self.command = command
+        self.started_at = time.time()
+        self.completed = 0
+        self._ids = itertools.count(1)
+        self._pending = {}         # internal id -> Future
+        self._health = None        # Future of the outstanding mcp.init, if any
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._stderr = deque(maxlen=50)
+        self._closed = False
+
+        self.process = subprocess.Popen(
+            command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        threading.Thread(target=self._read_stdout, name="mcp-stdout", daemon=True).start()
+        threading.Thread(target=self._read_stderr, name="mcp-stderr", daemon=True).start()
+
+    @property
+    def alive(self):
+        return not self._closed and self.process.poll() is None
+
+    @property
+    def in_flight(self):
+        with self._lock:
+            return len(self._pending)
+
+    def stderr_tail(self):
+        return "\n".join(self._stderr)
+
+    def _read_stdout(self):
+        for line in self.process.stdout:
+            try:
+                message = json.loads(line)
+            except ValueError:
+                log.debug("mcp_unparseable_output", line=line[:200].decode(errors="replace"))
+                continue
+            message_id = message.get("id") if isinstance(message, dict) else None
+            with self._lock:
+                if message_id == HEALTH_CHECK_ID:
+                    future, self._health = self._health, None
+                else:
+                    future = self._pending.pop(message_id, None)
+            if future is not None and not future.done():
+                future.set_result(message)
+        self._fail_pending(McpWorkerError("MCP worker exited", self.stderr_tail()))
+
+    def _read_stderr(self):
+        for line in self.process.stderr:
+            text = line.decode(errors="replace").rstrip()
+            self._stderr.append(text)
+            log.debug("mcp_stderr", pid=self.process.pid, line=text)
+
+    def _fail_pending(self, error):
+        with self._lock:
+            futures = list(self._pending.values())
+            self._pending.clear()
+            if self._health is not None:
+                futures.append(self._health)
+                self._health = None
+        for future in futures:
+            if not future.done():
+                future.set_exception(error)
+
+    def _send(self, message):
+        data = (json.dumps(message) + "\n").encode()
+        try:
+            with self._write_lock:
+                self.process.stdin.write(data)
+                self.process.stdin.flush()
+        except (BrokenPipeError, OSError, ValueError) as e:
+            raise McpWorkerError(f"Failed to write to MCP worker: {str(e)}", self.stderr_tail())
+
+    def submit(self, request_data):
+        """Send a request under a fresh internal id and return a Future of the reply"""
+        if request_data.get("method") == "mcp.init":
+            # The script answers init under a fixed id, so it rides on the health check
+            return self._health_check()
+        internal_id = next(self._ids)
+        future = Future()
+        with self._lock:
+            self._pending[internal_id] = future
+        try:
+            self._send(dict(request_data, id=internal_id))
+        except McpWorkerError:
+            with self._lock:
+                self._pending.pop(internal_id, None)
+            raise
+        future.internal_id = internal_id
+        return future
+
+    def forget(self, future):
+        """Stop waiting for a request that timed out"""
+        internal_id = getattr(future, "internal_id", None)
+        if internal_id is not None:
+            with self._lock:
+                self._pending.pop(internal_id, None)
+
+    def _health_check(self):
+        """Send mcp.init, or join the one already in flight, and return its Future"""
+        with self._lock:
+            future = self._health
+            if future is not None:
+                return future
+            future = self._health = Future()
+        try:
+            self._send({"id": HEALTH_CHECK_ID, "method": "mcp.init"})
+        except McpWorkerError:
+            with self._lock:
+                if self._health is future:
+                    self._health = None
+            raise
+        return future
+
+    def ping(self, timeout):
+        """Return True if the worker answers mcp.init within timeout seconds"""
+        if not self.alive:
+            return False
+        try:
+            self._health_check().result(timeout)
+            return True
+        except (McpWorkerError, FutureTimeoutError):
+            return False
+
+    def close(self):
+        self._closed = True
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=2)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        self._fail_pending(McpWorkerError("MCP worker was shut down", self.stderr_tail()))
+
+
+class McpWorkerPool:
+    """
+    Fixed-size set of workers; each request goes to the least busy live one
+    """
+
+    def __init__(self, command, size=2, request_timeout=30.0, health_interval=30.0, health_timeout=5.0):
+        self.command = command
+        self.size = max(1, size)
+        self.request_timeout = request_timeout
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+        self._workers = []
+        self._lock = threading.Lock()
+        self._monitor = None
+        self._stopped = threading.Event()
+
+    def _ensure_workers(self):
+        """Replace dead workers and top the pool up to size (caller holds the lock)"""
+        for worker in [w for w in self._workers if not w.alive]:
+            self._workers.remove(worker)
+            WORKER_RESTARTS.inc(reason="exited")
+            log.warning("mcp_worker_exited", pid=worker.process.pid, returncode=worker.process.poll(),
+                        stderr=worker.stderr_tail())
+        while len(self._workers) < self.size:
+            self._workers.append(McpWorker(self.command))
+        if self._monitor is None and self.health_interval > 0:
+            self._monitor = threading.Thread(target=self._monitor_workers, name="mcp-health", daemon=True)
+            self._monitor.start()
+
+    def _pick_worker(self):
+        with self._lock:
+            self._ensure_workers()
+            return min(self._workers, key=lambda worker: worker.in_flight)
+
+    def _replace(self, worker, reason):
+        with self._lock:
+            if worker not in self._workers:
+                return  # Already replaced by another thread
+            self._workers.remove(worker)
+        WORKER_RESTARTS.inc(reason=reason)
+        log.warning("mcp_worker_replaced", pid=worker.process.pid, reason=reason)
+        worker.close()
+
+    def request(self, request_data, timeout=None):
+        """
+        Send one MCP request and return the worker's reply with the caller's id restored
+
+        Raises McpTimeout or McpWorkerError.
+        """
+        timeout = self.request_timeout if timeout is None else timeout
+        worker = self._pick_worker()
+        try:
+            future = worker.submit(request_data)
+        except McpWorkerError:
+            # The worker died between the liveness check and the write; retry once on a fresh one
+            self._replace(worker, "write_failed")
+            worker = self._pick_worker()
+            future = worker.submit(request_data)
+
+        try:
+            reply = future.result(timeout)
+        except FutureTimeoutError:
+            worker.forget(future)
+            MCP_REQUESTS.inc(outcome="timeout")
+            # A slow tool call is not a wedged worker; only replace it if it stopped answering
+            if not worker.ping(self.health_timeout):
+                self._replace(worker, "wedged")
+            raise McpTimeout(f"MCP request timed out after {timeout} seconds")
+        except McpWorkerError:
+            MCP_REQUESTS.inc(outcome="worker_error")
+            raise
+
+        MCP_REQUESTS.inc(outcome="ok")
+        worker.completed += 1
+        reply = dict(reply)
+        reply["id"] = request_data.get("id")
+        return reply
+
+    def _monitor_workers(self):
+        """Periodically health-check idle workers and replace the ones that don't answer"""
+        while not self._stopped.wait(self.health_interval):
+            with self._lock:
+                workers = list(self._workers)
+            for worker in workers:
+                # Busy workers are proving they are alive; only probe idle ones
+                if worker.alive and worker.in_flight == 0 and not worker.ping(self.health_timeout):
+                    self._replace(worker, "health_check")
+            with self._lock:
+                self._ensure_workers()
+
+    def stats(self):
+        with self._lock:
+            workers = list(self._workers)
+        return {
+            "size": self.size,
+            "workers": [
+                {
+                    "pid": worker.process.pid,
+                    "alive": worker.alive,
+                    "in_flight": worker.in_flight,
+                    "completed": worker.completed,
+                    "uptime_seconds": round(time.time() - worker.started_at, 1),
+                }
+                for worker in workers
+            ],
+        }
+
+    def shutdown(self):
+        self._stopped.set()
+        with self._lock:
+            workers, self._workers = self._workers, []
+        for worker in workers:
+            worker.close()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_worker_pool(command, **options):
+    """Return the process-wide pool, starting it on first use"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = McpWorkerPool(command, **options)
+                atexit.register(_pool.shutdown)
+    return _pool
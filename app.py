@@ -1,58 +1,171 @@
 import os
 import base64
+import hmac
+import importlib.util
+import re
+import threading
+import time
+from functools import partial
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
 from io import BytesIO
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Request, Response, g, render_template, request, jsonify, send_file, stream_with_context
 from werkzeug.utils import secure_filename
-import requests
-from dotenv import load_dotenv
-import traceback
-from openai import OpenAI
 import json
+from nutrition_cache import NutrientCache
+from analysis_cache import AnalysisCache, content_hash, perceptual_hash
+from streaming_json import FoodItemStreamParser
+from jobs import JobQueueFull, load_job_backend
+from food_lexicon import CATEGORY_PROFILES, categorize_food
+from metrics import PROMETHEUS_CONTENT_TYPE, REGISTRY, bind_context, current_trace, end_trace, new_trace_id, span, start_trace
+from structured_logging import configure_logging, get_logger
+from profiling import PROFILE_KINDS, get_profiler, profile_flask_view
 
-# Try to import Pillow, but handle failure gracefully
-try:
-    from PIL import Image
-    PILLOW_AVAILABLE = True
-except ImportError:
-    print("Warning: Pillow (PIL) is not available. Image conversion features will be limited.")
-    PILLOW_AVAILABLE = False
+# openai, requests, Pillow and numpy (through nutrients and meal_history) are
+# imported on first use to keep cold starts cheap; for Pillow only check here
+# that it is installed
+PILLOW_AVAILABLE = importlib.util.find_spec("PIL") is not None
 
-# Load environment variables
-load_dotenv()
+# Load environment variables from .env; on Vercel they come from the platform
+if not os.environ.get('VERCEL_ENV'):
+    from dotenv import load_dotenv
+    load_dotenv()
 
-# Configure logging for Vercel
-if os.environ.get('VERCEL_ENV'):
-    import logging
-    logging.basicConfig(level=logging.INFO)
-    logger = logging.getLogger(__name__)
-    logger.info("Running in Vercel environment")
+# Structured logs go to stderr, which Vercel collects; LOG_FORMAT=text for local reading
+configure_logging(os.environ.get('LOG_LEVEL', 'INFO'), os.environ.get('LOG_FORMAT', 'json'))
+log = get_logger('app')
 
 # Ensure required environment variables are set
-required_env_vars = ["OPENAI_API_KEY", "USDA_API_KEY"]
+required_env_vars = ["OPENAI_API_KEY"]
+if os.environ.get('NUTRITION_SOURCE', 'usda') != 'local':
+    required_env_vars.append("USDA_API_KEY")
 missing_vars = [var for var in required_env_vars if not os.getenv(var)]
 if missing_vars:
     error_msg = f"Missing required environment variables: {', '.join(missing_vars)}"
     if os.environ.get('VERCEL_ENV'):
-        print(error_msg)  # Print to Vercel logs
+        log.error("missing_environment", variables=missing_vars)  # Shows up in Vercel logs
     else:
         raise ValueError(error_msg)
 
+class AppRequest(Request):
+    """Request class that allows larger bodies on the batch endpoint"""
+    
+    @property
+    def max_content_length(self):
+        if self.path == '/analyze/batch':
+            return app.config['BATCH_MAX_CONTENT_LENGTH']
+        return app.config['MAX_CONTENT_LENGTH']
+
 # Initialize Flask app
 app = Flask(__name__, static_folder='static')
+app.request_class = AppRequest
 
 # Import and register the MCP blueprint after app is created
 from api.mcp import mcp_blueprint
 app.register_blueprint(mcp_blueprint)
 
+from api.calendar.store import get_event_store
+from api.calendar.times import InvalidTime, parse_time
+
+REQUEST_SECONDS = REGISTRY.histogram(
+    "calai_http_request_duration_seconds", "Time to produce a response", ("endpoint", "method", "status")
+)
+UPSTREAM_REQUESTS = REGISTRY.counter(
+    "calai_upstream_requests_total", "Calls made to OpenAI and USDA FoodData Central", ("upstream",)
+)
+UPSTREAM_ERRORS = REGISTRY.counter(
+    "calai_upstream_errors_total", "Failed calls to OpenAI and USDA FoodData Central", ("upstream", "error")
+)
+PAYLOAD_BYTES = REGISTRY.gauge(
+    "calai_payload_bytes", "Size of the most recent payload at each stage", ("payload",)
+)
+
+# Client-supplied request ids are echoed back only if they look like ids
+TRACE_ID_PATTERN = re.compile(r'^[A-Za-z0-9._:-]{1,128}$')
+
+def trace_requested():
+    """True when the client asked for per-stage timings (?trace=1 or X-Trace: 1)"""
+    flag = request.args.get('trace') or request.headers.get('X-Trace') or ''
+    return flag.lower() in ('1', 'true')
+
+@app.before_request
+def begin_request_trace():
+    """Give the request a trace id (X-Request-ID if sent) and make its trace current"""
+    trace_id = request.headers.get('X-Request-ID', '')
+    if not TRACE_ID_PATTERN.match(trace_id):
+        trace_id = new_trace_id()
+    g.trace = start_trace(trace_id, record_spans=trace_requested())
+
+@app.after_request
+def finish_request_trace(response):
+    """Echo the trace id, add Server-Timing when tracing, and record the request latency"""
+    trace = g.get('trace')
+    if trace is None:
+        return response
+    response.headers['X-Request-ID'] = trace.trace_id
+    if trace.record_spans:
+        response.headers['Server-Timing'] = trace.server_timing()
+    REQUEST_SECONDS.observe(
+        time.perf_counter() - trace.started,
+        endpoint=request.url_rule.rule if request.url_rule else 'unmatched',
+        method=request.method,
+        status=response.status_code
+    )
+    return response
+
+@app.teardown_request
+def clear_request_trace(error=None):
+    end_trace()
+
+def with_trace(result):
+    """Attach the request's spans to a JSON result when the client asked for them"""
+    trace = current_trace()
+    if trace is None or not trace.record_spans:
+        return result
+    return dict(result, trace=trace.to_dict())
+
 @app.route('/')
 def index():
     try:
         return render_template('index.html')
     except Exception as e:
-        print(f"Error serving index: {str(e)}")
-        traceback.print_exc()
+        log.exception("index_render_failed", error=str(e))
         return app.send_static_file('index.html')
 
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus scrape endpoint; set METRICS_TOKEN to require a bearer token"""
+    token = app.config['METRICS_TOKEN']
+    if token and request.headers.get('Authorization') != f"Bearer {token}":
+        return jsonify(error="Unauthorized"), 401
+    return Response(REGISTRY.render(), content_type=PROMETHEUS_CONTENT_TYPE)
+
+def admin_authorized():
+    """True when the request carries the PROFILE_ADMIN_TOKEN bearer token (never if unset)"""
+    token = app.config['PROFILE_ADMIN_TOKEN']
+    return bool(token) and hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {token}")
+
+@app.route('/admin/profiles')
+def list_profiles():
+    """List stored request profiles, newest first"""
+    if not admin_authorized():
+        return jsonify(error="Unauthorized"), 401
+    return jsonify(profiles=get_profiler().store.list())
+
+@app.route('/admin/profiles/<profile_id>/<kind>')
+def download_profile(profile_id, kind):
+    """Download one file of a stored profile: pstats, collapsed or summary"""
+    if not admin_authorized():
+        return jsonify(error="Unauthorized"), 401
+    path = get_profiler().store.path_for(profile_id, kind)
+    if path is None:
+        return jsonify(error="Profile not found"), 404
+    return send_file(
+        os.path.abspath(path),
+        mimetype=PROFILE_KINDS[kind][1],
+        as_attachment=True,
+        download_name=os.path.basename(path)
+    )
+
 @app.route('/api/debug')
 def debug_info():
     """Return debug information about the environment"""
@@ -68,399 +181,548 @@ def debug_info():
             "template_folder": app.template_folder,
             "static_exists": os.path.exists(app.static_folder) if app.static_folder else False,
             "templates_exist": os.path.exists(app.template_folder) if app.template_folder else False,
-        }
+        },
+        "nutrient_cache": nutrient_cache.stats(),
+        "analysis_cache": analysis_cache.stats(),
+        "analysis_jobs": get_job_backend().stats()
     }
     return jsonify(debug_data)
 
 @app.errorhandler(500)
 def server_error(e):
     error_msg = str(e)
-    print(f"Server error: {error_msg}")
-    traceback.print_exc()
+    log.exception("server_error", error=error_msg)
     return jsonify(error=error_msg), 500
 
-# Set upload folder based on environment
-app.config['UPLOAD_FOLDER'] = '/tmp' if os.environ.get('VERCEL_ENV') else 'uploads'
+# Uploads are processed in memory and never written to disk
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max upload size
+app.config['BATCH_MAX_CONTENT_LENGTH'] = int(os.environ.get('BATCH_MAX_CONTENT_LENGTH', str(256 * 1024 * 1024)))
+app.config['BATCH_MAX_WORKERS'] = int(os.environ.get('BATCH_MAX_WORKERS', '4'))
+# Asynchronous analysis jobs; ANALYSIS_JOB_BACKEND is a "module:ClassName" spec, empty for in-process
+app.config['ANALYSIS_JOB_BACKEND'] = os.environ.get('ANALYSIS_JOB_BACKEND', '')
+app.config['ANALYSIS_JOB_WORKERS'] = int(os.environ.get('ANALYSIS_JOB_WORKERS', '4'))
+app.config['ANALYSIS_JOB_MAX_PENDING'] = int(os.environ.get('ANALYSIS_JOB_MAX_PENDING', '100'))
+app.config['ANALYSIS_JOB_TTL'] = int(os.environ.get('ANALYSIS_JOB_TTL', '3600'))  # seconds results are kept
 app.config['ALLOWED_EXTENSIONS'] = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
-print(f"Allowed extensions set to: {app.config['ALLOWED_EXTENSIONS']}")
-print(f"Upload folder set to: {app.config['UPLOAD_FOLDER']}")
-
-# Create uploads folder if it doesn't exist and we're not in Vercel
-if not os.environ.get('VERCEL_ENV'):
-    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+# Images are downscaled and re-encoded as JPEG before being sent to the vision model
+app.config['VISION_PREPROCESS'] = os.environ.get('VISION_PREPROCESS', 'true').lower() == 'true'
+app.config['VISION_MAX_SIDE'] = int(os.environ.get('VISION_MAX_SIDE', '1024'))  # pixels
+app.config['VISION_JPEG_QUALITY'] = int(os.environ.get('VISION_JPEG_QUALITY', '85'))
+app.config['USDA_TIMEOUT'] = float(os.environ.get('USDA_TIMEOUT', '10'))  # seconds per lookup
+app.config['USDA_MAX_WORKERS'] = int(os.environ.get('USDA_MAX_WORKERS', '8'))
+# Where nutrient values come from: 'usda' (search API) or 'local' (FDC index built with fdc_index.py)
+app.config['NUTRITION_SOURCE'] = os.environ.get('NUTRITION_SOURCE', 'usda')
+app.config['FDC_INDEX_PATH'] = os.environ.get('FDC_INDEX_PATH', os.path.join('data', 'fdc_index.sqlite3'))
+app.config['NUTRIENT_CACHE_PATH'] = os.environ.get(
+    'NUTRIENT_CACHE_PATH',
+    os.path.join('/tmp' if os.environ.get('VERCEL_ENV') else 'cache', 'nutrients.sqlite3')
+)
+app.config['NUTRIENT_CACHE_TTL'] = int(os.environ.get('NUTRIENT_CACHE_TTL', str(7 * 24 * 3600)))
+app.config['NUTRIENT_CACHE_MAX_ENTRIES'] = int(os.environ.get('NUTRIENT_CACHE_MAX_ENTRIES', '50000'))
+app.config['NUTRIENT_CACHE_MEMORY_ENTRIES'] = int(os.environ.get('NUTRIENT_CACHE_MEMORY_ENTRIES', '1024'))
+app.config['ANALYSIS_CACHE_MAX_ENTRIES'] = int(os.environ.get('ANALYSIS_CACHE_MAX_ENTRIES', '256'))
+app.config['ANALYSIS_CACHE_TTL'] = int(os.environ.get('ANALYSIS_CACHE_TTL', '3600'))
+# Opt-in: also match re-encoded near-duplicates by perceptual hash (max differing bits out of 64).
+# The cache is shared, so a similar-looking photo from someone else could get its analysis
+app.config['ANALYSIS_CACHE_PHASH'] = os.environ.get('ANALYSIS_CACHE_PHASH', 'false').lower() == 'true'
+app.config['ANALYSIS_CACHE_PHASH_DISTANCE'] = int(os.environ.get('ANALYSIS_CACHE_PHASH_DISTANCE', '4'))
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN', '')
+# Profiling itself is configured by PROFILE_* variables read in profiling.py
+app.config['PROFILE_ADMIN_TOKEN'] = os.environ.get('PROFILE_ADMIN_TOKEN', '')
+# Saved meals and their daily/weekly rollups (see meal_history.py)
+app.config['MEAL_HISTORY_PATH'] = os.environ.get(
+    'MEAL_HISTORY_PATH',
+    os.path.join('/tmp' if os.environ.get('VERCEL_ENV') else 'data', 'meals.sqlite3')
+)
 
 def allowed_file(filename):
     """Check if file has an allowed extension"""
     if '.' not in filename:
         return False
     ext = filename.rsplit('.', 1)[1].lower()
-    # Print all allowed extensions for debugging
-    print(f"Checking extension: '{ext}' against allowed extensions: {app.config['ALLOWED_EXTENSIONS']}")
     is_allowed = ext in app.config['ALLOWED_EXTENSIONS']
     # Add special case for webp since it might be problematic
     if ext == 'webp' and not is_allowed:
-        print("WebP file detected but not in allowed extensions!")
+        log.warning("webp_not_allowed")
     return is_allowed
 
-def analyze_image_with_gpt_vision(image_data):
+class VisionResponseError(Exception):
+    """Raised when the vision model's reply doesn't contain parseable JSON"""
+    
+    def __init__(self, message, raw_response):
+        super().__init__(message)
+        self.raw_response = raw_response
+
+# Prompt for GPT Vision with step-by-step instructions
+VISION_PROMPT = """
+    You are an expert nutritionist and food analyst with access to detailed food databases. I need you to analyze this food image methodically:
+    
+    STEP 1: IDENTIFY ALL FOODS
+    - List each distinct food item visible in the image
+    - Be specific about varieties, cooking methods, and visible ingredients
+    - Note visible condiments, sauces, or toppings
+
+    STEP 2: ESTIMATE PORTION SIZES
+    - First, estimate the approximate diameter of the plate/container in inches
+    - For each food identified in Step 1, estimate:
+      * The volume (in cups, tablespoons) or weight (in ounces) as appropriate
+      * Use the plate size as a reference
+      * Consider portion depth for foods like rice, pasta, etc.
+
+    STEP 3: DETAILED FOOD DESCRIPTIONS
+    - For each food, create a standardized description that includes:
+      * The specific food name (e.g., "brown rice" not just "rice")
+      * Preparation method if visible (baked, fried, grilled, etc.)
+      * Visual cues about ingredients (seasonings, oils, etc.)
+    
+    Format your response as a structured JSON object:
+    {
+      "plate_size": "estimated diameter in inches",
+      "food_items": [
+        {
+          "name": "specific food name",
+          "description": "detailed description",
+          "preparation": "cooking method if identifiable",
+          "quantity": "numerical value",
+          "unit": "oz, cups, tbsp, etc.",
+          "confidence": "high/medium/low"
+        },
+        // repeat for each food item
+      ],
+      "meal_description": "brief overall description of the meal"
+    }
+
+    Be as precise and detailed as possible in your identification and measurements.
     """
-    Send the image to GPT Vision API and get nutritional analysis
+
+def parse_food_analysis(response_text):
+    """
+    Extract the food analysis JSON object from the vision model's reply
     """
-    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    PAYLOAD_BYTES.set(len(response_text), payload='vision_reply')
     
+    # Try to find JSON in the response
     try:
-        # Convert image data to base64
-        if isinstance(image_data, str):  # If it's a file path
-            print(f"Processing image from file path: {image_data}")
-            try:
-                with open(image_data, "rb") as image_file:
-                    image_content = image_file.read()
-                    print(f"Successfully read image file: {len(image_content)} bytes")
-                    encoded_image = base64.b64encode(image_content).decode('utf-8')
-            except Exception as file_error:
-                print(f"Error reading image file: {str(file_error)}")
-                raise
-        else:  # If it's already binary data
-            print(f"Processing binary image data: {len(image_data)} bytes")
-            encoded_image = base64.b64encode(image_data).decode('utf-8')
-            
-        print(f"Successfully encoded image to base64: {len(encoded_image)} chars")
-        
-        # Prepare the prompt for GPT Vision with step-by-step instructions
-        prompt = """
-        You are an expert nutritionist and food analyst with access to detailed food databases. I need you to analyze this food image methodically:
-        
-        STEP 1: IDENTIFY ALL FOODS
-        - List each distinct food item visible in the image
-        - Be specific about varieties, cooking methods, and visible ingredients
-        - Note visible condiments, sauces, or toppings
-
-        STEP 2: ESTIMATE PORTION SIZES
-        - First, estimate the approximate diameter of the plate/container in inches
-        - For each food identified in Step 1, estimate:
-          * The volume (in cups, tablespoons) or weight (in ounces) as appropriate
-          * Use the plate size as a reference
-          * Consider portion depth for foods like rice, pasta, etc.
-
-        STEP 3: DETAILED FOOD DESCRIPTIONS
-        - For each food, create a standardized description that includes:
-          * The specific food name (e.g., "brown rice" not just "rice")
-          * Preparation method if visible (baked, fried, grilled, etc.)
-          * Visual cues about ingredients (seasonings, oils, etc.)
-        
-        Format your response as a structured JSON object:
-        {
-          "plate_size": "estimated diameter in inches",
-          "food_items": [
-            {
-              "name": "specific food name",
-              "description": "detailed description",
-              "preparation": "cooking method if identifiable",
-              "quantity": "numerical value",
-              "unit": "oz, cups, tbsp, etc.",
-              "confidence": "high/medium/low"
-            },
-            // repeat for each food item
-          ],
-          "meal_description": "brief overall description of the meal"
-        }
-
-        Be as precise and detailed as possible in your identification and measurements.
-        """
-        
-        print("Sending request to OpenAI API...")
-        
-        response = client.chat.completions.create(
-            model="gpt-4-vision-preview",
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": prompt},
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{encoded_image}"
-                            }
-                        }
-                    ]
-                }
-            ],
-            max_tokens=500
-        )
-        
-        print("Received response from OpenAI API")
-        
-        # Extract and parse JSON from the response
-        response_text = response.choices[0].message.content
-        print(f"Response text length: {len(response_text)} characters")
-        
-        # Try to find JSON in the response
-        try:
+        with span('json_extract'):
             # First try: look for JSON block delimiters
             json_start = response_text.find('{')
             json_end = response_text.rfind('}')
             
             if json_start >= 0 and json_end >= 0:
                 json_str = response_text[json_start:json_end+1]
-                print(f"Extracted JSON string: {len(json_str)} characters")
-                food_analysis = json.loads(json_str)
-            else:
-                # Second try: assume the entire response is valid JSON
-                food_analysis = json.loads(response_text)
+                log.debug("vision_json_extracted", reply_chars=len(response_text), json_chars=len(json_str))
+                return json.loads(json_str)
             
-            # Get nutrition information for each food item
-            print("Successfully parsed JSON response, getting nutrition data...")
-            result = get_nutrition_data(food_analysis)
-            return {
-                "success": True,
-                "data": result
-            }
-                
-        except json.JSONDecodeError as json_error:
-            # If JSON parsing fails, return the raw response
-            print(f"Failed to parse JSON: {str(json_error)}")
-            print(f"Raw response text: {response_text}")
-            return {
-                "success": False,
-                "error": f"Failed to parse GPT Vision response: {str(json_error)}",
-                "raw_response": response_text
-            }
+            # Second try: assume the entire response is valid JSON
+            return json.loads(response_text)
+    
+    except json.JSONDecodeError as json_error:
+        log.warning("vision_json_invalid", error=str(json_error), reply=response_text)
+        raise VisionResponseError(f"Failed to parse GPT Vision response: {str(json_error)}", response_text)
+
+_openai_client = None
+_openai_lock = threading.Lock()
+
+def get_openai_client():
+    """Return the shared OpenAI client, creating it on first use"""
+    global _openai_client
+    if _openai_client is None:
+        with _openai_lock:
+            if _openai_client is None:
+                from openai import OpenAI
+                _openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    return _openai_client
+
+def stream_food_analysis(image_data):
+    """
+    Stream the GPT Vision reply for the image bytes
+    
+    Yields ('item', food_item) for each entry of the food_items array as soon
+    as it has been fully generated, then ('analysis', food_analysis) with the
+    complete parsed reply.
+    """
+    client = get_openai_client()
+    
+    # Convert image data to base64
+    with span('base64_encode'):
+        encoded_image = base64.b64encode(image_data).decode('utf-8')
+    PAYLOAD_BYTES.set(len(image_data), payload='vision_image')
+    PAYLOAD_BYTES.set(len(encoded_image), payload='vision_image_base64')
+    log.debug("openai_request", image_bytes=len(image_data), base64_chars=len(encoded_image))
+    
+    UPSTREAM_REQUESTS.inc(upstream='openai')
+    parser = FoodItemStreamParser()
+    try:
+        # Until the response starts; reading the streamed body is timed as openai_stream
+        with span('openai_request'):
+            stream = client.chat.completions.create(
+                model="gpt-4-vision-preview",
+                messages=[
+                    {
+                        "role": "user",
+                        "content": [
+                            {"type": "text", "text": VISION_PROMPT},
+                            {
+                                "type": "image_url",
+                                "image_url": {
+                                    "url": f"data:{image_mime_type(image_data)};base64,{encoded_image}"
+                                }
+                            }
+                        ]
+                    }
+                ],
+                max_tokens=500,
+                stream=True
+            )
+        
+        with span('openai_stream'):
+            for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    for food_item in parser.feed(delta):
+                        yield 'item', food_item
+    except Exception as e:
+        UPSTREAM_ERRORS.inc(upstream='openai', error=type(e).__name__)
+        raise
+    
+    log.debug("openai_response", reply_chars=len(parser.text))
+    yield 'analysis', parse_food_analysis(parser.text)
+
+def request_food_analysis(image_data):
+    """
+    Send the image bytes to GPT Vision API and return the parsed food analysis
+    """
+    for event, payload in stream_food_analysis(image_data):
+        if event == 'analysis':
+            return payload
+
+def analyze_image_with_gpt_vision(image_data):
+    """
+    Send the image to GPT Vision API and get nutritional analysis
+    
+    Nutrition lookups start while the vision reply is still streaming in.
+    """
+    try:
+        food_analysis = None
+        food_details = {}
+        for event in iter_analysis_events(image_data):
+            if event[0] == 'analysis':
+                food_analysis = event[1]
+                log.debug("vision_analysis_parsed", food_items=len(food_analysis.get("food_items", [])))
+            else:
+                food_details[event[1]] = event[2]
+        
+        food_items = food_analysis.get("food_items", [])
+        result = summarize_nutrition(food_analysis, [food_details[index] for index in range(len(food_items))])
+        if nutrition_uses_estimates():
+            result["note"] = ESTIMATE_NOTE
+        return {
+            "success": True,
+            "data": result
+        }
+    
+    except VisionResponseError as e:
+        # If JSON parsing fails, return the raw response
+        return {
+            "success": False,
+            "error": str(e),
+            "raw_response": e.raw_response
+        }
     
     except Exception as e:
-        print(f"Error analyzing image: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        log.exception("vision_analysis_failed", error=str(e))
         return {
             "success": False,
             "error": str(e)
         }
 
-def get_nutrition_data(food_analysis):
+USDA_SEARCH_URL = "https://api.nal.usda.gov/fdc/v1/foods/search"
+
+# Shared keep-alive session and worker pool for USDA lookups, created on first use
+_usda_session = None
+_usda_executor = None
+_usda_lock = threading.Lock()
+
+def get_usda_session():
+    """Return the shared HTTP session used for USDA FoodData Central requests"""
+    global _usda_session
+    if _usda_session is None:
+        with _usda_lock:
+            if _usda_session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=1,
+                    pool_maxsize=app.config['USDA_MAX_WORKERS']
+                )
+                session.mount("https://", adapter)
+                _usda_session = session
+    return _usda_session
+
+def get_usda_executor():
+    """Return the bounded thread pool that runs USDA lookups"""
+    global _usda_executor
+    if _usda_executor is None:
+        with _usda_lock:
+            if _usda_executor is None:
+                _usda_executor = ThreadPoolExecutor(
+                    max_workers=app.config['USDA_MAX_WORKERS'],
+                    thread_name_prefix="usda-lookup"
+                )
+    return _usda_executor
+
+nutrient_cache = NutrientCache(
+    app.config['NUTRIENT_CACHE_PATH'],
+    ttl=app.config['NUTRIENT_CACHE_TTL'],
+    max_entries=app.config['NUTRIENT_CACHE_MAX_ENTRIES'],
+    memory_entries=app.config['NUTRIENT_CACHE_MEMORY_ENTRIES']
+)
+
+def fetch_usda_nutrients(food_name, api_key):
     """
-    Get nutrition data for each food item using USDA FoodData Central API
+    Search USDA FoodData Central for a food and return its per-100g nutrient vector
+    
+    Returns None when the search has no match; raises on HTTP errors.
     """
-    # Initialize nutrition totals
-    total_nutrition = {
-        "calories": 0,
-        "proteins": 0,
-        "fats": 0,
-        "carbs": 0
+    params = {
+        "api_key": api_key,
+        "query": food_name,
+        "dataType": ["Foundation", "SR Legacy"],
+        "pageSize": 1
     }
     
+    UPSTREAM_REQUESTS.inc(upstream='usda')
+    try:
+        with span('usda_request'):
+            response = get_usda_session().get(
+                USDA_SEARCH_URL,
+                params=params,
+                timeout=app.config['USDA_TIMEOUT']
+            )
+            response.raise_for_status()
+            data = response.json()
+    except Exception as e:
+        status = getattr(getattr(e, 'response', None), 'status_code', None)
+        UPSTREAM_ERRORS.inc(upstream='usda', error=str(status) if status else type(e).__name__)
+        raise
+    
+    if not data.get("foods"):
+        return None
+    
+    food_data = data["foods"][0]
+    
+    # Get nutrient values
+    from nutrients import vector_from_food_nutrients
+    return vector_from_food_nutrients(food_data.get("foodNutrients", []))
+
+def lookup_food_item(food_item, api_key):
+    """
+    Look up a single food item in USDA FoodData Central, falling back to an estimate
+    
+    Per-100g values are served from the nutrient cache when available.
+    """
+    from nutrients import FoodNutrition, vector_from_json, vector_to_json
+    food_name = food_item.get("name", "")
+    
+    try:
+        # Entries written under another nutrient schema read as misses
+        per_100g = vector_from_json(nutrient_cache.get(food_name))
+        if per_100g is None:
+            per_100g = fetch_usda_nutrients(food_name, api_key)
+            if per_100g is None:
+                # If food not found, estimate
+                return estimate_food_item(food_item)
+            nutrient_cache.set(food_name, vector_to_json(per_100g))
+        
+        return FoodNutrition.for_food_item(food_item, per_100g)
+    
+    except Exception as e:
+        log.warning("usda_lookup_failed", food=food_name, error=str(e))
+        # On API error, estimate nutrients
+        return estimate_food_item(food_item)
+
+_food_index = None
+
+def get_food_index():
+    """Open the local FoodData Central index on first use"""
+    global _food_index
+    if _food_index is None:
+        with _usda_lock:
+            if _food_index is None:
+                from fdc_index import FoodIndex
+                _food_index = FoodIndex(app.config['FDC_INDEX_PATH'])
+    return _food_index
+
+def lookup_local_food_item(food_item):
+    """
+    Resolve a single food item against the local FoodData Central index
+    """
+    from nutrients import FoodNutrition
+    food_name = food_item.get("name", "")
+    
+    try:
+        with span('fdc_index_lookup'):
+            per_100g = get_food_index().lookup(food_name)
+        if per_100g is None:
+            # If food not found, estimate
+            return estimate_food_item(food_item)
+        return FoodNutrition.for_food_item(food_item, per_100g)
+    
+    except Exception as e:
+        log.warning("local_lookup_failed", food=food_name, error=str(e))
+        return estimate_food_item(food_item)
+
+def nutrition_lookup():
+    """
+    Return the function that resolves a single food item to its nutrition
+    
+    With NUTRITION_SOURCE=local items are resolved in-process against the
+    local index; otherwise the USDA search API is used. Without a USDA API
+    key every item is estimated.
+    """
+    if app.config['NUTRITION_SOURCE'] == 'local':
+        return lookup_local_food_item
+    
     # Get API key from environment
     api_key = os.getenv("USDA_API_KEY")
     
     if not api_key:
-        # If no API key, make an estimate based on the food items
-        return estimate_nutrition(food_analysis)
+        return estimate_food_item
+    
+    return partial(lookup_food_item, api_key=api_key)
+
+def iter_nutrition_details(food_items):
+    """
+    Yield (index, FoodNutrition) for each food item as its lookup completes
+    """
+    lookup = nutrition_lookup()
+    executor = get_usda_executor()
+    futures = {
+        executor.submit(bind_context(lookup), food_item): index
+        for index, food_item in enumerate(food_items)
+    }
+    for future in as_completed(futures):
+        yield futures[future], future.result()
+
+def iter_analysis_events(image_data):
+    """
+    Stream the vision reply and look up nutrition for each food item as it arrives
     
-    food_details = []
+    Yields ('item', index, FoodNutrition) whenever a lookup finishes, which
+    can be before the reply is complete, and ('analysis', food_analysis) once
+    it is. An index is reported again if the final reply disagrees with what
+    was parsed while streaming.
+    """
+    lookup = nutrition_lookup()
+    executor = get_usda_executor()
+    pending = {}          # future -> index
+    submitted = []        # food items in submission order
+    food_analysis = None
     
-    # Process each food item
-    for food_item in food_analysis.get("food_items", []):
-        # Prepare search term
-        food_name = food_item.get("name", "")
-        
-        # Search for food in USDA FoodData Central
-        search_url = f"https://api.nal.usda.gov/fdc/v1/foods/search"
-        params = {
-            "api_key": api_key,
-            "query": food_name,
-            "dataType": ["Foundation", "SR Legacy"],
-            "pageSize": 1
-        }
-        
-        try:
-            response = requests.get(search_url, params=params)
-            if response.status_code == 200:
-                data = response.json()
-                if data.get("foods") and len(data["foods"]) > 0:
-                    food_data = data["foods"][0]
-                    
-                    # Get nutrient values
-                    nutrients = food_data.get("foodNutrients", [])
-                    calories = next((n["value"] for n in nutrients if n.get("nutrientName") == "Energy" and n.get("unitName") == "KCAL"), 0)
-                    proteins = next((n["value"] for n in nutrients if n.get("nutrientName") == "Protein"), 0)
-                    fats = next((n["value"] for n in nutrients if n.get("nutrientName") == "Total lipid (fat)"), 0)
-                    carbs = next((n["value"] for n in nutrients if n.get("nutrientName") == "Carbohydrate, by difference"), 0)
-                    
-                    # Scale nutrients based on portion size
-                    quantity = float(food_item.get("quantity", 1))
-                    unit = food_item.get("unit", "oz")
-                    
-                    # Convert to grams based on unit
-                    grams = convert_to_grams(quantity, unit)
-                    
-                    # Standard USDA reference amount is per 100g
-                    scale_factor = grams / 100.0
-                    
-                    # Calculate scaled nutrients
-                    item_nutrition = {
-                        "name": food_name,
-                        "description": food_item.get("description", ""),
-                        "calories": calories * scale_factor,
-                        "proteins": proteins * scale_factor,
-                        "fats": fats * scale_factor,
-                        "carbs": carbs * scale_factor,
-                        "quantity": quantity,
-                        "unit": unit
-                    }
-                    
-                    # Add to total nutrition
-                    total_nutrition["calories"] += item_nutrition["calories"]
-                    total_nutrition["proteins"] += item_nutrition["proteins"]
-                    total_nutrition["fats"] += item_nutrition["fats"]
-                    total_nutrition["carbs"] += item_nutrition["carbs"]
-                    
-                    food_details.append(item_nutrition)
-                else:
-                    # If food not found, estimate
-                    estimated = estimate_food_item(food_item)
-                    food_details.append(estimated)
-                    
-                    # Add to total nutrition
-                    total_nutrition["calories"] += estimated["calories"]
-                    total_nutrition["proteins"] += estimated["proteins"]
-                    total_nutrition["fats"] += estimated["fats"]
-                    total_nutrition["carbs"] += estimated["carbs"]
-            else:
-                # API error, estimate nutrients
-                estimated = estimate_food_item(food_item)
-                food_details.append(estimated)
-                
-                # Add to total nutrition
-                total_nutrition["calories"] += estimated["calories"]
-                total_nutrition["proteins"] += estimated["proteins"]
-                total_nutrition["fats"] += estimated["fats"]
-                total_nutrition["carbs"] += estimated["carbs"]
-                
-        except Exception as e:
-            print(f"Error getting nutrition data for {food_name}: {str(e)}")
-            # On error, estimate nutrients
-            estimated = estimate_food_item(food_item)
-            food_details.append(estimated)
-            
-            # Add to total nutrition
-            total_nutrition["calories"] += estimated["calories"]
-            total_nutrition["proteins"] += estimated["proteins"]
-            total_nutrition["fats"] += estimated["fats"]
-            total_nutrition["carbs"] += estimated["carbs"]
+    def finished():
+        for future in [f for f in pending if f.done()]:
+            yield 'item', pending.pop(future), future.result()
+    
+    for event, payload in stream_food_analysis(image_data):
+        if event == 'item':
+            pending[executor.submit(bind_context(lookup), payload)] = len(submitted)
+            submitted.append(payload)
+            yield from finished()
+        else:
+            food_analysis = payload
+    
+    # Reconcile with the complete reply, which is authoritative
+    for index, food_item in enumerate(food_analysis.get("food_items", [])):
+        if index < len(submitted) and submitted[index] == food_item:
+            continue
+        for future in [f for f, i in pending.items() if i == index]:
+            future.cancel()
+            del pending[future]
+        pending[executor.submit(bind_context(lookup), food_item)] = index
+    
+    yield 'analysis', food_analysis
+    
+    # Lookups still running once the reply is complete
+    with span('nutrition_wait'):
+        for future in as_completed(list(pending)):
+            yield 'item', pending[future], future.result()
+
+def summarize_nutrition(food_analysis, food_details):
+    """
+    Scale each item's nutrients to its portion and total them in one pass
+    
+    food_details is a list of FoodNutrition in item order.
+    """
+    from nutrients import summarize_items
+    with span('summarize'):
+        food_items, total_nutrition, total_nutrients = summarize_items(food_details)
     
     # Prepare final result
     result = {
         "meal_description": food_analysis.get("meal_description", ""),
         "plate_size": food_analysis.get("plate_size", ""),
         "total_nutrition": total_nutrition,
-        "food_items": food_details
+        "total_nutrients": total_nutrients,
+        "food_items": food_items
     }
     
     return result
 
-def convert_to_grams(quantity, unit):
-    """Convert various units to grams"""
-    unit = unit.lower()
-    if unit in ["g", "grams"]:
-        return quantity
-    elif unit in ["oz", "ounce", "ounces"]:
-        return quantity * 28.35  # 1 oz = 28.35g
-    elif unit in ["cup", "cups"]:
-        return quantity * 240  # Approximately 240g per cup (varies by food)
-    elif unit in ["tbsp", "tablespoon", "tablespoons"]:
-        return quantity * 15  # Approximately 15g
-    elif unit in ["tsp", "teaspoon", "teaspoons"]:
-        return quantity * 5  # Approximately 5g
-    else:
-        # Default to oz if unit not recognized
-        return quantity * 28.35
+def nutrition_uses_estimates():
+    """True when nutrition can only be estimated (no local index and no USDA key)"""
+    return app.config['NUTRITION_SOURCE'] != 'local' and not os.getenv("USDA_API_KEY")
+
+def get_nutrition_data(food_analysis):
+    """
+    Get nutrition data for each food item using USDA FoodData Central
+    
+    Results keep the order of the food items in the analysis.
+    """
+    if nutrition_uses_estimates():
+        # If no API key, make an estimate based on the food items
+        return estimate_nutrition(food_analysis)
+    
+    food_items = food_analysis.get("food_items", [])
+    food_details = [None] * len(food_items)
+    with span('nutrition_lookups'):
+        for index, item_nutrition in iter_nutrition_details(food_items):
+            food_details[index] = item_nutrition
+    
+    return summarize_nutrition(food_analysis, food_details)
+
+_food_estimates = None
+
+def get_food_estimates():
+    """Basic estimates for common food categories (per 100g), built on first use"""
+    global _food_estimates
+    if _food_estimates is None:
+        from nutrients import vector_from_values
+        _food_estimates = {
+            category: vector_from_values(values) for category, values in CATEGORY_PROFILES.items()
+        }
+    return _food_estimates
 
 def estimate_food_item(food_item):
     """
     Make a rough estimate of nutrition for a food item when API data is unavailable
     """
-    # Basic estimates for common food categories (per 100g)
-    food_estimates = {
-        "default": {"calories": 150, "proteins": 5, "fats": 5, "carbs": 20},
-        "vegetable": {"calories": 50, "proteins": 2, "fats": 0.5, "carbs": 10},
-        "fruit": {"calories": 70, "proteins": 1, "fats": 0.3, "carbs": 15},
-        "meat": {"calories": 200, "proteins": 25, "fats": 12, "carbs": 0},
-        "fish": {"calories": 150, "proteins": 20, "fats": 8, "carbs": 0},
-        "grain": {"calories": 350, "proteins": 10, "fats": 2, "carbs": 70},
-        "dairy": {"calories": 150, "proteins": 10, "fats": 8, "carbs": 12},
-        "dessert": {"calories": 400, "proteins": 5, "fats": 15, "carbs": 60}
-    }
-    
-    # Try to categorize the food item
-    name = food_item.get("name", "").lower()
-    description = food_item.get("description", "").lower()
-    text = name + " " + description
-    
-    category = "default"
-    for key in food_estimates:
-        if key in text and key != "default":
-            category = key
-            break
-    
-    # Get base estimates for the category
-    base_nutrition = food_estimates[category]
-    
-    # Scale based on portion size
-    quantity = float(food_item.get("quantity", 1))
-    unit = food_item.get("unit", "oz")
-    
-    # Convert to grams
-    grams = convert_to_grams(quantity, unit)
-    
-    # Scale nutrition values (base values are per 100g)
-    scale_factor = grams / 100.0
-    
-    return {
-        "name": food_item.get("name", ""),
-        "description": food_item.get("description", ""),
-        "calories": round(base_nutrition["calories"] * scale_factor, 1),
-        "proteins": round(base_nutrition["proteins"] * scale_factor, 1),
-        "fats": round(base_nutrition["fats"] * scale_factor, 1),
-        "carbs": round(base_nutrition["carbs"] * scale_factor, 1),
-        "quantity": quantity,
-        "unit": unit,
-        "estimated": True  # Flag to indicate this is an estimate
-    }
+    from nutrients import FoodNutrition
+    category = categorize_food(food_item.get("name", ""), food_item.get("description", ""))
+    return FoodNutrition.for_food_item(food_item, get_food_estimates()[category], estimated=True)
+
+ESTIMATE_NOTE = "Nutrition values are estimates based on visual analysis and may not be accurate."
 
 def estimate_nutrition(food_analysis):
     """
     Estimate nutrition when API is unavailable
     """
-    # Initialize nutrition totals
-    total_nutrition = {
-        "calories": 0,
-        "proteins": 0,
-        "fats": 0,
-        "carbs": 0
-    }
-    
-    food_details = []
-    
-    # Process each food item
-    for food_item in food_analysis.get("food_items", []):
-        estimated = estimate_food_item(food_item)
-        food_details.append(estimated)
-        
-        # Add to total nutrition
-        total_nutrition["calories"] += estimated["calories"]
-        total_nutrition["proteins"] += estimated["proteins"]
-        total_nutrition["fats"] += estimated["fats"]
-        total_nutrition["carbs"] += estimated["carbs"]
-    
-    # Prepare final result
-    result = {
-        "meal_description": food_analysis.get("meal_description", ""),
-        "plate_size": food_analysis.get("plate_size", ""),
-        "total_nutrition": total_nutrition,
-        "food_items": food_details,
-        "note": "Nutrition values are estimates based on visual analysis and may not be accurate."
-    }
+    food_details = [estimate_food_item(food_item) for food_item in food_analysis.get("food_items", [])]
     
+    result = summarize_nutrition(food_analysis, food_details)
+    result["note"] = ESTIMATE_NOTE
     return result
 
 def extract_number(text, *keywords):
@@ -469,181 +731,684 @@ def extract_number(text, *keywords):
         for keyword in keywords:
             if keyword.lower() in line.lower():
                 # Find all numbers in the line
-                import re
                 numbers = re.findall(r'\d+(?:\.\d+)?', line)
                 if numbers:
                     return float(numbers[0])
     return 0  # Default if no number found
 
-def convert_image_format(input_path, output_path, format='JPEG'):
-    """Convert image to another format if Pillow is available"""
+def flatten_to_rgb(img):
+    """Return an RGB version of an image, compositing transparency onto white"""
+    if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
+        from PIL import Image
+        img = img.convert('RGBA')
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        background.paste(img, mask=img.split()[-1])  # last band is the alpha channel
+        return background
+    if img.mode != 'RGB':
+        return img.convert('RGB')
+    return img
+
+def convert_image_format(image_bytes, format='JPEG'):
+    """
+    Convert image bytes to another format in memory if Pillow is available
+    
+    Returns the converted bytes, or None if the image could not be converted.
+    """
     if not PILLOW_AVAILABLE:
-        print("Warning: Cannot convert image format because Pillow is not available")
-        # Just copy the file as a fallback
-        with open(input_path, 'rb') as src, open(output_path, 'wb') as dst:
-            dst.write(src.read())
-        return False
+        log.warning("pillow_unavailable")
+        return None
     
     try:
-        with Image.open(input_path) as img:
-            # Handle transparency if needed
-            if img.mode in ('RGBA', 'LA'):
-                background = Image.new('RGB', img.size, (255, 255, 255))
-                background.paste(img, mask=img.split()[3])  # 3 is the alpha channel
-                img = background
-            elif img.mode != 'RGB':
-                img = img.convert('RGB')
-            
-            img.save(output_path, format, quality=90)
-        return True
+        from PIL import Image
+        with Image.open(BytesIO(image_bytes)) as img:
+            output = BytesIO()
+            flatten_to_rgb(img).save(output, format, quality=90)
+        return output.getvalue()
     except Exception as e:
-        print(f"Error converting image: {str(e)}")
-        return False
+        log.warning("image_conversion_failed", error=str(e))
+        return None
 
-@app.route('/analyze', methods=['POST'])
-def analyze():
-    if 'file' not in request.files and 'image_data' not in request.form:
-        print("Error: No image provided")
-        return jsonify({"success": False, "error": "No image provided"})
+# Formats the vision model accepts as they are
+VISION_FORMATS = {'JPEG', 'PNG', 'GIF', 'WEBP'}
+
+# Decoder info that describes pixels or timing rather than the photo or its owner
+PLAIN_IMAGE_INFO = {
+    'dpi', 'aspect', 'gamma', 'srgb', 'transparency', 'background', 'version', 'duration', 'timestamp', 'loop',
+    'interlace', 'progressive', 'progression', 'jfif', 'jfif_version', 'jfif_unit', 'jfif_density',
+    'adobe', 'adobe_transform', 'compression'
+}
+
+def image_mime_type(image_bytes):
+    """MIME type for image bytes from their signature, JPEG when unrecognized"""
+    if image_bytes.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image/png'
+    if image_bytes[:6] in (b'GIF87a', b'GIF89a'):
+        return 'image/gif'
+    if image_bytes[:4] == b'RIFF' and image_bytes[8:12] == b'WEBP':
+        return 'image/webp'
+    return 'image/jpeg'
+
+def has_image_metadata(img):
+    """
+    True if a decoded image carries metadata (EXIF, ICC profile, XMP, comments, text chunks)
+    
+    For a JPEG every APPn segment other than the JFIF header counts, as do comments.
+    """
+    if img.format == 'JPEG':
+        return not all(marker == 'APP0' and data.startswith(b'JFIF\0')
+                       for marker, data in getattr(img, 'applist', []))
+    return not set(img.info) <= PLAIN_IMAGE_INFO
+
+def prepare_image_for_vision(image_bytes):
+    """
+    Downscale and re-encode an image before it is sent to the vision model
+    
+    Decodes at reduced resolution where the format allows it (JPEG draft
+    mode), caps the longest side at VISION_MAX_SIDE, drops EXIF and other
+    metadata, and re-encodes as JPEG at VISION_JPEG_QUALITY. An image in a
+    format the model accepts that already fits, carries no metadata and
+    isn't animated is passed through when re-encoding wouldn't shrink it.
+    Returns (image_bytes, stats), or (None, None) if the image can't be processed.
+    """
+    if not PILLOW_AVAILABLE:
+        return None, None
+    
+    started = time.perf_counter()
+    max_side = app.config['VISION_MAX_SIDE']
     
     try:
-        # Handle file upload
-        if 'file' in request.files:
-            file = request.files['file']
-            if file.filename == '':
-                print("Error: No file selected")
-                return jsonify({"success": False, "error": "No file selected"})
-            
-            print(f"File received: {file.filename}, Content type: {file.content_type}")
+        from PIL import Image, ImageOps
+        with Image.open(BytesIO(image_bytes)) as source:
+            original_size = source.size
+            # Let the decoder skip detail we are about to throw away
+            source.draft('RGB', (max_side, max_side))
+            # Apply the EXIF orientation before the metadata is dropped
+            img = ImageOps.exif_transpose(source)
+            img = flatten_to_rgb(img)
+            img.thumbnail((max_side, max_side), Image.LANCZOS)
+            # Checked once decoded, since PNG text chunks may follow the image data
+            plain = (source.format in VISION_FORMATS and max(original_size) <= max_side
+                     and not getattr(source, 'is_animated', False) and not has_image_metadata(source))
             
-            # Save the uploaded file temporarily
-            filename = secure_filename(file.filename)
-            original_filepath = os.path.join(app.config['UPLOAD_FOLDER'], "original_" + filename)
-            file.save(original_filepath)
-            print(f"Original file saved to: {original_filepath}")
-            
-            # For WebP files, convert to JPEG if Pillow is available
-            if filename.lower().endswith('.webp'):
-                print("Converting WebP to JPEG...")
-                processed_filepath = os.path.join(app.config['UPLOAD_FOLDER'], "processed_" + filename.rsplit('.', 1)[0] + ".jpg")
-                
-                if convert_image_format(original_filepath, processed_filepath):
-                    print(f"Converted image saved to: {processed_filepath}")
-                    filepath_to_analyze = processed_filepath
-                else:
-                    print("Could not convert WebP, using original file")
-                    filepath_to_analyze = original_filepath
-                    
-                # Use the processed or original image for analysis
-                try:
-                    result = analyze_image_with_gpt_vision(filepath_to_analyze)
-                    # Clean up files after analysis
-                    if os.path.exists(original_filepath):
-                        os.remove(original_filepath)
-                    if os.path.exists(processed_filepath) and original_filepath != processed_filepath:
-                        os.remove(processed_filepath)
-                    return jsonify(result)
-                except Exception as analysis_error:
-                    print(f"Error analyzing image: {str(analysis_error)}")
-                    # Clean up files
-                    if os.path.exists(original_filepath):
-                        os.remove(original_filepath)
-                    if os.path.exists(processed_filepath) and original_filepath != processed_filepath:
-                        os.remove(processed_filepath)
-                    raise
-            
-            # For non-WebP files
+            # Pillow would otherwise carry a JPEG comment over from the source
+            img.info.clear()
+            output = BytesIO()
+            img.save(output, 'JPEG', quality=app.config['VISION_JPEG_QUALITY'], optimize=True)
+            processed = output.getvalue()
+    except Exception as e:
+        log.warning("image_preprocessing_failed", error=str(e))
+        return None, None
+    
+    processed_size = img.size
+    if plain and len(processed) >= len(image_bytes):
+        processed, processed_size = image_bytes, original_size
+    
+    stats = {
+        "original_bytes": len(image_bytes),
+        "processed_bytes": len(processed),
+        "saved_bytes": len(image_bytes) - len(processed),
+        "original_size": list(original_size),
+        "processed_size": list(processed_size),
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 2)
+    }
+    log.debug("image_preprocessed", **stats)
+    return processed, stats
+
+analysis_cache = AnalysisCache(
+    max_entries=app.config['ANALYSIS_CACHE_MAX_ENTRIES'],
+    ttl=app.config['ANALYSIS_CACHE_TTL'],
+    max_distance=app.config['ANALYSIS_CACHE_PHASH_DISTANCE']
+)
+
+CACHE_STATS = REGISTRY.gauge("calai_cache_stat", "Counters and sizes reported by the caches", ("cache", "stat"))
+ANALYSIS_JOBS = REGISTRY.gauge("calai_analysis_jobs", "Analysis jobs by status", ("status",))
+
+@REGISTRY.on_collect
+def collect_cache_metrics():
+    """Copy cache and job queue stats into gauges at scrape time"""
+    for cache_name, stats in (("nutrient", nutrient_cache.stats()), ("analysis", analysis_cache.stats())):
+        for stat, value in stats.items():
+            CACHE_STATS.set(value, cache=cache_name, stat=stat)
+    # Don't start the job workers just to report that they are idle
+    if _job_backend is not None:
+        for status, count in _job_backend.stats().items():
+            ANALYSIS_JOBS.set(count, status=status)
+
+def image_cache_keys(image_bytes):
+    """Return the content hash and (optionally) perceptual hash of decoded image bytes"""
+    phash = perceptual_hash(image_bytes) if app.config['ANALYSIS_CACHE_PHASH'] else None
+    return content_hash(image_bytes), phash
+
+def cached_analysis(cache_keys):
+    """Return a previously finished analysis for these image keys, flagged as a cache hit"""
+    cached = analysis_cache.get(*cache_keys)
+    if cached is None:
+        return None
+    log.debug("analysis_cache_hit", image=cache_keys[0][:12])
+    return dict(cached, cached=True)
+
+def remember_analysis(cache_keys, result):
+    """Cache a successful analysis and flag the response as a cache miss"""
+    if result.get("success"):
+        analysis_cache.set(cache_keys[0], result, cache_keys[1])
+    return dict(result, cached=False)
+
+def prepare_analysis_image(image_bytes, is_webp=False):
+    """
+    Get decoded image bytes ready for the vision model
+    
+    Returns (image_bytes, preprocessing_stats); stats is None when the
+    preprocessing stage is disabled or could not handle the image.
+    """
+    # Shrink the image before the vision call; unless passed through, WebP comes back as JPEG
+    stats = None
+    if app.config['VISION_PREPROCESS']:
+        with span('preprocess'):
+            processed, stats = prepare_image_for_vision(image_bytes)
+        if processed is not None:
+            return processed, stats
+    
+    # For WebP images, convert to JPEG if Pillow is available
+    if is_webp:
+        with span('webp_convert'):
+            converted = convert_image_format(image_bytes)
+        if converted is not None:
+            log.debug("webp_converted", jpeg_bytes=len(converted))
+            return converted, stats
+        log.warning("webp_conversion_skipped")
+    
+    return image_bytes, stats
+
+def analyze_image_bytes(image_bytes, is_webp=False):
+    """
+    Run the analysis pipeline on decoded image bytes, entirely in memory
+    """
+    # Serve repeat submissions of the same photo from the cache
+    with span('cache_lookup'):
+        cache_keys = image_cache_keys(image_bytes)
+        cached = cached_analysis(cache_keys)
+    if cached is not None:
+        return cached
+    
+    image_bytes, stats = prepare_analysis_image(image_bytes, is_webp)
+    
+    result = remember_analysis(cache_keys, analyze_image_with_gpt_vision(image_bytes))
+    if stats is not None:
+        result["preprocessing"] = stats
+    return result
+
+def sse_event(event, data):
+    """Format a Server-Sent Events message with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def stream_image_analysis(image_bytes, is_webp=False):
+    """
+    Run the analysis pipeline and yield SSE messages as each stage finishes
+    
+    Events: 'preprocessing' (optional), 'analysis' with the identified food
+    items once the vision reply is complete, and one 'item' per food item as
+    its nutrition lookup completes. Lookups start while the reply is still
+    streaming, so 'item' events can come before 'analysis' and are not in
+    item order; 'index' gives the position. The stream ends with 'total'
+    and 'done' (the same payload /analyze would return), or with 'error'.
+    """
+    with span('cache_lookup'):
+        cache_keys = image_cache_keys(image_bytes)
+        cached = cached_analysis(cache_keys)
+    if cached is not None:
+        data = cached["data"]
+        yield sse_event("analysis", {
+            "meal_description": data.get("meal_description", ""),
+            "plate_size": data.get("plate_size", ""),
+            "food_items": data.get("food_items", []),
+            "cached": True
+        })
+        for index, item_nutrition in enumerate(data.get("food_items", [])):
+            yield sse_event("item", {"index": index, "nutrition": item_nutrition})
+        yield sse_event("total", {"total_nutrition": data.get("total_nutrition", {})})
+        yield sse_event("done", cached)
+        return
+    
+    image_bytes, stats = prepare_analysis_image(image_bytes, is_webp)
+    if stats is not None:
+        yield sse_event("preprocessing", stats)
+    
+    try:
+        food_analysis = None
+        food_details = {}
+        for event in iter_analysis_events(image_bytes):
+            if event[0] == 'analysis':
+                food_analysis = event[1]
+                yield sse_event("analysis", {
+                    "meal_description": food_analysis.get("meal_description", ""),
+                    "plate_size": food_analysis.get("plate_size", ""),
+                    "food_items": food_analysis.get("food_items", []),
+                    "cached": False
+                })
             else:
-                # Check file extension
-                if not allowed_file(filename):
-                    print(f"Error: Invalid file format. File: {filename}")
-                    os.remove(original_filepath)
-                    return jsonify({"success": False, "error": f"Invalid file format. Allowed formats: {', '.join(app.config['ALLOWED_EXTENSIONS'])}"})
-                
-                try:
-                    result = analyze_image_with_gpt_vision(original_filepath)
-                    # Clean up the file after analysis
-                    os.remove(original_filepath)
-                    return jsonify(result)
-                except Exception as analysis_error:
-                    print(f"Error analyzing image: {str(analysis_error)}")
-                    if os.path.exists(original_filepath):
-                        os.remove(original_filepath)
-                    return jsonify({"success": False, "error": f"Error analyzing image: {str(analysis_error)}"})
+                _, index, item_nutrition = event
+                food_details[index] = item_nutrition
+                yield sse_event("item", {"index": index, "nutrition": item_nutrition.to_dict()})
         
-        # Handle base64 image data from webcam
-        elif 'image_data' in request.form:
-            image_data = request.form['image_data']
-            # Check if the data is valid
-            if not image_data:
-                print("Error: Empty image data")
-                return jsonify({"success": False, "error": "Empty image data"})
-                
-            # Extract content type and raw base64 data
-            content_type = None
-            if image_data.startswith('data:image'):
-                content_parts = image_data.split(';')
-                if len(content_parts) > 0:
-                    content_type = content_parts[0].split(':')[1]
-                print(f"Base64 image content type: {content_type}")
-                image_data = image_data.split(',')[1]
-            
-            try:
-                # Decode base64 to binary
-                image_binary = base64.b64decode(image_data)
-                
-                # If it's a WebP image, convert it to JPEG if Pillow is available
-                if content_type == 'image/webp':
-                    print("Converting WebP base64 image to JPEG...")
-                    temp_webp_path = os.path.join(app.config['UPLOAD_FOLDER'], "temp_webcam.webp")
-                    temp_jpg_path = os.path.join(app.config['UPLOAD_FOLDER'], "temp_webcam.jpg")
-                    
-                    # Save the original WebP image
-                    with open(temp_webp_path, 'wb') as f:
-                        f.write(image_binary)
-                    
-                    if convert_image_format(temp_webp_path, temp_jpg_path):
-                        print(f"Converted base64 image saved to: {temp_jpg_path}")
-                        filepath_to_analyze = temp_jpg_path
-                    else:
-                        print("Could not convert WebP, using original file")
-                        filepath_to_analyze = temp_webp_path
-                    
-                    # Analyze the image
-                    try:
-                        result = analyze_image_with_gpt_vision(filepath_to_analyze)
-                        
-                        # Clean up temporary files
-                        if os.path.exists(temp_webp_path):
-                            os.remove(temp_webp_path)
-                        if os.path.exists(temp_jpg_path) and temp_webp_path != temp_jpg_path:
-                            os.remove(temp_jpg_path)
-                        
-                        return jsonify(result)
-                    
-                    except Exception as analysis_error:
-                        print(f"Error analyzing WebP base64 image: {str(analysis_error)}")
-                        # Clean up any temporary files
-                        if os.path.exists(temp_webp_path):
-                            os.remove(temp_webp_path)
-                        if os.path.exists(temp_jpg_path) and temp_webp_path != temp_jpg_path:
-                            os.remove(temp_jpg_path)
-                        return jsonify({"success": False, "error": f"Error analyzing WebP image: {str(analysis_error)}"})
-                
-                # For other image types, process directly
-                else:
-                    result = analyze_image_with_gpt_vision(image_binary)
-                    return jsonify(result)
-                
-            except Exception as decode_error:
-                print(f"Error decoding image data: {str(decode_error)}")
-                return jsonify({"success": False, "error": f"Error decoding image data: {str(decode_error)}"})
+        food_items = food_analysis.get("food_items", [])
+        result = summarize_nutrition(food_analysis, [food_details[index] for index in range(len(food_items))])
+        if nutrition_uses_estimates():
+            result["note"] = ESTIMATE_NOTE
+        
+        yield sse_event("total", {"total_nutrition": result["total_nutrition"]})
     
+    except VisionResponseError as e:
+        yield sse_event("error", {"success": False, "error": str(e), "raw_response": e.raw_response})
+        return
     except Exception as e:
-        print(f"Unexpected error: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        log.exception("stream_analysis_failed", error=str(e))
+        yield sse_event("error", {"success": False, "error": str(e)})
+        return
+    
+    response = remember_analysis(cache_keys, {"success": True, "data": result})
+    if stats is not None:
+        response["preprocessing"] = stats
+    yield sse_event("done", response)
+
+class ImageRequestError(Exception):
+    """Raised when a request doesn't carry a usable image"""
+
+def read_upload(file):
+    """
+    Return (image_bytes, is_webp) for an uploaded file
+    """
+    if file.filename == '':
+        log.info("image_rejected", reason="no file selected")
+        raise ImageRequestError("No file selected")
+    
+    log.debug("file_received", filename=file.filename, content_type=file.content_type)
+    
+    filename = secure_filename(file.filename)
+    is_webp = filename.lower().endswith('.webp')
+    
+    # Check file extension
+    if not is_webp and not allowed_file(filename):
+        log.info("image_rejected", reason="invalid file format", filename=filename)
+        raise ImageRequestError(f"Invalid file format. Allowed formats: {', '.join(app.config['ALLOWED_EXTENSIONS'])}")
+    
+    return file.read(), is_webp
+
+def decode_image_data(image_data):
+    """
+    Return (image_bytes, is_webp) for base64 image data, with or without a data URL prefix
+    """
+    # Check if the data is valid
+    if not image_data:
+        log.info("image_rejected", reason="empty image data")
+        raise ImageRequestError("Empty image data")
+        
+    # Extract content type and raw base64 data
+    content_type = None
+    if image_data.startswith('data:image'):
+        content_parts = image_data.split(';')
+        if len(content_parts) > 0:
+            content_type = content_parts[0].split(':')[1]
+        log.debug("base64_image_received", content_type=content_type)
+        image_data = image_data.split(',')[1]
+    
+    try:
+        # Decode base64 to binary
+        image_binary = base64.b64decode(image_data)
+    except Exception as decode_error:
+        log.info("image_rejected", reason="undecodable base64", error=str(decode_error))
+        raise ImageRequestError(f"Error decoding image data: {str(decode_error)}")
+    
+    return image_binary, content_type == 'image/webp'
+
+def read_request_image():
+    """
+    Return (image_bytes, is_webp) from the multipart `file` or base64 `image_data` field
+    """
+    if 'file' not in request.files and 'image_data' not in request.form:
+        log.info("image_rejected", reason="no image provided")
+        raise ImageRequestError("No image provided")
+    
+    with span('read_image'):
+        if 'file' in request.files:
+            # Handle file upload
+            image_bytes, is_webp = read_upload(request.files['file'])
+        else:
+            # Handle base64 image data from webcam
+            image_bytes, is_webp = decode_image_data(request.form['image_data'])
+    PAYLOAD_BYTES.set(len(image_bytes), payload='upload')
+    return image_bytes, is_webp
+
+@app.route('/analyze', methods=['POST'])
+@profile_flask_view
+def analyze():
+    from meal_history import InvalidMeal, meal_from_analysis
+    try:
+        try:
+            image_bytes, is_webp = read_request_image()
+            # With save=1 the result is also stored as a meal; check its options before analyzing
+            save_options = read_meal_save_options()
+        except (ImageRequestError, InvalidMeal) as e:
+            return jsonify({"success": False, "error": str(e)})
+        
+        try:
+            result = analyze_image_bytes(image_bytes, is_webp=is_webp)
+            if save_options is not None and result.get("success"):
+                user_id, eaten_at, event_id = save_options
+                meal = get_meal_history().add(user_id, meal_from_analysis(result["data"], eaten_at, event_id))
+                result = dict(result, meal_id=meal["id"])
+            return jsonify(with_trace(result))
+        except Exception as analysis_error:
+            log.exception("analysis_failed", error=str(analysis_error))
+            return jsonify({"success": False, "error": f"Error analyzing image: {str(analysis_error)}"})
+    
+    except Exception as e:
+        log.exception("unexpected_error", error=str(e))
         return jsonify({"success": False, "error": f"Unexpected error: {str(e)}"})
 
+@app.route('/analyze/stream', methods=['POST'])
+@profile_flask_view
+def analyze_stream():
+    """
+    Streaming variant of /analyze that sends Server-Sent Events per stage
+    """
+    try:
+        image_bytes, is_webp = read_request_image()
+        events = stream_image_analysis(image_bytes, is_webp=is_webp)
+    except ImageRequestError as e:
+        events = iter([sse_event("error", {"success": False, "error": str(e)})])
+    
+    return Response(
+        stream_with_context(events),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+_batch_executor = None
+_batch_lock = threading.Lock()
+
+def get_batch_executor():
+    """Return the bounded thread pool that runs batch analyses"""
+    global _batch_executor
+    if _batch_executor is None:
+        with _batch_lock:
+            if _batch_executor is None:
+                _batch_executor = ThreadPoolExecutor(
+                    max_workers=app.config['BATCH_MAX_WORKERS'],
+                    thread_name_prefix="batch-analysis"
+                )
+    return _batch_executor
+
+def iter_batch_images():
+    """
+    Yield (image_id, image_bytes, is_webp) for each image in a batch request
+    
+    Accepts multipart uploads (any number of `files`/`file` fields) or an
+    NDJSON body with one {"id": ..., "image_data": "<base64>"} object per
+    line. Images that can't be read yield (image_id, ImageRequestError, None)
+    so the rest of the batch still runs.
+    """
+    if request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+        # Read line by line so the body is never held in memory as a whole
+        for line_number, line in enumerate(request.stream, 1):
+            line = line.strip()
+            if not line:
+                continue
+            image_id = line_number
+            try:
+                entry = json.loads(line)
+                if not isinstance(entry, dict):
+                    raise ImageRequestError("Each line must be a JSON object")
+                image_id = entry.get("id", line_number)
+                image_bytes, is_webp = decode_image_data(entry.get("image_data", ""))
+                yield image_id, image_bytes, is_webp
+            except json.JSONDecodeError as e:
+                yield image_id, ImageRequestError(f"Invalid JSON: {str(e)}"), None
+            except ImageRequestError as e:
+                yield image_id, e, None
+        return
+    
+    files = request.files.getlist('files') + request.files.getlist('file')
+    for position, file in enumerate(files):
+        image_id = file.filename or position
+        try:
+            image_bytes, is_webp = read_upload(file)
+            yield image_id, image_bytes, is_webp
+        except ImageRequestError as e:
+            yield image_id, e, None
+
+def analyze_batch_image(image_bytes, is_webp):
+    """Analyze one image of a batch, turning any failure into an error result"""
+    try:
+        return analyze_image_bytes(image_bytes, is_webp=is_webp)
+    except Exception as e:
+        log.exception("batch_image_failed", error=str(e))
+        return {"success": False, "error": f"Error analyzing image: {str(e)}"}
+
+def iter_batch_results(images):
+    """
+    Yield (index, image_id, result) as each image of a batch finishes
+    
+    At most twice BATCH_MAX_WORKERS images are decoded and waiting at once.
+    """
+    executor = get_batch_executor()
+    max_in_flight = app.config['BATCH_MAX_WORKERS'] * 2
+    pending = {}  # future -> (index, image_id)
+    
+    for index, (image_id, image_bytes, is_webp) in enumerate(images):
+        if isinstance(image_bytes, ImageRequestError):
+            yield index, image_id, {"success": False, "error": str(image_bytes)}
+            continue
+        
+        pending[executor.submit(bind_context(analyze_batch_image), image_bytes, is_webp)] = (index, image_id)
+        if len(pending) >= max_in_flight:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                index_done, id_done = pending.pop(future)
+                yield index_done, id_done, future.result()
+    
+    for future in as_completed(pending):
+        index_done, id_done = pending[future]
+        yield index_done, id_done, future.result()
+
+@app.route('/analyze/batch', methods=['POST'])
+@profile_flask_view
+def analyze_batch():
+    """
+    Analyze many images in one request with bounded concurrency
+    
+    Returns every result in input order, or with ?stream=1 writes NDJSON
+    lines as each image finishes. Failures are reported per image.
+    """
+    results = iter_batch_results(iter_batch_images())
+    
+    if request.args.get('stream', '').lower() in ('1', 'true'):
+        def generate():
+            for index, image_id, result in results:
+                yield json.dumps(dict(result, index=index, id=image_id)) + "\n"
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    
+    ordered = sorted(results, key=lambda entry: entry[0])
+    return jsonify({
+        "success": True,
+        "count": len(ordered),
+        "results": [dict(result, index=index, id=image_id) for index, image_id, result in ordered]
+    })
+
+_job_backend = None
+
+def run_analysis_job(payload):
+    """Job handler: analyze the image bytes carried by a job payload"""
+    return analyze_batch_image(payload["image_bytes"], payload["is_webp"])
+
+def get_job_backend():
+    """Return the analysis job backend, creating it on first use"""
+    global _job_backend
+    if _job_backend is None:
+        with _batch_lock:
+            if _job_backend is None:
+                _job_backend = load_job_backend(
+                    app.config['ANALYSIS_JOB_BACKEND'],
+                    run_analysis_job,
+                    max_workers=app.config['ANALYSIS_JOB_WORKERS'],
+                    max_pending=app.config['ANALYSIS_JOB_MAX_PENDING'],
+                    result_ttl=app.config['ANALYSIS_JOB_TTL']
+                )
+    return _job_backend
+
+@app.route('/analyze/jobs', methods=['POST'])
+def submit_analysis_job():
+    """
+    Queue an analysis and return its job id right away
+    
+    Takes the same inputs as /analyze; poll GET /analyze/jobs/<job_id>.
+    """
+    try:
+        image_bytes, is_webp = read_request_image()
+    except ImageRequestError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    
+    try:
+        job_id = get_job_backend().submit({"image_bytes": image_bytes, "is_webp": is_webp})
+    except JobQueueFull as e:
+        return jsonify({"success": False, "error": str(e)}), 503
+    
+    return jsonify({
+        "success": True,
+        "job_id": job_id,
+        "status": "queued",
+        "status_url": f"/analyze/jobs/{job_id}"
+    }), 202
+
+@app.route('/analyze/jobs/<job_id>', methods=['GET'])
+def get_analysis_job(job_id):
+    """Return the status of an analysis job, with its result once finished"""
+    job = get_job_backend().get(job_id)
+    if job is None:
+        return jsonify({"success": False, "error": "Job not found or expired"}), 404
+    return jsonify(dict(job, success=True))
+
+_meal_history = None
+
+def get_meal_history():
+    """Return the meal history store, opening it on first use"""
+    global _meal_history
+    if _meal_history is None:
+        with _batch_lock:
+            if _meal_history is None:
+                from meal_history import MealHistory
+                _meal_history = MealHistory(app.config['MEAL_HISTORY_PATH'])
+    return _meal_history
+
+def request_user_id():
+    """The user meal requests act for: the X-User-Id header, or "default" without one"""
+    from meal_history import InvalidMeal, valid_user_id
+    user_id = request.headers.get('X-User-Id') or 'default'
+    if not valid_user_id(user_id):
+        raise InvalidMeal("X-User-Id must be 1-128 letters, digits or . _ : @ -")
+    return user_id
+
+def check_meal_event(event_id):
+    """Make sure the calendar event a meal links to exists"""
+    from meal_history import InvalidMeal
+    if event_id is not None and get_event_store().get(event_id) is None:
+        raise InvalidMeal(f"Calendar event {event_id} not found")
+
+def read_meal_save_options():
+    """
+    Return (user_id, eaten_at, event_id) when an /analyze request asks to save its result, else None
+    """
+    from meal_history import validate_meal_fields
+    
+    def option(name):
+        return request.args.get(name) or request.form.get(name)
+    
+    if (option('save') or '').lower() not in ('1', 'true'):
+        return None
+    eaten_at, event_id = option('eaten_at'), option('event_id')
+    # Validate now so a bad option doesn't cost an analysis
+    check_meal_event(validate_meal_fields(eaten_at, event_id)[1])
+    return request_user_id(), eaten_at, event_id
+
+def read_meal_body():
+    """Build a meal from a JSON request body: an /analyze result plus eaten_at and event_id"""
+    from meal_history import meal_from_analysis
+    meal = meal_from_analysis(request.get_json(silent=True))
+    check_meal_event(meal.get("event_id"))
+    return meal
+
+@app.route('/meals', methods=['GET', 'POST'])
+def meals():
+    """
+    Save a meal (POST) or list saved meals (GET)
+    
+    GET takes from/to (ISO 8601 times), event_id and limit (default 100).
+    """
+    from meal_history import InvalidMeal
+    try:
+        user_id = request_user_id()
+        if request.method == 'POST':
+            meal = get_meal_history().add(user_id, read_meal_body())
+            return jsonify({"success": True, "meal": meal}), 201
+        
+        start, end = request.args.get('from'), request.args.get('to')
+        limit = request.args.get('limit', '100')
+        if not limit.isdigit() or not 1 <= int(limit) <= 1000:
+            raise InvalidMeal("limit must be between 1 and 1000")
+        entries = get_meal_history().between(
+            user_id,
+            parse_time(start) if start else None,
+            parse_time(end) if end else None,
+            event_id=request.args.get('event_id'),
+            limit=int(limit)
+        )
+    except (InvalidMeal, InvalidTime) as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    return jsonify({"success": True, "count": len(entries), "meals": entries})
+
+@app.route('/meals/<int:meal_id>', methods=['GET', 'PUT', 'DELETE'])
+def meal_entry(meal_id):
+    """Read, replace or delete one saved meal"""
+    from meal_history import InvalidMeal
+    try:
+        user_id = request_user_id()
+        history = get_meal_history()
+        if request.method == 'PUT':
+            meal = history.replace(user_id, meal_id, read_meal_body())
+        elif request.method == 'DELETE':
+            meal = history.delete(user_id, meal_id)
+        else:
+            meal = history.get(user_id, meal_id)
+    except InvalidMeal as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    if meal is None:
+        return jsonify({"success": False, "error": "Meal not found"}), 404
+    return jsonify({"success": True, "meal": meal})
+
+@app.route('/meals/summary', methods=['GET'])
+def meal_summary():
+    """
+    Calories and macros per day or ISO week (period=day|week) from the rollups
+    
+    from/to are dates; without them the last 7 days or 8 weeks up to today.
+    """
+    from meal_history import InvalidMeal, parse_summary_range, summarize_periods
+    period = request.args.get('period', 'day')
+    try:
+        user_id = request_user_id()
+        first, last = parse_summary_range(period, request.args.get('from'), request.args.get('to'))
+        rows = get_meal_history().summary(user_id, period, first, last)
+    except InvalidMeal as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    totals, average = summarize_periods(rows)
+    return jsonify({
+        "success": True,
+        "period": period,
+        "from": rows[0]["start"],
+        "to": rows[-1]["start"],
+        "periods": rows,
+        "totals": totals,
+        "average": average
+    })
+
 if __name__ == '__main__':
     app.run(debug=True, port=5001, host='0.0.0.0') 
\ No newline at end of file
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""
+Local USDA FoodData Central index
+
+Builds a compact SQLite index from the FoodData Central bulk downloads
+(Foundation and SR Legacy, as CSV directories or JSON files) so food lookups
+can run in-process instead of calling the USDA search API.
+
+The index holds one row per food with its per-100g macros and full
+nutrient vector (see nutrients.py), plus an FTS5 table over the
+descriptions. It is built once and then opened read-only and
+memory-mapped by the app.
+
+Usage:
+    python fdc_index.py build --output data/fdc_index.sqlite3 FoodData_Central_foundation_food_csv/ FoodData_Central_sr_legacy_food_json.json
+    python fdc_index.py search --index data/fdc_index.sqlite3 "grilled chicken breast"
+"""
+
+import argparse
+import csv
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+
+import numpy as np
+
+from nutrients import MACRO_KEYS, MACRO_SLOTS, SCHEMA_NUTRIENT_IDS, SCHEMA_VERSION, vector_from_amounts, vector_from_values
+
+# Data types indexed, matching the dataType filter used for the USDA search API
+DATA_TYPES = {
+    "foundation_food": "Foundation",
+    "sr_legacy_food": "SR Legacy",
+    "Foundation": "Foundation",
+    "SR Legacy": "SR Legacy",
+}
+
+# Version 1 indexes only have the macro columns
+INDEX_FORMAT_VERSION = "2"
+
+
+def iter_csv_foods(directory):
+    """Yield (fdc_id, description, data_type, nutrient_vector) from an FDC CSV download directory"""
+    foods = {}
+    with open(os.path.join(directory, "food.csv"), newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            data_type = DATA_TYPES.get(row.get("data_type", ""))
+            if data_type:
+                foods[int(row["fdc_id"])] = (row["description"], data_type)
+
+    wanted = SCHEMA_NUTRIENT_IDS
+    amounts = {}
+    with open(os.path.join(directory, "food_nutrient.csv"), newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            try:
+                fdc_id = int(row["fdc_id"])
+                nutrient_id = int(row["nutrient_id"])
+            except (KeyError, ValueError):
+                continue
+            if fdc_id not in foods or nutrient_id not in wanted or not row.get("amount"):
+                continue
+            amounts.setdefault(fdc_id, {})[nutrient_id] = float(row["amount"])
+
+    for fdc_id, (description, data_type) in foods.items():
+        yield fdc_id, description, data_type, vector_from_amounts(amounts.get(fdc_id, {}))
+
+
+def iter_json_foods(path):
+    """Yield (fdc_id, description, data_type, nutrient_vector) from an FDC JSON download"""
+    with open(path, encoding="utf-8") as f:
+        payload = json.load(f)
+
+    if isinstance(payload, dict):
+        records = payload.get("FoundationFoods") or payload.get("SRLegacyFoods") or []
+    else:
+        records = payload
+
+    wanted = SCHEMA_NUTRIENT_IDS
+    for food in records:
+        data_type = DATA_TYPES.get(food.get("dataType", ""))
+        if not data_type:
+            continue
+        amounts = {}
+        for entry in food.get("foodNutrients", []):
+            nutrient_id = (entry.get("nutrient") or {}).get("id")
+            if nutrient_id in wanted and entry.get("amount") is not None:
+                amounts[nutrient_id] = float(entry["amount"])
+        yield food["fdcId"], food.get("description", ""), data_type, vector_from_amounts(amounts)
+
+
+def iter_source_foods(source):
+    """Dispatch on the kind of bulk download given"""
+    if os.path.isdir(source):
+        return iter_csv_foods(source)
+    return iter_json_foods(source)
+
+
+def build_index(sources, output_path):
+    """
+    Build the index from one or more bulk downloads and return the number of foods
+
+    The index is written to a temporary file and moved into place at the end,
+    so readers never see a half-built index.
+    """
+    directory = os.path.dirname(output_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = output_path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    conn = sqlite3.connect(tmp_path)
+    conn.executescript("""
+        CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+        CREATE TABLE foods (
+            fdc_id INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            data_type TEXT NOT NULL,
+            calories REAL NOT NULL,
+            proteins REAL NOT NULL,
+            fats REAL NOT NULL,
+            carbs REAL NOT NULL,
+            nutrients BLOB NOT NULL
+        );
+        CREATE VIRTUAL TABLE foods_fts USING fts5(
+            description,
+            content='foods',
+            content_rowid='fdc_id',
+            tokenize='unicode61 remove_diacritics 2',
+            prefix='2 3 4'
+        );
+    """)
+
+    for source in sources:
+        rows = (
+            (fdc_id, description, data_type, *vector[MACRO_SLOTS].tolist(), vector.astype("<f8").tobytes())
+            for fdc_id, description, data_type, vector in iter_source_foods(source)
+        )
+        conn.executemany("INSERT OR REPLACE INTO foods VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+    count = conn.execute("SELECT COUNT(*) FROM foods").fetchone()[0]
+
+    conn.execute("INSERT INTO foods_fts (foods_fts) VALUES ('rebuild')")
+    conn.execute("INSERT INTO foods_fts (foods_fts) VALUES ('optimize')")
+    conn.execute("INSERT INTO meta VALUES ('format_version', ?)", (INDEX_FORMAT_VERSION,))
+    conn.execute("INSERT INTO meta VALUES ('food_count', ?)", (str(count),))
+    conn.execute("INSERT INTO meta VALUES ('nutrient_schema', ?)", (str(SCHEMA_VERSION),))
+    conn.commit()
+    conn.execute("VACUUM")
+    conn.close()
+
+    os.replace(tmp_path, output_path)
+    return count
+
+
+def _fts_query(text, operator):
+    """Turn free text into an FTS5 prefix query ("white rice" -> "white"* AND "rice"*)"""
+    words = re.findall(r"[a-z0-9]+", (text or "").lower())
+    return f" {operator} ".join(f'"{word}"*' for word in words)
+
+
+class FoodIndex:
+    """
+    Read-only, memory-mapped view of an index built by build_index
+    """
+
+    def __init__(self, path, mmap_size=256 * 1024 * 1024):
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"FoodData Central index not found: {path}")
+        self.path = path
+        self.mmap_size = mmap_size
+        self._local = threading.local()
+        self._vectors = None
+
+    def _connection(self):
+        """Return this thread's read-only connection"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            uri = f"file:{os.path.abspath(self.path)}?mode=ro&immutable=1"
+            conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+            conn.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+            conn.execute("PRAGMA query_only=1")
+            self._local.conn = conn
+        return conn
+
+    def search(self, text, limit=5):
+        """Full-text prefix search over descriptions, best matches first"""
+        conn = self._connection()
+        # Require every word first, then fall back to any word
+        for operator in ("AND", "OR"):
+            query = _fts_query(text, operator)
+            if not query:
+                return []
+            rows = conn.execute(
+                "SELECT f.fdc_id, f.description, f.data_type, f.calories, f.proteins, f.fats, f.carbs "
+                "FROM foods_fts JOIN foods f ON f.fdc_id = foods_fts.rowid "
+                "WHERE foods_fts MATCH ? "
+                "ORDER BY bm25(foods_fts), length(f.description) "
+                "LIMIT ?",
+                (query, limit)
+            ).fetchall()
+            if rows:
+                return [
+                    {
+                        "fdc_id": row[0],
+                        "description": row[1],
+                        "data_type": row[2],
+                        "calories": row[3],
+                        "proteins": row[4],
+                        "fats": row[5],
+                        "carbs": row[6],
+                    }
+                    for row in rows
+                ]
+        return []
+
+    def has_vectors(self):
+        """Whether the index stores full nutrient vectors under the current schema"""
+        if self._vectors is None:
+            row = self._connection().execute(
+                "SELECT value FROM meta WHERE key = 'nutrient_schema'"
+            ).fetchone()
+            self._vectors = row is not None and row[0] == str(SCHEMA_VERSION)
+        return self._vectors
+
+    def lookup(self, food_name):
+        """Return the per-100g nutrient vector of the best match for a food name, or None"""
+        matches = self.search(food_name, limit=1)
+        if not matches:
+            return None
+        best = matches[0]
+        if self.has_vectors():
+            blob = self._connection().execute(
+                "SELECT nutrients FROM foods WHERE fdc_id = ?", (best["fdc_id"],)
+            ).fetchone()[0]
+            return np.frombuffer(blob, dtype="<f8").astype(float)
+        # Older indexes only carry the macros
+        return vector_from_values({key: best[key] for key in MACRO_KEYS})
+
+    def count(self):
+        """Number of foods in the index"""
+        return self._connection().execute("SELECT COUNT(*) FROM foods").fetchone()[0]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or query a local FoodData Central index")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build", help="Import bulk CSV directories or JSON files")
+    build_parser.add_argument("sources", nargs="+", help="FDC CSV download directories or JSON files")
+    build_parser.add_argument("--output", default=os.path.join("data", "fdc_index.sqlite3"))
+
+    search_parser = subparsers.add_parser("search", help="Search an existing index")
+    search_parser.add_argument("query")
+    search_parser.add_argument("--index", default=os.path.join("data", "fdc_index.sqlite3"))
+    search_parser.add_argument("--limit", type=int, default=5)
+
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        count = build_index(args.sources, args.output)
+        print(f"Indexed {count} foods into {args.output}")
+    else:
+        for match in FoodIndex(args.index).search(args.query, limit=args.limit):
+            print(json.dumps(match))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,398 @@
+"""
+Food category lexicon for rough nutrition estimates.
+
+Maps food names and synonyms to a handful of categories, each with a
+typical per-100g nutrient profile. The terms (and their plural forms) are
+compiled once into an Aho-Corasick automaton, so categorizing a food item
+is a single pass over its text however large the lexicon grows.
+"""
+
+import re
+import threading
+import unicodedata
+
+# Typical per-100g values for each category, used when no lookup succeeds
+CATEGORY_PROFILES = {
+    "default": {"calories": 150, "proteins": 5, "fats": 5, "carbs": 20},
+    "vegetable": {"calories": 50, "proteins": 2, "fats": 0.5, "carbs": 10, "fiber": 2.5},
+    "starchy_vegetable": {"calories": 90, "proteins": 2, "fats": 0.2, "carbs": 20, "fiber": 2.2},
+    "fruit": {"calories": 70, "proteins": 1, "fats": 0.3, "carbs": 15, "fiber": 2, "sugars": 12},
+    "meat": {"calories": 200, "proteins": 25, "fats": 12, "carbs": 0},
+    "poultry": {"calories": 190, "proteins": 27, "fats": 8, "carbs": 0},
+    "fish": {"calories": 150, "proteins": 20, "fats": 8, "carbs": 0},
+    "egg": {"calories": 155, "proteins": 13, "fats": 11, "carbs": 1},
+    "legume": {"calories": 130, "proteins": 8, "fats": 0.5, "carbs": 22, "fiber": 7},
+    "nut": {"calories": 600, "proteins": 20, "fats": 52, "carbs": 20, "fiber": 8},
+    "grain": {"calories": 350, "proteins": 10, "fats": 2, "carbs": 70},
+    "cooked_grain": {"calories": 140, "proteins": 4, "fats": 1, "carbs": 28, "fiber": 1.5},
+    "bread": {"calories": 265, "proteins": 9, "fats": 3, "carbs": 49, "fiber": 3},
+    "dairy": {"calories": 150, "proteins": 10, "fats": 8, "carbs": 12},
+    "cheese": {"calories": 380, "proteins": 24, "fats": 30, "carbs": 2},
+    "fat": {"calories": 800, "proteins": 0.5, "fats": 90, "carbs": 0.5},
+    "sauce": {"calories": 150, "proteins": 1.5, "fats": 10, "carbs": 12},
+    "soup": {"calories": 50, "proteins": 3, "fats": 2, "carbs": 6},
+    "mixed_dish": {"calories": 180, "proteins": 9, "fats": 8, "carbs": 18},
+    "fast_food": {"calories": 280, "proteins": 11, "fats": 14, "carbs": 28},
+    "snack": {"calories": 500, "proteins": 7, "fats": 25, "carbs": 60},
+    "dessert": {"calories": 400, "proteins": 5, "fats": 15, "carbs": 60, "sugars": 35},
+    "beverage": {"calories": 40, "proteins": 0.5, "fats": 0.5, "carbs": 9, "sugars": 8},
+}
+
+# Comma-separated terms per category. Plurals are generated automatically;
+# only irregular ones need listing. Multi-word terms take precedence over
+# the words they contain ("peanut butter" is a nut, not a fat).
+_LEXICON = {
+    "vegetable": """
+        vegetable, veggie, veg, greens, salad, side salad, garden salad, green salad, caesar salad,
+        lettuce, romaine, iceberg, arugula, rocket, spinach, kale, chard, swiss chard, collard,
+        collard greens, mustard greens, bok choy, pak choi, cabbage, red cabbage, napa cabbage,
+        sauerkraut, kimchi, broccoli, broccolini, cauliflower, brussels sprout, asparagus,
+        green bean, string bean, snap pea, snow pea, sugar snap pea, edamame pod, okra, celery,
+        cucumber, pickle, gherkin, zucchini, courgette, squash, summer squash, yellow squash,
+        eggplant, aubergine, tomato, cherry tomato, grape tomato, sun dried tomato, bell pepper,
+        pepper, capsicum, jalapeno, chili pepper, chile, poblano, serrano, habanero, onion,
+        red onion, green onion, spring onion, scallion, shallot, leek, garlic, chive, carrot,
+        baby carrot, beet, beetroot, radish, daikon, turnip, rutabaga, celeriac, fennel,
+        artichoke, mushroom, portobello, shiitake, cremini, button mushroom, enoki, bean sprout,
+        alfalfa sprout, sprout, watercress, endive, radicchio, frisee, microgreens, seaweed,
+        nori, kelp, wakame, coleslaw, slaw, crudites, ratatouille, stir fried vegetables,
+        mixed vegetables, grilled vegetables, roasted vegetables, steamed vegetables, herb,
+        parsley, cilantro, coriander, basil, mint, dill, rosemary, thyme, oregano, sage,
+        water chestnut, bamboo shoot, jicama, kohlrabi, tomatillo, salsa verde, pico de gallo
+    """,
+    "starchy_vegetable": """
+        potato, baked potato, boiled potato, mashed potato, roast potato, roasted potato,
+        new potato, red potato, russet, yukon gold, sweet potato, yam, mashed sweet potato,
+        corn, sweet corn, corn on the cob, corn kernel, peas, green peas, garden peas,
+        mushy peas, pumpkin, butternut squash, acorn squash, spaghetti squash, parsnip,
+        cassava, yuca, taro, plantain, boiled plantain, potato salad, scalloped potato,
+        au gratin potato, potato wedge, roasted root vegetables
+    """,
+    "fruit": """
+        fruit, fruit salad, fruit cup, apple, green apple, pear, peach, nectarine, plum, prune,
+        apricot, cherry, sour cherry, grape, raisin, sultana, currant, banana, orange,
+        mandarin, clementine, tangerine, satsuma, grapefruit, lemon, lime, kiwi, kiwifruit,
+        mango, papaya, pineapple, passion fruit, guava, lychee, longan, rambutan, dragon fruit,
+        pitaya, jackfruit, durian, persimmon, pomegranate, fig, date, medjool date,
+        strawberry, blueberry, raspberry, blackberry, cranberry, gooseberry, boysenberry,
+        mulberry, elderberry, acai, berry, mixed berries, melon, watermelon, cantaloupe,
+        honeydew, coconut flesh, olive, avocado, guacamole, applesauce, dried fruit,
+        dried apricot, dried cranberry, dried mango, fruit compote, starfruit, quince, kumquat
+    """,
+    "meat": """
+        meat, red meat, beef, steak, sirloin, ribeye, rib eye, t bone, filet mignon, tenderloin,
+        flank steak, skirt steak, brisket, roast beef, pot roast, ground beef, minced beef,
+        mince, beef patty, meatball, meatloaf, veal, lamb, lamb chop, rack of lamb, mutton,
+        goat, pork, pork chop, pork loin, pork belly, pulled pork, carnitas, ham, prosciutto,
+        bacon, pancetta, sausage, bratwurst, chorizo, kielbasa, pepperoni, salami, hot dog,
+        frankfurter, wiener, bologna, pastrami, corned beef, jerky, beef jerky, rib,
+        spare rib, baby back rib, short rib, venison, bison, rabbit, liver, kidney, oxtail,
+        gyro meat, doner, kebab, shish kebab, kofta, bulgogi, carne asada, barbacoa, chop,
+        cutlet, schnitzel, burger patty, lamb shank, osso buco, sweetbread
+    """,
+    "poultry": """
+        chicken, chicken breast, chicken thigh, chicken leg, drumstick, chicken wing, wing,
+        buffalo wing, chicken tender, chicken strip, rotisserie chicken, roast chicken,
+        grilled chicken, baked chicken, chicken nugget, nugget, popcorn chicken, chicken salad,
+        turkey, turkey breast, roast turkey, ground turkey, turkey bacon, duck, duck breast,
+        confit, goose, quail, cornish hen, hen, poultry, tandoori chicken, chicken tikka,
+        teriyaki chicken, chicken satay, satay, shawarma, chicken shawarma, jerk chicken,
+        pulled chicken, shredded chicken
+    """,
+    "fish": """
+        fish, seafood, salmon, smoked salmon, lox, tuna, ahi, canned tuna, tuna salad, cod,
+        haddock, pollock, halibut, tilapia, trout, catfish, bass, sea bass, snapper, grouper,
+        mahi mahi, swordfish, mackerel, sardine, anchovy, herring, sole, flounder, plaice,
+        carp, perch, pike, eel, unagi, sashimi, sushi, nigiri, poke, ceviche, shrimp, prawn,
+        scampi, lobster, crab, crab cake, crawfish, crayfish, clam, mussel, oyster, scallop,
+        squid, calamari, octopus, fish fillet, fish stick, fish finger, fish and chips,
+        fish cake, roe, caviar, surimi, imitation crab
+    """,
+    "egg": """
+        egg, fried egg, boiled egg, hard boiled egg, soft boiled egg, poached egg,
+        scrambled egg, scrambled eggs, deviled egg, egg white, egg yolk, omelet, omelette,
+        frittata, quiche, shakshuka, eggs benedict, egg salad, tamagoyaki
+    """,
+    "legume": """
+        legume, bean, beans, black bean, kidney bean, pinto bean, navy bean, cannellini bean,
+        white bean, lima bean, butter bean, fava bean, broad bean, mung bean, adzuki bean,
+        baked beans, refried beans, chickpea, garbanzo, hummus, falafel, lentil, red lentil,
+        green lentil, dal, dhal, daal, split pea, black eyed pea, edamame, soybean, tofu,
+        tempeh, seitan, chana masala, bean salad, three bean salad, chili beans
+    """,
+    "nut": """
+        nut, mixed nuts, almond, walnut, pecan, cashew, pistachio, hazelnut, macadamia,
+        brazil nut, pine nut, peanut, peanut butter, almond butter, cashew butter, nut butter,
+        seed, sunflower seed, pumpkin seed, pepita, chia seed, flaxseed, flax seed,
+        sesame seed, hemp seed, tahini, trail mix, coconut, desiccated coconut
+    """,
+    "grain": """
+        grain, cereal, breakfast cereal, granola, muesli, oat, rolled oats, bran, corn flakes,
+        flour, wheat, whole wheat, barley, rye, cornmeal, semolina, crispbread, rice cake,
+        puffed rice, wheat germ
+    """,
+    "cooked_grain": """
+        rice, white rice, brown rice, fried rice, jasmine rice, basmati rice, wild rice,
+        sticky rice, rice pilaf, pilaf, pilau, biryani, risotto, paella, congee, porridge,
+        oatmeal, grits, polenta, quinoa, couscous, bulgur, farro, buckwheat, kasha, millet,
+        pasta, spaghetti, penne, fusilli, rigatoni, linguine, fettuccine, macaroni, lasagne
+        sheet, orzo, tortellini, ravioli, gnocchi, noodle, egg noodle, rice noodle, ramen,
+        udon, soba, lo mein, chow mein, pad thai, vermicelli, glass noodle, spaetzle
+    """,
+    "bread": """
+        bread, white bread, whole wheat bread, wholemeal bread, sourdough, rye bread,
+        multigrain bread, toast, roll, bread roll, dinner roll, bun, hamburger bun, baguette,
+        ciabatta, focaccia, brioche, challah, pita, pita bread, naan, chapati, roti, paratha,
+        tortilla, flour tortilla, corn tortilla, wrap, flatbread, bagel, english muffin,
+        croissant, biscuit, scone, cornbread, garlic bread, breadstick, crouton, pretzel,
+        waffle, pancake, crepe, french toast, arepa, injera, matzo, cracker bread
+    """,
+    "dairy": """
+        dairy, milk, whole milk, skim milk, low fat milk, chocolate milk, yogurt, yoghurt,
+        greek yogurt, frozen yogurt, kefir, buttermilk, cream, whipped cream, sour cream,
+        creme fraiche, cottage cheese, ricotta, quark, skyr, custard, lassi, raita, tzatziki,
+        condensed milk, evaporated milk, milkshake, smoothie bowl
+    """,
+    "cheese": """
+        cheese, cheddar, mozzarella, parmesan, parmigiano, pecorino, gouda, edam, brie,
+        camembert, swiss cheese, emmental, gruyere, provolone, monterey jack, pepper jack,
+        colby, feta, goat cheese, chevre, halloumi, paneer, blue cheese, gorgonzola,
+        roquefort, stilton, manchego, havarti, muenster, american cheese, cream cheese,
+        mascarpone, queso, queso fresco, cheese sauce, fondue, grilled cheese
+    """,
+    "fat": """
+        butter, margarine, ghee, lard, shortening, oil, olive oil, vegetable oil, canola oil,
+        coconut oil, sesame oil, sunflower oil, avocado oil, dripping, tallow, mayonnaise,
+        mayo, aioli
+    """,
+    "sauce": """
+        sauce, gravy, dressing, salad dressing, ranch, ranch dressing, vinaigrette,
+        balsamic vinaigrette, caesar dressing, blue cheese dressing, thousand island,
+        ketchup, catsup, mustard, barbecue sauce, bbq sauce, hot sauce, sriracha, soy sauce,
+        teriyaki sauce, hoisin, oyster sauce, fish sauce, sweet chili sauce, pesto,
+        marinara, tomato sauce, pasta sauce, alfredo sauce, bechamel, hollandaise,
+        tartar sauce, cocktail sauce, salsa, chutney, relish, curry sauce, tikka masala sauce,
+        peanut sauce, honey mustard, dip, spinach dip, queso dip, jam, jelly, marmalade,
+        preserves, honey, maple syrup, syrup, nutella, chocolate spread
+    """,
+    "soup": """
+        soup, broth, stock, bone broth, consomme, bouillon, chicken soup, chicken noodle soup,
+        tomato soup, vegetable soup, minestrone, miso soup, lentil soup, pea soup,
+        split pea soup, bean soup, french onion soup, clam chowder, chowder, bisque,
+        gazpacho, borscht, pho, ramen broth, wonton soup, hot and sour soup, tom yum,
+        tom kha, egg drop soup, mulligatawny, pozole, menudo
+    """,
+    "mixed_dish": """
+        casserole, stew, beef stew, irish stew, goulash, chili, chili con carne, curry,
+        green curry, red curry, massaman curry, korma, tikka masala, butter chicken,
+        vindaloo, rogan josh, stir fry, stir fried, teriyaki, sweet and sour, kung pao,
+        general tso, orange chicken, fajita, enchilada, burrito, burrito bowl, quesadilla,
+        taco, tamale, nachos, lasagna, lasagne, moussaka, shepherds pie, cottage pie,
+        pot pie, chicken pot pie, pie, empanada, samosa, dumpling, gyoza, potsticker,
+        dim sum, bao, spring roll, egg roll, sandwich, sub, hoagie, panini, club sandwich,
+        blt, wrap sandwich, pasta bake, mac and cheese, macaroni and cheese, spaghetti
+        bolognese, bolognese, carbonara, stroganoff, jambalaya, gumbo, bibimbap, katsu,
+        katsu curry, donburi, poke bowl, buddha bowl, grain bowl, bowl, platter, meal,
+        dinner plate, plate lunch, stuffed pepper, cabbage roll, pierogi, croquette
+    """,
+    "fast_food": """
+        pizza, pizza slice, pepperoni pizza, cheese pizza, calzone, burger, hamburger,
+        cheeseburger, veggie burger, chicken sandwich, fried chicken, chicken fried steak,
+        fries, french fries, chips, fish and chips, curly fries, sweet potato fries,
+        tater tot, hash brown, onion ring, mozzarella stick, corn dog, fried fish, tempura,
+        fried shrimp, fried rice, poutine, loaded fries, sloppy joe, philly cheesesteak,
+        cheesesteak, fried, deep fried, breaded
+    """,
+    "snack": """
+        snack, potato chip, potato chips, crisps, tortilla chip, tortilla chips, corn chip,
+        pita chip, cracker, saltine, graham cracker, popcorn, pretzels, cheese puff,
+        granola bar, protein bar, energy bar, cereal bar, rice cracker, pork rind,
+        veggie chips, banana chips, snack mix
+    """,
+    "dessert": """
+        dessert, cake, chocolate cake, cheesecake, carrot cake, cupcake, muffin, brownie,
+        blondie, cookie, biscotti, macaron, macaroon, shortbread, pie slice, apple pie,
+        pumpkin pie, pecan pie, tart, fruit tart, pastry, danish, eclair, cream puff,
+        profiterole, cannoli, baklava, churro, donut, doughnut, cinnamon roll, sticky bun,
+        ice cream, gelato, sorbet, sherbet, frozen custard, sundae, popsicle, pudding,
+        rice pudding, bread pudding, mousse, tiramisu, panna cotta, creme brulee, flan,
+        trifle, cobbler, crumble, crisp, candy, chocolate, chocolate bar, dark chocolate,
+        milk chocolate, truffle, fudge, caramel, toffee, marshmallow, gummy, gummy bear,
+        lollipop, licorice, jelly bean, frosting, icing, whipped topping, sweet, mochi,
+        halva, gulab jamun, jalebi, pavlova, meringue, strudel, stollen, waffle cone
+    """,
+    "beverage": """
+        beverage, drink, water, sparkling water, juice, orange juice, apple juice,
+        grape juice, cranberry juice, lemonade, limeade, soda, cola, soft drink, pop,
+        ginger ale, root beer, energy drink, sports drink, iced tea, sweet tea, tea,
+        green tea, black tea, herbal tea, chai, chai latte, coffee, espresso, americano,
+        latte, cappuccino, flat white, macchiato, mocha, cold brew, frappuccino, hot chocolate,
+        cocoa, smoothie, protein shake, shake, kombucha, beer, lager, ale, wine, red wine,
+        white wine, cider, cocktail, margarita, sangria, coconut water, almond milk,
+        oat milk, soy milk
+    """,
+}
+
+# Irregular or uncountable forms the suffix rules below would get wrong
+_IRREGULAR_PLURALS = {
+    "leaf": "leaves",
+    "loaf": "loaves",
+    "knife": "knives",
+    "tooth": "teeth",
+    "goose": "geese",
+    "fish": "fish",
+    "shrimp": "shrimp",
+    "sheep": "sheep",
+    "salmon": "salmon",
+    "tuna": "tuna",
+    "cod": "cod",
+    "trout": "trout",
+    "squid": "squid",
+    "venison": "venison",
+    "bison": "bison",
+    "seafood": "seafood",
+}
+
+
+def normalize_text(text):
+    """Lowercase, strip accents and collapse everything but letters and digits to single spaces"""
+    text = unicodedata.normalize("NFKD", text or "")
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    text = text.lower().replace("'", "")
+    return " ".join(re.findall(r"[a-z0-9]+", text))
+
+
+def plural_forms(term):
+    """Return the plural(s) of a term, inflecting only its last word"""
+    head, _, last = term.rpartition(" ")
+    prefix = head + " " if head else ""
+    if last in _IRREGULAR_PLURALS:
+        return [prefix + _IRREGULAR_PLURALS[last]]
+    if last.endswith(("s", "x", "z", "ch", "sh")):
+        forms = [last + "es"]
+    elif last.endswith("y") and len(last) > 1 and last[-2] not in "aeiou":
+        forms = [last[:-1] + "ies"]
+    elif last.endswith("o"):
+        forms = [last + "es", last + "s"]
+    elif last.endswith("f"):
+        forms = [last[:-1] + "ves", last + "s"]
+    else:
+        forms = [last + "s"]
+    return [prefix + form for form in forms]
+
+
+def iter_lexicon_terms():
+    """Yield (term, category) for every lexicon entry and its plurals"""
+    for category, terms in _LEXICON.items():
+        for term in terms.split(","):
+            term = normalize_text(term)
+            if not term:
+                continue
+            yield term, category
+            for form in plural_forms(term):
+                yield form, category
+
+
+class KeywordMatcher:
+    """
+    Aho-Corasick automaton over whole words
+
+    Terms and text are both run through normalize_text and padded with a
+    space on each side, so a match can only start and end at word
+    boundaries ("pea" does not match inside "peach").
+    """
+
+    def __init__(self, terms):
+        # Trie as parallel lists: goto transitions, failure links, and the
+        # (length, value) outputs that end at each state
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+        for term, value in terms:
+            self._add(f" {term} ", value)
+        self._link()
+
+    def __len__(self):
+        return sum(len(outputs) for outputs in self._output)
+
+    def _add(self, pattern, value):
+        state = 0
+        for char in pattern:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            state = next_state
+        # The first category listed for a term wins
+        if not any(length == len(pattern) for length, _ in self._output[state]):
+            self._output[state].append((len(pattern), value))
+
+    def _link(self):
+        """Compute failure links breadth-first and fold in suffix outputs"""
+        queue = list(self._goto[0].values())
+        for state in queue:
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(char, 0)
+                self._fail[next_state] = target if target != next_state else 0
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+
+    def iter_matches(self, text):
+        """Yield (end, length, value) for every term found in text, in one pass"""
+        padded = f" {normalize_text(text)} "
+        goto, fail, output = self._goto, self._fail, self._output
+        state = 0
+        for end, char in enumerate(padded, 1):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for length, value in output[state]:
+                yield end, length, value
+
+    def best_match(self, text):
+        """
+        Return the value of the longest match, or None
+
+        Ties go to the rightmost match, since in English food names the
+        last noun is usually the head ("chocolate cake" is a cake).
+        """
+        best = None
+        for end, length, value in self.iter_matches(text):
+            if best is None or (length, end) > best[:2]:
+                best = (length, end, value)
+        return best[2] if best else None
+
+
+_matcher = None
+_matcher_lock = threading.Lock()
+
+
+def get_matcher():
+    """Compile the lexicon on first use and reuse it afterwards"""
+    global _matcher
+    if _matcher is None:
+        with _matcher_lock:
+            if _matcher is None:
+                _matcher = KeywordMatcher(iter_lexicon_terms())
+    return _matcher
+
+
+def categorize_food(name, description=""):
+    """
+    Return the category for a food item, or "default" if nothing matches
+
+    The name is tried first; the description only fills in when the name
+    itself is unrecognized.
+    """
+    matcher = get_matcher()
+    for text in (name, description):
+        category = matcher.best_match(text)
+        if category is not None:
+            return category
+    return "default"
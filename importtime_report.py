@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Import-time report for cold starts
+
+Imports a module in fresh interpreters with `python -X importtime`, parses
+the timings it writes to stderr and reports the slowest imports by
+cumulative and self time, plus totals per top-level package. Save a run
+with --json and pass it back with --baseline to see what changed between
+releases.
+
+Usage:
+    python importtime_report.py                      # report for "import app"
+    python importtime_report.py vercel --runs 7 --top 15
+    python importtime_report.py --json importtime.json
+    python importtime_report.py --baseline importtime.json
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# `import time: self [us] | cumulative | imported package`
+_LINE_PREFIX = "import time:"
+
+
+def parse_importtime(stderr):
+    """
+    Parse -X importtime output into a list of (module, self_us, cumulative_us, depth)
+
+    Depth is the nesting level of the import, taken from the indentation of
+    the module name (0 for imports made directly by the measured code).
+    """
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith(_LINE_PREFIX):
+            continue
+        fields = line[len(_LINE_PREFIX):].split("|")
+        if len(fields) != 3:
+            continue
+        try:
+            self_us = int(fields[0])
+            cumulative_us = int(fields[1])
+        except ValueError:
+            continue  # the header line
+        name = fields[2].rstrip()
+        # One leading space, then two per nesting level
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        entries.append((name.strip(), self_us, cumulative_us, depth))
+    return entries
+
+
+def run_once(module, python=sys.executable, env=None):
+    """Import module in a fresh interpreter and return (wall_ms, entries)"""
+    started = time.perf_counter()
+    result = subprocess.run(
+        [python, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        env=env,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    wall_ms = (time.perf_counter() - started) * 1000
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+    return wall_ms, parse_importtime(result.stderr)
+
+
+def benchmark(module, runs=5, python=sys.executable):
+    """
+    Import module `runs` times and return a report with median timings
+
+    Placeholder API keys are set if missing so the app's startup check
+    passes; nothing is contacted at import.
+    """
+    env = dict(os.environ)
+    env.setdefault("OPENAI_API_KEY", "importtime-placeholder")
+    env.setdefault("USDA_API_KEY", "importtime-placeholder")
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+
+    # The first run compiles bytecode; time the warm runs after it
+    run_once(module, python, env)
+
+    walls = []
+    self_times = {}
+    cumulative_times = {}
+    depths = {}
+    for _ in range(runs):
+        wall_ms, entries = run_once(module, python, env)
+        walls.append(wall_ms)
+        for name, self_us, cumulative_us, depth in entries:
+            self_times.setdefault(name, []).append(self_us)
+            cumulative_times.setdefault(name, []).append(cumulative_us)
+            depths[name] = depth
+
+    modules = {
+        name: {
+            "self_us": int(statistics.median(self_times[name])),
+            "cumulative_us": int(statistics.median(cumulative_times[name])),
+            "depth": depths[name],
+        }
+        for name in self_times
+    }
+    packages = {}
+    for name, timing in modules.items():
+        package = name.split(".")[0]
+        packages[package] = packages.get(package, 0) + timing["self_us"]
+
+    return {
+        "module": module,
+        "python": sys.version.split()[0],
+        "runs": runs,
+        "wall_ms": round(statistics.median(walls), 1),
+        "import_us": sum(t["cumulative_us"] for t in modules.values() if t["depth"] == 0),
+        "module_count": len(modules),
+        "modules": modules,
+        "packages": packages,
+    }
+
+
+def _format_delta(current, previous):
+    if previous is None:
+        return "     new"
+    delta = current - previous
+    return f"{delta / 1000:+8.1f}"
+
+
+def print_report(report, top=20, baseline=None):
+    base_modules = (baseline or {}).get("modules", {})
+    base_packages = (baseline or {}).get("packages", {})
+
+    print(f"import {report['module']} (Python {report['python']}, median of {report['runs']} runs)")
+    line = f"  process wall time: {report['wall_ms']:.1f} ms, imports: {report['import_us'] / 1000:.1f} ms"
+    if baseline:
+        line += (f" (baseline {baseline['wall_ms']:.1f} ms / {baseline['import_us'] / 1000:.1f} ms,"
+                 f" {(report['import_us'] - baseline['import_us']) / 1000:+.1f} ms)")
+    print(line)
+    print(f"  modules imported: {report['module_count']}")
+
+    delta_header = "  delta ms" if baseline else ""
+
+    print(f"\nSlowest imports by cumulative time{delta_header}")
+    by_cumulative = sorted(report["modules"].items(), key=lambda item: item[1]["cumulative_us"], reverse=True)
+    for name, timing in by_cumulative[:top]:
+        row = f"  {timing['cumulative_us'] / 1000:9.1f} ms  {name}"
+        if baseline:
+            previous = base_modules.get(name, {}).get("cumulative_us")
+            row = f"{row:<60}{_format_delta(timing['cumulative_us'], previous)}"
+        print(row)
+
+    print(f"\nSlowest imports by self time{delta_header}")
+    by_self = sorted(report["modules"].items(), key=lambda item: item[1]["self_us"], reverse=True)
+    for name, timing in by_self[:top]:
+        row = f"  {timing['self_us'] / 1000:9.1f} ms  {name}"
+        if baseline:
+            previous = base_modules.get(name, {}).get("self_us")
+            row = f"{row:<60}{_format_delta(timing['self_us'], previous)}"
+        print(row)
+
+    print(f"\nSelf time per top-level package{delta_header}")
+    by_package = sorted(report["packages"].items(), key=lambda item: item[1], reverse=True)
+    for package, self_us in by_package[:top]:
+        row = f"  {self_us / 1000:9.1f} ms  {package}"
+        if baseline:
+            row = f"{row:<60}{_format_delta(self_us, base_packages.get(package))}"
+        print(row)
+
+    if baseline:
+        gone = sorted(set(base_packages) - set(report["packages"]))
+        if gone:
+            print(f"\nNo longer imported: {', '.join(gone)}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Report import-time cost of a module")
+    parser.add_argument("module", nargs="?", default="app", help="Module to import (default: app)")
+    parser.add_argument("--runs", type=int, default=5, help="Timed runs; medians are reported")
+    parser.add_argument("--top", type=int, default=20, help="Rows per table")
+    parser.add_argument("--python", default=sys.executable, help="Interpreter to measure")
+    parser.add_argument("--json", metavar="PATH", help="Also write the full report as JSON")
+    parser.add_argument("--baseline", metavar="PATH", help="JSON report to compare against")
+    args = parser.parse_args(argv)
+
+    report = benchmark(args.module, runs=args.runs, python=args.python)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    print_report(report, top=args.top, baseline=baseline)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
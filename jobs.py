@@ -0,0 +1,136 @@
+"""
+Background job queue for asynchronous meal analysis.
+
+A backend accepts a payload, runs it through a handler on its own workers
+and keeps the outcome around for a while so clients can poll for it. The
+default InProcessJobBackend uses a bounded thread pool inside the web
+process; another backend (a shared queue, or a local stand-in for one in
+tests) can be plugged in with load_job_backend("package.module:ClassName").
+"""
+
+import importlib
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+QUEUED = "queued"
+RUNNING = "running"
+FINISHED = "finished"
+FAILED = "failed"
+
+
+class JobQueueFull(Exception):
+    """Raised when a backend refuses new work because too many jobs are waiting"""
+
+
+class JobBackend:
+    """
+    Interface every job backend implements
+
+    Backends are constructed with the handler that processes a payload and
+    returns a JSON-serializable result, plus backend-specific options.
+    """
+
+    def __init__(self, handler, **options):
+        self.handler = handler
+
+    def submit(self, payload):
+        """Queue a payload and return the new job id"""
+        raise NotImplementedError
+
+    def get(self, job_id):
+        """Return the job's public record, or None if unknown or expired"""
+        raise NotImplementedError
+
+    def stats(self):
+        """Return queue counters for diagnostics"""
+        return {}
+
+    def shutdown(self):
+        """Stop accepting work and release workers"""
+
+
+class InProcessJobBackend(JobBackend):
+    """
+    Runs jobs on a bounded thread pool and keeps records in memory
+    """
+
+    def __init__(self, handler, max_workers=4, max_pending=100, result_ttl=3600):
+        super().__init__(handler)
+        self.max_pending = max_pending
+        self.result_ttl = result_ttl
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="analysis-job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, payload):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            waiting = sum(1 for job in self._jobs.values() if job["status"] in (QUEUED, RUNNING))
+            if waiting >= self.max_pending:
+                raise JobQueueFull(f"Too many pending jobs ({waiting})")
+            self._jobs[job_id] = {
+                "id": job_id,
+                "status": QUEUED,
+                "created_at": now,
+                "started_at": None,
+                "finished_at": None,
+                "expires_at": None,
+            }
+        self._executor.submit(self._run, job_id, payload)
+        return job_id
+
+    def _run(self, job_id, payload):
+        self._update(job_id, status=RUNNING, started_at=time.time())
+        try:
+            result = self.handler(payload)
+            update = {"status": FINISHED, "result": result}
+        except Exception as e:
+            update = {"status": FAILED, "error": str(e)}
+        now = time.time()
+        self._update(job_id, finished_at=now, expires_at=now + self.result_ttl, **update)
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job.update(fields)
+
+    def _expire(self, now):
+        """Drop finished jobs whose results have expired (caller holds the lock)"""
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job["expires_at"] is not None and job["expires_at"] <= now
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def get(self, job_id):
+        with self._lock:
+            self._expire(time.time())
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def stats(self):
+        with self._lock:
+            counts = {QUEUED: 0, RUNNING: 0, FINISHED: 0, FAILED: 0}
+            for job in self._jobs.values():
+                counts[job["status"]] += 1
+            return counts
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+
+def load_job_backend(spec, handler, **options):
+    """
+    Build a backend from a "module:ClassName" spec, or the in-process one if spec is empty
+    """
+    if not spec:
+        return InProcessJobBackend(handler, **options)
+    module_name, _, class_name = spec.partition(":")
+    backend_class = getattr(importlib.import_module(module_name), class_name)
+    return backend_class(handler, **options)
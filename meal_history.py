@@ -0,0 +1,325 @@
+"""
+Per-user history of analyzed meals with daily and weekly macro totals.
+
+Meals live in a SQLite table next to a rollup table holding, per user and
+per day and ISO week, the meal count and the summed calories, proteins,
+fats and carbs. Triggers on the meals table keep the rollups current on
+every insert, update and delete, inside the same transaction, so summary
+and trend queries read one precomputed row per period instead of the raw
+history.
+
+A meal's day is the calendar date of eaten_at in the UTC offset it was
+given with (UTC if it has none), so meals land on the day the user ate
+them; its week is the Monday starting that day's ISO week.
+"""
+
+import json
+import os
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta, timezone
+
+from api.calendar.times import InvalidTime, parse_datetime
+from nutrients import MACRO_KEYS
+
+PERIODS = ("day", "week")
+# Periods a summary may span, so zero-filled trends stay bounded
+MAX_SUMMARY_PERIODS = 366
+
+USER_ID_PATTERN = re.compile(r'^[A-Za-z0-9._:@-]{1,128}$')
+
+# Fields of an analysis result kept with a meal
+MEAL_FIELDS = ("meal_description", "plate_size", "total_nutrition", "total_nutrients", "food_items", "note")
+
+
+class InvalidMeal(ValueError):
+    """Raised for a meal entry or summary query that can't be stored or answered"""
+
+
+def _rollup_sql(row, sign):
+    """Statements adding (sign 1) or removing (sign -1) a NEW/OLD meal row from its day and week rollups"""
+    macros = ", ".join(MACRO_KEYS)
+    values = ", ".join(f"{sign} * {row}.{key}" for key in MACRO_KEYS)
+    updates = ", ".join(f"{key} = {key} + excluded.{key}" for key in MACRO_KEYS)
+    return "".join(
+        f"INSERT INTO meal_rollups (user_id, period, start, meals, {macros})"
+        f" VALUES ({row}.user_id, '{period}', {row}.{period}, {sign}, {values})"
+        f" ON CONFLICT (user_id, period, start) DO UPDATE SET meals = meals + excluded.meals, {updates};"
+        for period in PERIODS
+    )
+
+
+# Drops the rollups a deleted or moved meal leaves empty
+_PRUNE_SQL = (
+    "DELETE FROM meal_rollups WHERE user_id = OLD.user_id AND meals <= 0"
+    " AND ((period = 'day' AND start = OLD.day) OR (period = 'week' AND start = OLD.week));"
+)
+
+
+def period_start(day, period):
+    """The first day of the period holding a date"""
+    return day - timedelta(days=day.weekday()) if period == "week" else day
+
+
+def _parse_day(value, name):
+    try:
+        return date.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise InvalidMeal(f"{name} must be a date like 2024-06-03")
+
+
+def validate_meal_fields(eaten_at=None, event_id=None):
+    """
+    Check a meal's eaten_at and event_id and return them as stored
+
+    eaten_at must be an ISO 8601 time and defaults to now; event_id becomes
+    a string, or stays None.
+    """
+    if eaten_at:
+        try:
+            parse_datetime(eaten_at)
+        except (InvalidTime, TypeError):
+            raise InvalidMeal(f"eaten_at must be an ISO 8601 time, got {eaten_at!r}")
+    else:
+        eaten_at = datetime.now(timezone.utc).isoformat(timespec="seconds").replace("+00:00", "Z")
+    return eaten_at, (None if event_id is None else str(event_id))
+
+
+def meal_from_analysis(analysis, eaten_at=None, event_id=None):
+    """
+    Build a meal entry from an /analyze result (or a client's copy of one)
+
+    eaten_at is an ISO 8601 time and defaults to now; event_id links the
+    meal to a calendar event.
+    """
+    if not isinstance(analysis, dict):
+        raise InvalidMeal("A meal must be a JSON object")
+    # A whole /analyze response carries the analysis under "data"
+    if isinstance(analysis.get("data"), dict):
+        eaten_at = eaten_at or analysis.get("eaten_at")
+        event_id = event_id or analysis.get("event_id")
+        analysis = analysis["data"]
+    totals = analysis.get("total_nutrition")
+    if not isinstance(totals, dict):
+        raise InvalidMeal("total_nutrition is required")
+    meal = {key: analysis[key] for key in MEAL_FIELDS if key in analysis}
+    try:
+        meal["total_nutrition"] = {key: float(totals.get(key) or 0) for key in MACRO_KEYS}
+    except (TypeError, ValueError):
+        raise InvalidMeal(f"total_nutrition values must be numbers: {', '.join(MACRO_KEYS)}")
+
+    meal["eaten_at"], event_id = validate_meal_fields(
+        eaten_at or analysis.get("eaten_at"), event_id or analysis.get("event_id")
+    )
+    if event_id is not None:
+        meal["event_id"] = event_id
+    return meal
+
+
+class MealHistory:
+    """
+    Meals and their rollups in a SQLite file shared by every process that opens it
+    """
+
+    def __init__(self, path, timeout=5.0):
+        self.path = path
+        self.timeout = timeout
+        self._conn = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        """Open this process's connection and create the schema on first use (caller holds the lock)"""
+        if self._conn is None or self._pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=self.timeout,
+                                   isolation_level=None, cached_statements=64)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._create_schema(conn)
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+            self._conn = conn
+            self._pid = os.getpid()
+        return self._conn
+
+    @staticmethod
+    def _create_schema(conn):
+        macros = "".join(f" {key} REAL NOT NULL," for key in MACRO_KEYS)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS meals ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " user_id TEXT NOT NULL,"
+            " eaten_at REAL NOT NULL,"
+            " day TEXT NOT NULL,"
+            " week TEXT NOT NULL,"
+            " event_id TEXT,"
+            f"{macros}"
+            " data TEXT NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS meals_user_time ON meals (user_id, eaten_at, id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS meals_event ON meals (event_id) WHERE event_id IS NOT NULL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS meal_rollups ("
+            " user_id TEXT NOT NULL,"
+            " period TEXT NOT NULL,"
+            " start TEXT NOT NULL,"
+            " meals INTEGER NOT NULL,"
+            f"{macros}"
+            " PRIMARY KEY (user_id, period, start)) WITHOUT ROWID"
+        )
+        conn.execute(
+            f"CREATE TRIGGER IF NOT EXISTS meals_rollup_insert AFTER INSERT ON meals BEGIN {_rollup_sql('NEW', 1)} END"
+        )
+        conn.execute(
+            f"CREATE TRIGGER IF NOT EXISTS meals_rollup_delete AFTER DELETE ON meals BEGIN {_rollup_sql('OLD', -1)}"
+            f" {_PRUNE_SQL} END"
+        )
+        conn.execute(
+            f"CREATE TRIGGER IF NOT EXISTS meals_rollup_update AFTER UPDATE ON meals BEGIN {_rollup_sql('OLD', -1)}"
+            f" {_rollup_sql('NEW', 1)} {_PRUNE_SQL} END"
+        )
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._connect().execute(sql, params).fetchall()
+
+    @staticmethod
+    def _row(user_id, meal):
+        """Column values for a meal: (user_id, eaten_at, day, week, event_id, macros..., data)"""
+        eaten_at = parse_datetime(meal["eaten_at"])
+        if eaten_at.tzinfo is None:
+            eaten_at = eaten_at.replace(tzinfo=timezone.utc)
+        day = eaten_at.date()
+        totals = meal["total_nutrition"]
+        return (user_id, eaten_at.timestamp(), day.isoformat(), period_start(day, "week").isoformat(),
+                meal.get("event_id"), *(totals[key] for key in MACRO_KEYS), json.dumps(meal))
+
+    @staticmethod
+    def _decode(row):
+        return dict(json.loads(row[1]), id=str(row[0]))
+
+    def add(self, user_id, meal):
+        """Store a meal built with meal_from_analysis and return it with its id"""
+        columns = ", ".join(MACRO_KEYS)
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                f"INSERT INTO meals (user_id, eaten_at, day, week, event_id, {columns}, data)"
+                f" VALUES (?, ?, ?, ?, ?, {', '.join('?' for _ in MACRO_KEYS)}, ?)",
+                self._row(user_id, meal)
+            )
+        return dict(meal, id=str(cursor.lastrowid))
+
+    def get(self, user_id, meal_id):
+        rows = self._query("SELECT id, data FROM meals WHERE id = ? AND user_id = ?", (meal_id, user_id))
+        return self._decode(rows[0]) if rows else None
+
+    def replace(self, user_id, meal_id, meal):
+        """Replace a meal, keeping its id; returns None if the user has no such meal"""
+        row = self._row(user_id, meal)
+        assignments = ", ".join(f"{key} = ?" for key in MACRO_KEYS)
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                f"UPDATE meals SET eaten_at = ?, day = ?, week = ?, event_id = ?, {assignments}, data = ?"
+                " WHERE id = ? AND user_id = ?",
+                (*row[1:], meal_id, user_id)
+            )
+            if cursor.rowcount == 0:
+                return None
+        return dict(meal, id=str(meal_id))
+
+    def delete(self, user_id, meal_id):
+        """Remove a meal and return it, or None if the user has no such meal"""
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT id, data FROM meals WHERE id = ? AND user_id = ?", (meal_id, user_id)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute("DELETE FROM meals WHERE id = ?", (row[0],))
+        return self._decode(row)
+
+    def between(self, user_id, start=None, end=None, event_id=None, limit=100):
+        """Return a user's meals eaten in [start, end) (UTC timestamps), oldest first"""
+        sql = "SELECT id, data FROM meals WHERE user_id = ? AND eaten_at >= ? AND eaten_at < ?"
+        params = [user_id, float("-inf") if start is None else start, float("inf") if end is None else end]
+        if event_id is not None:
+            sql += " AND event_id = ?"
+            params.append(event_id)
+        rows = self._query(sql + " ORDER BY eaten_at, id LIMIT ?", (*params, limit))
+        return [self._decode(row) for row in rows]
+
+    def summary(self, user_id, period, first, last):
+        """
+        Return the user's rollups for each period from the one holding date
+        first to the one holding date last, with zeros for periods without meals
+        """
+        if period not in PERIODS:
+            raise InvalidMeal(f"period must be one of {', '.join(PERIODS)}")
+        first, last = period_start(first, period), period_start(last, period)
+        step = timedelta(weeks=1) if period == "week" else timedelta(days=1)
+        count = (last - first) // step + 1
+        if not 1 <= count <= MAX_SUMMARY_PERIODS:
+            raise InvalidMeal(f"A summary covers 1 to {MAX_SUMMARY_PERIODS} periods, from first to last")
+
+        rows = self._query(
+            f"SELECT start, meals, {', '.join(MACRO_KEYS)} FROM meal_rollups"
+            " WHERE user_id = ? AND period = ? AND start >= ? AND start <= ? ORDER BY start",
+            (user_id, period, first.isoformat(), last.isoformat())
+        )
+        found = {row[0]: row[1:] for row in rows}
+        result = []
+        for index in range(count):
+            start = (first + index * step).isoformat()
+            meals, *totals = found.get(start, (0,) + (0.0,) * len(MACRO_KEYS))
+            result.append(dict({"start": start, "meals": meals},
+                               **{key: round(value, 2) for key, value in zip(MACRO_KEYS, totals)}))
+        return result
+
+
+def summarize_periods(rows):
+    """Totals and per-period averages over summary rows, for trend displays"""
+    totals = {key: round(sum(row[key] for row in rows), 2) for key in MACRO_KEYS}
+    meals = sum(row["meals"] for row in rows)
+    average = {key: round(totals[key] / len(rows), 2) for key in MACRO_KEYS} if rows else {}
+    return dict(totals, meals=meals), average
+
+
+def parse_summary_range(period, start, end, today=None):
+    """
+    Resolve a summary's from/to dates; defaults to the 7 days or 8 weeks up to today (UTC)
+    """
+    today = today or datetime.now(timezone.utc).date()
+    last = _parse_day(end, "to") if end else today
+    if start:
+        first = _parse_day(start, "from")
+    else:
+        first = last - (timedelta(weeks=7) if period == "week" else timedelta(days=6))
+    if first > last:
+        raise InvalidMeal("from must not be after to")
+    return first, last
+
+
+def valid_user_id(value):
+    return bool(value) and USER_ID_PATTERN.match(value) is not None
+
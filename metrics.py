@@ -0,0 +1,282 @@
+"""
+In-process metrics and request tracing.
+
+Counters, gauges and histograms live in a process-wide registry and are
+rendered in the Prometheus text exposition format for /metrics. span()
+times one stage of handling a request: the duration always goes into the
+stage latency histogram, and into the request's trace when the client
+asked for one.
+"""
+
+import contextvars
+import math
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# Seconds; covers everything from a cache hit to a slow vision call
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{_escape(value)}"' for name, value in extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _samples(self):
+        """Yield (suffix, label_values, extra_labels, value) for rendering"""
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield "", key, (), value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, key, extra, value in self._samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(self.labelnames, key, extra)} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """Monotonically increasing count"""
+
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """Value that can go up and down, e.g. the size of the last payload"""
+
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Histogram(_Metric):
+    """Distribution of observations in cumulative buckets"""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket (non-cumulative) counts, sum, count
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][index] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def _samples(self):
+        with self._lock:
+            items = [(key, (list(state[0]), state[1], state[2])) for key, state in self._values.items()]
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield "_bucket", key, (("le", _format_value(bound)),), cumulative
+            yield "_bucket", key, (("le", "+Inf"),), count
+            yield "_sum", key, (), total
+            yield "_count", key, (), count
+
+
+class Registry:
+    """
+    Named metrics plus callbacks that refresh gauges right before rendering
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, metric_class, name, documentation, labelnames, **options):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = metric_class(name, documentation, labelnames, **options)
+            elif not isinstance(metric, metric_class):
+                raise ValueError(f"{name} is already registered as a {metric.kind}")
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._get_or_create(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def on_collect(self, callback):
+        """Run callback before every render; use it to copy stats into gauges"""
+        self._callbacks.append(callback)
+        return callback
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format"""
+        for callback in self._callbacks:
+            callback()
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "calai_stage_duration_seconds", "Time spent in each stage of handling a request", ("stage",)
+)
+STAGE_ERRORS = REGISTRY.counter(
+    "calai_stage_errors_total", "Stages that ended with an exception", ("stage",)
+)
+
+
+class Trace:
+    """
+    Spans recorded for one request, shared by every thread working on it
+    """
+
+    def __init__(self, trace_id, record_spans=False):
+        self.trace_id = trace_id
+        self.record_spans = record_spans
+        self.started = time.perf_counter()
+        self._spans = []
+        self._lock = threading.Lock()
+
+    def add(self, name, started, duration, error=None):
+        span = {
+            "name": name,
+            "start_ms": round((started - self.started) * 1000, 2),
+            "duration_ms": round(duration * 1000, 2),
+        }
+        if error is not None:
+            span["error"] = error
+        with self._lock:
+            self._spans.append(span)
+
+    def to_dict(self):
+        with self._lock:
+            spans = sorted(self._spans, key=lambda span: span["start_ms"])
+        return {"id": self.trace_id, "spans": spans}
+
+    def server_timing(self):
+        """Render the spans as a Server-Timing header value, summing repeated stages"""
+        totals = {}
+        with self._lock:
+            for span in self._spans:
+                totals[span["name"]] = totals.get(span["name"], 0) + span["duration_ms"]
+        return ", ".join(f"{name};dur={duration:.2f}" for name, duration in totals.items())
+
+
+_current_trace = contextvars.ContextVar("calai_trace", default=None)
+
+
+def new_trace_id():
+    return uuid.uuid4().hex
+
+
+def start_trace(trace_id=None, record_spans=False):
+    """Make a new trace current for this context and return it"""
+    trace = Trace(trace_id or new_trace_id(), record_spans)
+    _current_trace.set(trace)
+    return trace
+
+
+def end_trace():
+    _current_trace.set(None)
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+def current_trace_id():
+    trace = _current_trace.get()
+    return trace.trace_id if trace is not None else None
+
+
+def bind_context(fn):
+    """
+    Wrap fn so it runs with a copy of the caller's context
+
+    Use it when handing work to a thread pool so spans and log lines in
+    the worker are attributed to the request that queued it. Each call
+    makes its own copy, as one context can't be entered by two threads.
+    """
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        return context.run(fn, *args, **kwargs)
+    return run
+
+
+@contextmanager
+def span(name):
+    """Time a stage, recording it in STAGE_SECONDS and the current trace"""
+    started = time.perf_counter()
+    error = None
+    try:
+        yield
+    except GeneratorExit:
+        # A consumer stopped iterating early; that is not a failure of the stage
+        raise
+    except BaseException as e:
+        error = type(e).__name__
+        STAGE_ERRORS.inc(stage=name)
+        raise
+    finally:
+        duration = time.perf_counter() - started
+        STAGE_SECONDS.observe(duration, stage=name)
+        trace = _current_trace.get()
+        if trace is not None and trace.record_spans:
+            trace.add(name, started, duration, error)
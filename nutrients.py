@@ -0,0 +1,231 @@
+"""
+Fixed-schema nutrient vectors.
+
+Every food is described by one float64 row with a slot per nutrient in
+NUTRIENT_SCHEMA, holding its per-100g amount (NaN when the source doesn't
+report it). Portion scaling and meal totals are then a single NumPy
+multiply and sum over the stacked rows instead of per-key dict arithmetic.
+"""
+
+import numpy as np
+
+# (key, unit, FoodData Central nutrient ids in order of preference)
+NUTRIENT_SCHEMA = (
+    ("calories", "kcal", (1008, 2047, 2048)),  # Energy, then Atwater general/specific energy
+    ("proteins", "g", (1003,)),
+    ("fats", "g", (1004,)),
+    ("carbs", "g", (1005, 1050)),  # by difference, then by summation
+    ("fiber", "g", (1079,)),
+    ("sugars", "g", (2000, 1063)),
+    ("saturated_fat", "g", (1258,)),
+    ("monounsaturated_fat", "g", (1292,)),
+    ("polyunsaturated_fat", "g", (1293,)),
+    ("trans_fat", "g", (1257,)),
+    ("cholesterol", "mg", (1253,)),
+    ("sodium", "mg", (1093,)),
+    ("potassium", "mg", (1092,)),
+    ("calcium", "mg", (1087,)),
+    ("iron", "mg", (1089,)),
+    ("magnesium", "mg", (1090,)),
+    ("phosphorus", "mg", (1091,)),
+    ("zinc", "mg", (1095,)),
+    ("vitamin_a", "µg", (1106,)),  # RAE
+    ("vitamin_c", "mg", (1162,)),
+    ("vitamin_d", "µg", (1114,)),
+    ("vitamin_e", "mg", (1109,)),
+    ("vitamin_k", "µg", (1185,)),
+    ("thiamin", "mg", (1165,)),
+    ("riboflavin", "mg", (1166,)),
+    ("niacin", "mg", (1167,)),
+    ("vitamin_b6", "mg", (1175,)),
+    ("folate", "µg", (1177,)),
+    ("vitamin_b12", "µg", (1178,)),
+    ("water", "g", (1051,)),
+)
+
+# Bump when NUTRIENT_SCHEMA changes so stored vectors are not misread
+SCHEMA_VERSION = 1
+
+NUTRIENT_KEYS = tuple(key for key, _, _ in NUTRIENT_SCHEMA)
+NUTRIENT_UNITS = {key: unit for key, unit, _ in NUTRIENT_SCHEMA}
+NUTRIENT_INDEX = {key: index for index, key in enumerate(NUTRIENT_KEYS)}
+SCHEMA_NUTRIENT_IDS = frozenset(n for _, _, ids in NUTRIENT_SCHEMA for n in ids)
+
+# The four values reported at the top level of every response; they default
+# to 0 rather than unknown, as they always have
+MACRO_KEYS = ("calories", "proteins", "fats", "carbs")
+MACRO_SLOTS = np.array([NUTRIENT_INDEX[key] for key in MACRO_KEYS])
+
+
+def empty_vector():
+    """Return a vector with every nutrient unknown and macros at 0"""
+    vector = np.full(len(NUTRIENT_KEYS), np.nan)
+    vector[MACRO_SLOTS] = 0.0
+    return vector
+
+
+def vector_from_values(values):
+    """Build a vector from a {nutrient_key: amount} mapping"""
+    vector = empty_vector()
+    for key, amount in values.items():
+        vector[NUTRIENT_INDEX[key]] = amount
+    return vector
+
+
+def vector_from_amounts(amounts):
+    """Build a vector from a {fdc_nutrient_id: amount} mapping"""
+    vector = empty_vector()
+    for index, (_, _, nutrient_ids) in enumerate(NUTRIENT_SCHEMA):
+        for nutrient_id in nutrient_ids:
+            amount = amounts.get(nutrient_id)
+            if amount is not None:
+                vector[index] = amount
+                break
+    return vector
+
+
+def vector_from_food_nutrients(food_nutrients):
+    """Build a vector from the foodNutrients list of a FoodData Central search result"""
+    amounts = {}
+    for nutrient in food_nutrients:
+        nutrient_id = nutrient.get("nutrientId")
+        if nutrient_id in SCHEMA_NUTRIENT_IDS and nutrient.get("value") is not None:
+            amounts[nutrient_id] = nutrient["value"]
+    return vector_from_amounts(amounts)
+
+
+def vector_to_json(vector):
+    """Serialize a vector as a schema-tagged JSON-friendly dict (NaN -> None)"""
+    return {
+        "schema": SCHEMA_VERSION,
+        "values": [None if np.isnan(value) else float(value) for value in vector],
+    }
+
+
+def vector_from_json(data):
+    """Inverse of vector_to_json; returns None for data written under another schema"""
+    if not isinstance(data, dict) or data.get("schema") != SCHEMA_VERSION:
+        return None
+    return np.array([np.nan if value is None else value for value in data["values"]], dtype=float)
+
+
+def vector_to_dict(vector):
+    """Map a vector to {nutrient_key: amount}, with None for unknown amounts"""
+    return {
+        key: (None if np.isnan(value) else float(value))
+        for key, value in zip(NUTRIENT_KEYS, vector)
+    }
+
+
+def convert_to_grams(quantity, unit):
+    """Convert various units to grams"""
+    unit = unit.lower()
+    if unit in ["g", "grams"]:
+        return quantity
+    elif unit in ["oz", "ounce", "ounces"]:
+        return quantity * 28.35  # 1 oz = 28.35g
+    elif unit in ["cup", "cups"]:
+        return quantity * 240  # Approximately 240g per cup (varies by food)
+    elif unit in ["tbsp", "tablespoon", "tablespoons"]:
+        return quantity * 15  # Approximately 15g
+    elif unit in ["tsp", "teaspoon", "teaspoons"]:
+        return quantity * 5  # Approximately 5g
+    else:
+        # Default to oz if unit not recognized
+        return quantity * 28.35
+
+
+class FoodNutrition:
+    """
+    One food item of a meal: its portion and its per-100g nutrient vector
+    """
+
+    __slots__ = ("name", "description", "quantity", "unit", "grams", "per_100g", "estimated")
+
+    def __init__(self, name, description, quantity, unit, grams, per_100g, estimated=False):
+        self.name = name
+        self.description = description
+        self.quantity = quantity
+        self.unit = unit
+        self.grams = grams
+        self.per_100g = per_100g
+        self.estimated = estimated
+
+    @classmethod
+    def for_food_item(cls, food_item, per_100g, estimated=False):
+        """Build from a food item of the vision analysis and a per-100g vector"""
+        quantity = float(food_item.get("quantity", 1))
+        unit = food_item.get("unit", "oz")
+        return cls(
+            name=food_item.get("name", ""),
+            description=food_item.get("description", ""),
+            quantity=quantity,
+            unit=unit,
+            grams=convert_to_grams(quantity, unit),
+            per_100g=per_100g,
+            estimated=estimated,
+        )
+
+    def amounts(self):
+        """Nutrient amounts for this portion"""
+        return scale_portions([self])[0]
+
+    def to_dict(self, amounts=None):
+        """Response representation; pass precomputed amounts to skip scaling"""
+        if amounts is None:
+            amounts = self.amounts()
+        result = {
+            "name": self.name,
+            "description": self.description,
+        }
+        for key, slot in zip(MACRO_KEYS, MACRO_SLOTS):
+            result[key] = float(amounts[slot])
+        result["quantity"] = self.quantity
+        result["unit"] = self.unit
+        result["nutrients"] = vector_to_dict(amounts)
+        if self.estimated:
+            result["estimated"] = True  # Flag to indicate this is an estimate
+        return result
+
+
+def scale_portions(items):
+    """
+    Return an (items x nutrients) matrix of amounts for each item's portion
+
+    Standard reference amounts are per 100g. Estimated items are rounded to
+    one decimal, since more precision would be misleading.
+    """
+    if not items:
+        return np.zeros((0, len(NUTRIENT_KEYS)))
+    per_100g = np.vstack([item.per_100g for item in items])
+    scale = np.array([item.grams for item in items], dtype=float) / 100.0
+    amounts = per_100g * scale[:, None]
+    estimated = np.array([item.estimated for item in items])
+    if estimated.any():
+        amounts[estimated] = np.round(amounts[estimated], 1)
+    return amounts
+
+
+def meal_totals(amounts):
+    """
+    Sum a portion matrix into a meal total vector
+
+    A nutrient no item reports stays unknown (NaN) instead of becoming 0.
+    """
+    if amounts.shape[0] == 0:
+        return empty_vector()
+    known = ~np.isnan(amounts)
+    totals = np.nansum(amounts, axis=0)
+    totals[~known.any(axis=0)] = np.nan
+    return totals
+
+
+def summarize_items(items):
+    """
+    Return (item_dicts, total_nutrition, total_nutrients) for a list of FoodNutrition
+    """
+    amounts = scale_portions(items)
+    totals = meal_totals(amounts)
+    item_dicts = [item.to_dict(row) for item, row in zip(items, amounts)]
+    total_nutrition = {key: float(totals[slot]) for key, slot in zip(MACRO_KEYS, MACRO_SLOTS)}
+    return item_dicts, total_nutrition, vector_to_dict(totals)
@@ -0,0 +1,171 @@
+"""
+Two-tier cache for per-100g nutrient values returned by USDA FoodData Central.
+
+Lookups hit an in-process LRU first and fall back to a SQLite store on disk,
+so common foods survive restarts and are shared between worker processes.
+Entries expire after a TTL and both tiers are bounded in size.
+"""
+
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from structured_logging import get_logger
+
+log = get_logger('nutrition')
+
+
+def normalize_food_name(name):
+    """Normalize a food name into a cache key ("Grilled  Chicken!" -> "grilled chicken")"""
+    words = re.findall(r"[a-z0-9]+", (name or "").lower())
+    return " ".join(words)
+
+
+class NutrientCache:
+    """
+    In-process LRU backed by a SQLite table, keyed by normalized food name
+    """
+
+    def __init__(self, path, ttl=7 * 24 * 3600, max_entries=50000, memory_entries=1024):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        self._disk_count = 0
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _connect(self):
+        """Open the SQLite store on first use"""
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS nutrient_cache ("
+                " key TEXT PRIMARY KEY,"
+                " value TEXT NOT NULL,"
+                " expires_at REAL NOT NULL,"
+                " accessed_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS nutrient_cache_accessed "
+                "ON nutrient_cache (accessed_at)"
+            )
+            conn.commit()
+            self._disk_count = conn.execute("SELECT COUNT(*) FROM nutrient_cache").fetchone()[0]
+            self._conn = conn
+        return self._conn
+
+    def _remember(self, key, value, expires_at):
+        """Put an entry in the memory tier, evicting the least recently used"""
+        self._memory[key] = (value, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, food_name):
+        """Return cached per-100g nutrients for a food name, or None"""
+        key = normalize_food_name(food_name)
+        if not key:
+            return None
+        now = time.time()
+
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._memory[key]
+
+            try:
+                conn = self._connect()
+                row = conn.execute(
+                    "SELECT value, expires_at FROM nutrient_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and row[1] > now:
+                    conn.execute(
+                        "UPDATE nutrient_cache SET accessed_at = ? WHERE key = ?", (now, key)
+                    )
+                    conn.commit()
+                    value = json.loads(row[0])
+                    self._remember(key, value, row[1])
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return value
+            except sqlite3.Error as e:
+                log.warning("nutrient_cache_read_failed", error=str(e))
+
+            self.misses += 1
+            return None
+
+    def set(self, food_name, nutrients):
+        """Store per-100g nutrients for a food name in both tiers"""
+        key = normalize_food_name(food_name)
+        if not key:
+            return
+        now = time.time()
+        expires_at = now + self.ttl
+
+        with self._lock:
+            self._remember(key, nutrients, expires_at)
+            try:
+                conn = self._connect()
+                conn.execute(
+                    "INSERT OR REPLACE INTO nutrient_cache (key, value, expires_at, accessed_at) "
+                    "VALUES (?, ?, ?, ?)",
+                    (key, json.dumps(nutrients), expires_at, now)
+                )
+                self._disk_count += 1
+                if self._disk_count > self.max_entries:
+                    self._evict(conn, now)
+                conn.commit()
+            except sqlite3.Error as e:
+                log.warning("nutrient_cache_write_failed", error=str(e))
+
+    def _evict(self, conn, now):
+        """Drop expired rows, then the least recently used ones above the size limit"""
+        removed = conn.execute("DELETE FROM nutrient_cache WHERE expires_at <= ?", (now,)).rowcount
+        count = conn.execute("SELECT COUNT(*) FROM nutrient_cache").fetchone()[0]
+        # Trim to 90% of the limit so eviction doesn't run on every insert
+        target = int(self.max_entries * 0.9)
+        if count > target:
+            removed += conn.execute(
+                "DELETE FROM nutrient_cache WHERE key IN ("
+                " SELECT key FROM nutrient_cache ORDER BY accessed_at LIMIT ?)",
+                (count - target,)
+            ).rowcount
+            count = target
+        self._disk_count = count
+        self.evictions += removed
+
+    def stats(self):
+        """Return hit/miss counters and tier sizes"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "memory_entries": len(self._memory),
+                "disk_entries": self._disk_count,
+            }
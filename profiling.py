@@ -0,0 +1,424 @@
+#!/usr/bin/env python3
+"""
+On-demand request profiler
+
+A request is profiled when it carries a valid signed X-Profile header or is
+picked by PROFILE_SAMPLE_RATE. It then runs under cProfile (for a .pstats
+file) and a wall-clock stack sampler (for a collapsed-stack file that
+flamegraph.pl or speedscope can render). Both are stored in PROFILE_DIR
+under the request id together with a small JSON summary.
+
+The X-Profile header is "<unix timestamp>:<nonce>:<hex HMAC-SHA256>",
+signed with PROFILE_SECRET over "<timestamp>:<nonce>:<request path>". It is
+valid for one minute and, within a process, for one request only, so a
+captured header can't be replayed to keep the profiler running. Generate
+one with:
+
+    PROFILE_SECRET=... python profiling.py sign /analyze
+"""
+
+import cProfile
+import hashlib
+import hmac
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from functools import wraps
+
+from metrics import current_trace_id
+
+SIGNATURE_MAX_AGE = 60  # seconds a signed header stays valid
+SIGNATURE_MAX_SKEW = 60  # seconds a header's timestamp may be ahead of the clock
+
+PROFILE_KINDS = {
+    "pstats": ("{}.pstats", "application/octet-stream"),
+    "collapsed": ("{}.collapsed.txt", "text/plain; charset=utf-8"),
+    "summary": ("{}.json", "application/json"),
+}
+
+# Profile ids end up in file names, so only allow id-like values
+PROFILE_ID_PATTERN = re.compile(r'^[A-Za-z0-9._:-]{1,128}$')
+
+
+def sign_profile_request(secret, path, timestamp=None, nonce=None):
+    """Return an X-Profile header value for a request to path"""
+    timestamp = int(time.time() if timestamp is None else timestamp)
+    nonce = uuid.uuid4().hex if nonce is None else nonce
+    digest = hmac.new(secret.encode(), f"{timestamp}:{nonce}:{path}".encode(), hashlib.sha256).hexdigest()
+    return f"{timestamp}:{nonce}:{digest}"
+
+
+def verify_profile_signature(secret, header, path, now=None):
+    """Check an X-Profile header value against the secret, request path and clock"""
+    if not secret or not header:
+        return False
+    timestamp, _, rest = header.partition(":")
+    nonce, _, digest = rest.partition(":")
+    if not nonce or not digest:
+        return False
+    try:
+        age = (time.time() if now is None else now) - int(timestamp)
+    except ValueError:
+        return False
+    if not -SIGNATURE_MAX_SKEW <= age <= SIGNATURE_MAX_AGE:
+        return False
+    expected = sign_profile_request(secret, path, int(timestamp), nonce).rpartition(":")[2]
+    return hmac.compare_digest(expected, digest)
+
+
+class NonceLog:
+    """
+    Nonces of signed headers already used, each kept until its header expires
+    """
+
+    def __init__(self):
+        self._expires = {}  # nonce -> expiry timestamp
+        self._lock = threading.Lock()
+
+    def use(self, header, now=None):
+        """Record the nonce of a verified header; False if it was used before"""
+        timestamp, _, rest = header.partition(":")
+        nonce = rest.partition(":")[0]
+        now = time.time() if now is None else now
+        with self._lock:
+            for seen, expires in list(self._expires.items()):
+                if expires < now:
+                    del self._expires[seen]
+            if nonce in self._expires:
+                return False
+            self._expires[nonce] = int(timestamp) + SIGNATURE_MAX_AGE
+            return True
+
+
+def _frame_label(code):
+    filename = os.path.basename(code.co_filename)
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})".replace(";", ",")
+
+
+class StackSampler:
+    """
+    Samples one thread's stack on a background thread at a fixed interval
+
+    Unlike cProfile this sees wall-clock time, so time spent blocked on
+    the network shows up where it happens.
+    """
+
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = 0
+        self._counts = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame.f_code))
+                frame = frame.f_back
+            key = ";".join(reversed(stack))
+            self._counts[key] = self._counts.get(key, 0) + 1
+            self.samples += 1
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def collapsed(self):
+        """Return the samples in collapsed-stack format, one "frame;frame;... count" per line"""
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(self._counts.items()))
+
+
+class ProfileStore:
+    """
+    Profiles on disk, three files per request id, oldest pruned past max_profiles
+    """
+
+    def __init__(self, directory, max_profiles=200):
+        self.directory = directory
+        self.max_profiles = max_profiles
+        self._lock = threading.Lock()
+
+    def path_for(self, profile_id, kind):
+        """Return the file path of one kind of a stored profile, or None if absent or invalid"""
+        if kind not in PROFILE_KINDS or not PROFILE_ID_PATTERN.match(profile_id):
+            return None
+        path = os.path.join(self.directory, PROFILE_KINDS[kind][0].format(profile_id))
+        return path if os.path.exists(path) else None
+
+    def save(self, profile_id, summary, profiler=None, collapsed=""):
+        os.makedirs(self.directory, exist_ok=True)
+        if profiler is not None:
+            profiler.dump_stats(os.path.join(self.directory, PROFILE_KINDS["pstats"][0].format(profile_id)))
+        with open(os.path.join(self.directory, PROFILE_KINDS["collapsed"][0].format(profile_id)), "w", encoding="utf-8") as f:
+            f.write(collapsed)
+        # The summary is written last; list() only reports profiles that have one
+        with open(os.path.join(self.directory, PROFILE_KINDS["summary"][0].format(profile_id)), "w", encoding="utf-8") as f:
+            json.dump(summary, f)
+        self._prune()
+
+    def list(self):
+        """Return the summaries of stored profiles, newest first"""
+        summaries = []
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        for name in names:
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.directory, name), encoding="utf-8") as f:
+                    summaries.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        summaries.sort(key=lambda summary: summary.get("started_at", 0), reverse=True)
+        return summaries
+
+    def _prune(self):
+        with self._lock:
+            summaries = self.list()
+            for summary in summaries[self.max_profiles:]:
+                for kind in PROFILE_KINDS:
+                    path = self.path_for(summary["id"], kind)
+                    if path is not None:
+                        try:
+                            os.remove(path)
+                        except OSError:
+                            pass
+
+
+class RequestProfiler:
+    """
+    Decides which requests to profile and runs them under the profilers
+    """
+
+    def __init__(self, store, secret="", sample_rate=0.0, sample_interval=0.005):
+        self.store = store
+        self.secret = secret
+        self.sample_rate = sample_rate
+        self.sample_interval = sample_interval
+        # cProfile can't run for two requests at once on every Python
+        # version, so overlapping requests only get the stack sampler
+        self._cprofile_lock = threading.Lock()
+        self._nonces = NonceLog()
+
+    @classmethod
+    def from_env(cls):
+        default_dir = os.path.join("/tmp" if os.environ.get("VERCEL_ENV") else ".", "profiles")
+        return cls(
+            ProfileStore(
+                os.environ.get("PROFILE_DIR", default_dir),
+                max_profiles=int(os.environ.get("PROFILE_MAX_STORED", "200"))
+            ),
+            secret=os.environ.get("PROFILE_SECRET", ""),
+            sample_rate=float(os.environ.get("PROFILE_SAMPLE_RATE", "0")),
+            sample_interval=float(os.environ.get("PROFILE_SAMPLE_INTERVAL", "0.005")),
+        )
+
+    def trigger(self, header, path):
+        """Return why a request should be profiled ('signed' or 'sampled'), or None"""
+        if header and verify_profile_signature(self.secret, header, path) and self._nonces.use(header):
+            return "signed"
+        if self.sample_rate > 0 and random.random() < self.sample_rate:
+            return "sampled"
+        return None
+
+    def run(self, profile_id, trigger, details, fn, *args, **kwargs):
+        """
+        Call fn under the profilers and store the result under profile_id
+
+        details is merged into the stored summary; it may be updated by fn
+        (e.g. with the response status) before the profile is saved.
+        """
+        run = self.start(profile_id, trigger, details)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            run.finish()
+
+    def start(self, profile_id, trigger, details):
+        """Start profiling the current thread; the returned run's finish() stops it and saves the profile"""
+        return _ProfileRun(self, profile_id, trigger, details)
+
+
+class _ProfileRun:
+    def __init__(self, owner, profile_id, trigger, details):
+        self.owner = owner
+        self.profile_id = profile_id
+        self.trigger = trigger
+        self.details = details
+        self.profiler = cProfile.Profile() if owner._cprofile_lock.acquire(blocking=False) else None
+        self.sampler = StackSampler(threading.get_ident(), owner.sample_interval)
+        self.started_at = time.time()
+        self.started = time.perf_counter()
+        self._finished = False
+        self.sampler.start()
+        if self.profiler is not None:
+            self.profiler.enable()
+
+    def finish(self):
+        if self._finished:
+            return
+        self._finished = True
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.owner._cprofile_lock.release()
+        self.sampler.stop()
+        summary = dict(
+            self.details,
+            id=self.profile_id,
+            trigger=self.trigger,
+            started_at=round(self.started_at, 3),
+            duration_ms=round((time.perf_counter() - self.started) * 1000, 2),
+            samples=self.sampler.samples,
+            has_pstats=self.profiler is not None,
+        )
+        try:
+            self.owner.store.save(self.profile_id, summary, self.profiler, self.sampler.collapsed())
+        except OSError:
+            pass  # Never fail the request because a profile couldn't be written
+
+
+_profiler = None
+_profiler_lock = threading.Lock()
+
+
+def get_profiler():
+    """Return the process-wide profiler configured from the environment"""
+    global _profiler
+    if _profiler is None:
+        with _profiler_lock:
+            if _profiler is None:
+                _profiler = RequestProfiler.from_env()
+    return _profiler
+
+
+def profile_flask_view(view):
+    """
+    Wrap a Flask view so requests that opt in are profiled
+
+    The profile id is the request's trace id, so it matches X-Request-ID,
+    and is also returned in the X-Profile-Id response header. A streamed
+    response is profiled until its body has been sent.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        from flask import make_response, request
+
+        profiler = get_profiler()
+        trigger = profiler.trigger(request.headers.get("X-Profile"), request.path)
+        if trigger is None:
+            return view(*args, **kwargs)
+
+        profile_id = _profile_id(current_trace_id() or request.headers.get("X-Request-ID"), profiler.store)
+        details = {"method": request.method, "path": request.path}
+
+        run = profiler.start(profile_id, trigger, details)
+        try:
+            response = make_response(view(*args, **kwargs))
+        except BaseException:
+            run.finish()
+            raise
+        details["status"] = response.status_code
+        if response.is_streamed:
+            # The work happens while the body is generated, after the view returns
+            response.call_on_close(run.finish)
+        else:
+            run.finish()
+        response.headers["X-Profile-Id"] = profile_id
+        return response
+    return wrapper
+
+
+def profile_handler_methods(handler_class):
+    """
+    Class decorator for BaseHTTPRequestHandler subclasses that profiles do_* methods
+
+    Requests opt in the same way as Flask views; the profile id is sent
+    back in an X-Profile-Id header.
+    """
+    for name in [attr for attr in vars(handler_class) if attr.startswith("do_")]:
+        setattr(handler_class, name, _profiled_method(getattr(handler_class, name)))
+
+    original_send_response = handler_class.send_response
+    original_end_headers = handler_class.end_headers
+
+    def send_response(self, code, message=None):
+        self._profile_status = code
+        original_send_response(self, code, message)
+
+    def end_headers(self):
+        profile_id = getattr(self, "_profile_id", None)
+        if profile_id is not None:
+            self.send_header("X-Profile-Id", profile_id)
+        original_end_headers(self)
+
+    handler_class.send_response = send_response
+    handler_class.end_headers = end_headers
+    return handler_class
+
+
+def _profiled_method(method):
+    @wraps(method)
+    def wrapper(self):
+        from urllib.parse import urlparse
+
+        path = urlparse(self.path).path
+        profiler = get_profiler()
+        trigger = profiler.trigger(self.headers.get("X-Profile"), path)
+        if trigger is None:
+            return method(self)
+
+        self._profile_id = _profile_id(self.headers.get("X-Request-ID"), profiler.store)
+        details = {"method": self.command, "path": path}
+
+        def call():
+            try:
+                return method(self)
+            finally:
+                details["status"] = getattr(self, "_profile_status", None)
+
+        return profiler.run(self._profile_id, trigger, details, call)
+    return wrapper
+
+
+def _profile_id(request_id, store):
+    if not request_id or not PROFILE_ID_PATTERN.match(request_id):
+        return uuid.uuid4().hex
+    if store.path_for(request_id, "summary") is not None:
+        # Don't overwrite an earlier profile when a client reuses its request id
+        return f"{request_id}-{uuid.uuid4().hex[:8]}"
+    return request_id
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Sign requests for on-demand profiling")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    sign_parser = subparsers.add_parser("sign", help="Print an X-Profile header value")
+    sign_parser.add_argument("path", help="Request path, e.g. /analyze")
+    args = parser.parse_args(argv)
+
+    secret = os.environ.get("PROFILE_SECRET")
+    if not secret:
+        parser.error("PROFILE_SECRET is not set")
+    print(sign_profile_request(secret, args.path))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
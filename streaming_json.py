@@ -0,0 +1,97 @@
+"""
+Incremental parser for the vision model's streamed JSON reply.
+
+The model answers with one JSON object containing a "food_items" array.
+FoodItemStreamParser is fed the reply chunk by chunk and hands back each
+element of that array as soon as its closing brace arrives, so nutrition
+lookups can start while the rest of the reply is still being generated.
+"""
+
+import json
+
+
+class FoodItemStreamParser:
+    """
+    Feed text chunks in, get completed "food_items" entries out
+    """
+
+    def __init__(self, array_key="food_items"):
+        self.array_key = array_key
+        self._chunks = []
+        self._buffer = ""      # text of the current food item, once one has started
+        self._depth = 0        # nesting of {} and [] inside the top-level object
+        self._in_string = False
+        self._escape = False
+        self._string = []      # characters of the string being read at depth 1
+        self._last_key = None  # last string seen at depth 1, i.e. the current key
+        self._array_depth = None
+        self._item_depth = None
+        self._done = False
+
+    @property
+    def text(self):
+        """Everything fed so far"""
+        return "".join(self._chunks)
+
+    def feed(self, chunk):
+        """Consume a chunk of the reply and return any food items it completed"""
+        self._chunks.append(chunk)
+        items = []
+        for char in chunk:
+            item = self._consume(char)
+            if item is not None:
+                items.append(item)
+        return items
+
+    def _consume(self, char):
+        if self._done:
+            return None
+
+        if self._item_depth is not None:
+            self._buffer += char
+
+        if self._in_string:
+            if self._escape:
+                self._escape = False
+            elif char == "\\":
+                self._escape = True
+            elif char == '"':
+                self._in_string = False
+                if self._depth == 1:
+                    self._last_key = "".join(self._string)
+                return None
+            if self._depth == 1:
+                self._string.append(char)
+            return None
+
+        if char == '"':
+            self._in_string = True
+            self._string = []
+        elif char in "{[":
+            if self._depth == 0 and char != "{":
+                return None
+            self._depth += 1
+            if char == "[" and self._depth == 2 and self._last_key == self.array_key:
+                self._array_depth = self._depth
+            elif char == "{" and self._array_depth is not None and self._depth == self._array_depth + 1:
+                self._item_depth = self._depth
+                self._buffer = char
+        elif char in "}]":
+            if self._depth == 0:
+                return None
+            if char == "}" and self._item_depth is not None and self._depth == self._item_depth:
+                self._depth -= 1
+                text, self._buffer, self._item_depth = self._buffer, "", None
+                try:
+                    item = json.loads(text)
+                except json.JSONDecodeError:
+                    return None
+                return item if isinstance(item, dict) else None
+            if char == "]" and self._array_depth is not None and self._depth == self._array_depth:
+                self._array_depth = None
+            self._depth -= 1
+            if self._depth == 0:
+                self._done = True
+        elif char == "," and self._depth == 1:
+            self._last_key = None
+        return None
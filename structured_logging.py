@@ -0,0 +1,95 @@
+"""
+Level-gated structured logging.
+
+Log calls take an event name plus keyword fields and emit one JSON object
+per line (or key=value text with LOG_FORMAT=text), tagged with the trace id
+of the request being handled. Nothing is formatted unless the level is
+enabled, so debug calls on hot paths are close to free in production.
+"""
+
+import json
+import logging
+import sys
+
+from metrics import current_trace_id
+
+LOGGER_NAMESPACE = "calai"
+
+
+class StructuredFormatter(logging.Formatter):
+    """Render a record and its fields as JSON or key=value text"""
+
+    def __init__(self, output_format="json"):
+        super().__init__()
+        self.output_format = output_format
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "event": record.getMessage(),
+        }
+        trace_id = getattr(record, "trace_id", None)
+        if trace_id:
+            entry["trace_id"] = trace_id
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+
+        if self.output_format == "text":
+            return " ".join(f"{key}={json.dumps(value, default=str)}" for key, value in entry.items())
+        return json.dumps(entry, default=str)
+
+
+class StructuredLogger:
+    """
+    Thin wrapper around a stdlib logger: log.info("event_name", key=value, ...)
+    """
+
+    def __init__(self, name):
+        self._logger = logging.getLogger(name)
+
+    def is_enabled(self, level):
+        return self._logger.isEnabledFor(level)
+
+    def _log(self, level, event, fields, exc_info=False):
+        if not self._logger.isEnabledFor(level):
+            return
+        self._logger.log(level, event, exc_info=exc_info,
+                         extra={"fields": fields, "trace_id": current_trace_id()})
+
+    def debug(self, event, **fields):
+        self._log(logging.DEBUG, event, fields)
+
+    def info(self, event, **fields):
+        self._log(logging.INFO, event, fields)
+
+    def warning(self, event, **fields):
+        self._log(logging.WARNING, event, fields)
+
+    def error(self, event, **fields):
+        self._log(logging.ERROR, event, fields)
+
+    def exception(self, event, **fields):
+        """Log at error level with the traceback of the exception being handled"""
+        self._log(logging.ERROR, event, fields, exc_info=True)
+
+
+def configure_logging(level="INFO", output_format="json", stream=None):
+    """Send every calai.* logger to one handler at the given level"""
+    logger = logging.getLogger(LOGGER_NAMESPACE)
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    handler = logging.StreamHandler(stream or sys.stderr)
+    handler.setFormatter(StructuredFormatter(output_format))
+    logger.addHandler(handler)
+    if isinstance(level, str):
+        level = logging.getLevelName(level.upper())
+    logger.setLevel(level if isinstance(level, int) else logging.INFO)
+    logger.propagate = False
+    return logger
+
+
+def get_logger(name):
+    return StructuredLogger(f"{LOGGER_NAMESPACE}.{name}")
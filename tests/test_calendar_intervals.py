@@ -0,0 +1,105 @@
+import random
+
+import pytest
+
+from api.calendar.availability import busy_intervals, free_intervals
+from api.calendar.intervals import IntervalIndex, overlaps
+from api.calendar.store import MemoryEventStore
+from api.calendar.times import parse_time
+
+
+def brute_force(spans, low, high):
+    """Values overlapping [low, high), ordered by (start, value) like the index"""
+    return [value for (start, value), end in sorted(spans.items()) if overlaps(start, end, low, high)]
+
+
+def random_span(rng):
+    start = rng.randint(0, 100)
+    # Plenty of instants and spans that touch each other at whole numbers
+    return start, start + rng.choice([0, 0, 1, 2, 5, rng.randint(0, 60)])
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_overlapping_matches_brute_force_under_inserts_and_deletes(seed):
+    rng = random.Random(seed)
+    index, spans = IntervalIndex(), {}
+    next_value = 0
+    for step in range(600):
+        if spans and rng.random() < 0.35:
+            start, value = rng.choice(sorted(spans))
+            index.discard(value, start)
+            del spans[(start, value)]
+        else:
+            start, end = random_span(rng)
+            index.add(next_value, start, end)
+            spans[(start, next_value)] = end
+            next_value += 1
+        assert len(index) == len(spans)
+
+        if step % 10 == 0:
+            for _ in range(20):
+                low = rng.randint(-5, 105)
+                high = low + rng.choice([0, 1, rng.randint(1, 50)])
+                assert index.overlapping(low, high) == brute_force(spans, low, high), (low, high)
+
+
+def test_zero_length_and_touching_spans():
+    index = IntervalIndex()
+    index.add(1, 10, 20)   # [10, 20)
+    index.add(2, 20, 30)   # touches 1 at 20
+    index.add(3, 20, 20)   # instant at 20
+    index.add(4, 30, 30)   # instant at the end of 2
+
+    assert index.overlapping(20, 21) == [2, 3]
+    assert index.overlapping(19, 20) == [1]
+    assert index.overlapping(10, 20) == [1]
+    assert index.overlapping(30, 31) == [4]
+    assert index.overlapping(0, 10) == []
+    # An empty window overlaps nothing, not even an instant at the same time
+    assert index.overlapping(20, 20) == []
+
+
+def test_discard_of_missing_span_is_a_no_op():
+    index = IntervalIndex()
+    index.add(1, 10, 20)
+    index.discard(1, 11)
+    index.discard(2, 10)
+    assert len(index) == 1
+    index.discard(1, 10)
+    assert len(index) == 0
+    assert index.overlapping(0, 100) == []
+
+
+def iso(minute):
+    return f"2024-06-03T{minute // 60:02d}:{minute % 60:02d}:00Z"
+
+
+def minutes(intervals, base):
+    return [((start - base) // 60, (end - base) // 60) for start, end in intervals]
+
+
+def test_busy_intervals_merge_overlapping_and_touching_events():
+    store = MemoryEventStore()
+    store.add_many([
+        {"title": "a", "start_time": iso(540), "end_time": iso(600)},   # 09:00-10:00
+        {"title": "b", "start_time": iso(570), "end_time": iso(630)},   # overlaps a
+        {"title": "c", "start_time": iso(630), "end_time": iso(660)},   # touches b
+        {"title": "d", "start_time": iso(720)},                         # instant, takes no time
+        {"title": "e", "start_time": iso(780), "end_time": iso(900)},   # runs past the window
+    ])
+    low, high = parse_time(iso(480)), parse_time(iso(840))
+    busy = busy_intervals(store, low, high)
+    base = parse_time(iso(0))
+    assert minutes(busy, base) == [(540, 660), (780, 840)]
+    assert minutes(free_intervals(busy, low, high), base) == [(480, 540), (660, 780)]
+
+
+def test_busy_intervals_expand_recurring_events_in_the_window():
+    store = MemoryEventStore()
+    store.add_many([{
+        "title": "standup", "start_time": iso(540), "end_time": iso(555), "rrule": "FREQ=DAILY;COUNT=5",
+    }])
+    low, high = parse_time("2024-06-04T00:00:00Z"), parse_time("2024-06-06T00:00:00Z")
+    busy = busy_intervals(store, low, high)
+    assert [(end - start) for start, end in busy] == [900, 900]
+    assert free_intervals([], low, high) == [(low, high)]
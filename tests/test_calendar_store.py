@@ -0,0 +1,52 @@
+import json
+import sqlite3
+
+import pytest
+
+from api.calendar.store import InvalidTime, MemoryEventStore, SQLiteEventStore
+
+MEETING = {"title": "Standup", "start_time": "2024-06-03T09:00:00Z", "end_time": "2024-06-03T09:15:00Z"}
+BAD_END = dict(MEETING, end_time="junk")
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return MemoryEventStore()
+    return SQLiteEventStore(str(tmp_path / "calendar.sqlite3"))
+
+
+def test_bad_end_time_leaves_store_unchanged(store):
+    event = store.add_many([MEETING])[0]
+    version = store.version()
+
+    with pytest.raises(InvalidTime):
+        store.add_many([BAD_END])
+    with pytest.raises(InvalidTime):
+        store.replace(event["id"], BAD_END)
+
+    assert store.version() == version
+    assert [e["id"] for e in store.all()] == [event["id"]]
+    assert store.get(event["id"])["end_time"] == MEETING["end_time"]
+    assert [e["id"] for e in store.overlapping(0, 2e9)] == [event["id"]]
+
+
+def test_span_backfill_skips_unparseable_legacy_rows(tmp_path):
+    path = str(tmp_path / "calendar.sqlite3")
+    SQLiteEventStore(path).add_many([MEETING])
+    # A database from before spans were indexed, holding an end_time nothing checked
+    conn = sqlite3.connect(path)
+    conn.execute("DROP TABLE calendar_spans")
+    conn.execute(
+        "INSERT INTO calendar_events (start_ts, data, recurring) VALUES (?, ?, 0)",
+        (1717405200, json.dumps(BAD_END))
+    )
+    conn.commit()
+    conn.close()
+
+    store = SQLiteEventStore(path)
+    assert len(store) == 2
+    assert [e["id"] for e in store.overlapping(0, 2e9)] == ["1"]
+
+    store.replace("2", MEETING)
+    assert [e["id"] for e in store.overlapping(0, 2e9)] == ["1", "2"]
@@ -0,0 +1,80 @@
+import pytest
+
+from food_lexicon import KeywordMatcher, categorize_food, normalize_text, plural_forms
+
+
+def matcher(*terms):
+    return KeywordMatcher((normalize_text(term), value) for term, value in terms)
+
+
+def test_matches_only_whole_words():
+    m = matcher(("ham", "meat"), ("pea", "vegetable"))
+    assert m.best_match("graham cracker") is None
+    assert m.best_match("peach") is None
+    assert m.best_match("hamburger") is None
+    assert m.best_match("ham") == "meat"
+    assert m.best_match("glazed ham slices") == "meat"
+    assert m.best_match("pea") == "vegetable"
+
+
+def test_adjacent_terms_share_the_space_between_them():
+    m = matcher(("ham", "meat"), ("egg", "egg"))
+    assert [(end, value) for end, _, value in m.iter_matches("ham egg")] == [(5, "meat"), (9, "egg")]
+
+
+def test_longest_match_wins():
+    m = matcher(("potato", "starchy_vegetable"), ("potato chips", "snack"), ("chips", "snack_short"))
+    assert m.best_match("salted potato chips") == "snack"
+    assert m.best_match("potato") == "starchy_vegetable"
+
+
+def test_ties_go_to_the_rightmost_match():
+    m = matcher(("chocolate", "sweet"), ("cake", "dessert"), ("rice", "grain"), ("milk", "dairy"))
+    assert m.best_match("chocolate cake") == "sweet"  # longer term wins before position
+    assert m.best_match("rice milk") == "dairy"
+    assert m.best_match("milk rice") == "grain"
+
+
+def test_first_category_listed_for_a_term_wins():
+    m = matcher(("butter", "fat"), ("butter", "dairy"))
+    assert m.best_match("butter") == "fat"
+    assert len(m) == 1
+
+
+@pytest.mark.parametrize("text, normalized", [
+    ("Crème Brûlée", "creme brulee"),
+    ("Chicken-Noodle  Soup!", "chicken noodle soup"),
+    ("Mom's MEATLOAF", "moms meatloaf"),
+    ("", ""),
+    (None, ""),
+])
+def test_normalize_text(text, normalized):
+    assert normalize_text(text) == normalized
+
+
+def test_case_and_punctuation_do_not_affect_matching():
+    m = matcher(("ice cream", "dessert"), ("creme brulee", "dessert_fr"))
+    assert m.best_match("ICE-CREAM, vanilla!") == "dessert"
+    assert m.best_match("Crème Brûlée") == "dessert_fr"
+
+
+def test_plural_forms_inflect_the_last_word():
+    assert plural_forms("baked potato") == ["baked potatoes", "baked potatos"]
+    assert plural_forms("berry") == ["berries"]
+    assert plural_forms("sandwich") == ["sandwiches"]
+    assert plural_forms("loaf") == ["loaves"]
+    assert plural_forms("salmon") == ["salmon"]
+
+
+@pytest.mark.parametrize("name, description, category", [
+    ("graham crackers", "", "snack"),
+    ("ham sandwich", "", "mixed_dish"),
+    ("peach", "", "fruit"),
+    ("Baked Potatoes", "", "starchy_vegetable"),
+    ("potato chips", "", "snack"),
+    ("Chicken-Noodle Soup!", "", "soup"),
+    ("house special", "grilled chicken", "poultry"),
+    ("house special", "", "default"),
+])
+def test_categorize_food(name, description, category):
+    assert categorize_food(name, description) == category
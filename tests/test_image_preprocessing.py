@@ -0,0 +1,51 @@
+import os
+from io import BytesIO
+
+import pytest
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("USDA_API_KEY", "test")
+
+import app as app_module  # noqa: E402
+
+Image = pytest.importorskip("PIL.Image")
+
+
+def encode(img, format, **params):
+    buffer = BytesIO()
+    img.save(buffer, format, **params)
+    return buffer.getvalue()
+
+
+def exif_with_gps():
+    exif = Image.Exif()
+    exif[0x010F] = "Camera maker"
+    exif[0x8825] = {1: "N", 2: (51.0, 30.0, 0.0)}
+    return exif.tobytes()
+
+
+@pytest.mark.parametrize("format", ["PNG", "GIF", "WEBP"])
+def test_small_plain_image_is_passed_through(format):
+    raw = encode(Image.new("RGB", (16, 16), (200, 40, 40)), format)
+    processed, stats = app_module.prepare_image_for_vision(raw)
+    assert processed == raw
+    assert stats["saved_bytes"] == 0
+    assert app_module.image_mime_type(processed) == f"image/{format.lower()}"
+
+
+@pytest.mark.parametrize("format", ["JPEG", "PNG", "WEBP"])
+def test_image_with_exif_is_reencoded_without_it(format):
+    noise = Image.frombytes("RGB", (64, 64), os.urandom(64 * 64 * 3))
+    raw = encode(noise, format, exif=exif_with_gps(), **({"quality": 10} if format == "JPEG" else {}))
+    processed, _ = app_module.prepare_image_for_vision(raw)
+    assert processed != raw
+    with Image.open(BytesIO(processed)) as img:
+        assert img.format == "JPEG"
+        assert not img.getexif()
+        assert app_module.has_image_metadata(img) is False
+
+
+def test_jpeg_comment_is_not_copied_into_the_reencode():
+    raw = encode(Image.new("RGB", (16, 16)), "JPEG", comment=b"taken at home")
+    processed, _ = app_module.prepare_image_for_vision(raw)
+    assert b"taken at home" not in processed
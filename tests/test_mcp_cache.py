@@ -0,0 +1,44 @@
+import os
+
+from api.mcp_cache import CACHEABLE, MUTATING, McpResponseCache, load_method_classes
+
+SCHEMA_PATH = os.path.join(os.path.dirname(__file__), "..", "vercel-mcp", "dist", "schema.json")
+
+
+class FakeVercel:
+    """Answers list/delete deployment calls from an in-memory list"""
+
+    def __init__(self):
+        self.deployments = ["dpl_1", "dpl_2"]
+        self.calls = []
+
+    def send(self, request):
+        self.calls.append(request["method"])
+        if request["method"] == "mcp__delete_deployment":
+            self.deployments.remove(request["params"]["id"])
+            return {"id": request["id"], "result": {"deleted": True}}
+        return {"id": request["id"], "result": {"deployments": list(self.deployments)}}
+
+
+def test_methods_missing_from_schema_are_mutating():
+    cache = McpResponseCache(load_method_classes(SCHEMA_PATH))
+    assert cache.classify("mcp__list_deployments") == CACHEABLE
+    # Served by vercel-mcp but not listed in its schema
+    for method in ("mcp__update_project", "mcp__create_deployment", "mcp__delete_deployment"):
+        assert cache.classify(method) == MUTATING
+
+
+def test_unlisted_mutation_invalidates_cached_reads():
+    vercel = FakeVercel()
+    cache = McpResponseCache(load_method_classes(SCHEMA_PATH))
+    list_call = {"method": "mcp__list_deployments", "params": {}}
+
+    _, outcome = cache.call(dict(list_call, id=1), vercel.send)
+    assert outcome == "miss"
+    _, outcome = cache.call({"id": 2, "method": "mcp__delete_deployment", "params": {"id": "dpl_1"}}, vercel.send)
+    assert outcome == "bypass"
+    response, outcome = cache.call(dict(list_call, id=3), vercel.send)
+
+    assert outcome == "miss"
+    assert response == {"id": 3, "result": {"deployments": ["dpl_2"]}}
+    assert vercel.calls == ["mcp__list_deployments", "mcp__delete_deployment", "mcp__list_deployments"]
@@ -0,0 +1,90 @@
+import os
+from io import BytesIO
+
+import pytest
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("USDA_API_KEY", "test")
+
+import app as app_module  # noqa: E402
+
+ANALYSIS = {
+    "meal_description": "Tomato soup",
+    "plate_size": "bowl",
+    "total_nutrition": {"calories": 321.0, "proteins": 8.0, "fats": 12.0, "carbs": 40.0},
+    "total_nutrients": {},
+    "food_items": [],
+}
+
+
+def png_bytes():
+    from PIL import Image
+    buffer = BytesIO()
+    Image.new("RGB", (32, 32), (200, 40, 40)).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setitem(app_module.app.config, "MEAL_HISTORY_PATH", str(tmp_path / "meals.sqlite3"))
+    monkeypatch.setattr(app_module, "_meal_history", None)
+    # Only the vision call is stubbed; upload, preprocessing and caching run as usual
+    monkeypatch.setattr(app_module, "analyze_image_with_gpt_vision", lambda image: {"success": True, "data": ANALYSIS})
+    monkeypatch.setattr(app_module, "analysis_cache", app_module.AnalysisCache())
+    return app_module.app.test_client()
+
+
+def test_analyze_save_stores_meal_and_rollups(client):
+    headers = {"X-User-Id": "alice"}
+    response = client.post(
+        "/analyze?save=1&eaten_at=2024-06-03T19:00:00%2B02:00",
+        data={"file": (BytesIO(png_bytes()), "soup.png")},
+        content_type="multipart/form-data",
+        headers=headers,
+    )
+    body = response.get_json()
+    assert body["success"], body
+    assert body["meal_id"]
+
+    meal = client.get(f"/meals/{body['meal_id']}", headers=headers).get_json()["meal"]
+    assert meal["meal_description"] == "Tomato soup"
+    assert meal["total_nutrition"]["calories"] == 321.0
+    assert meal["eaten_at"] == "2024-06-03T19:00:00+02:00"
+
+    summary = client.get("/meals/summary?from=2024-06-03&to=2024-06-03", headers=headers).get_json()
+    assert summary["periods"] == [
+        {"start": "2024-06-03", "meals": 1, "calories": 321.0, "proteins": 8.0, "fats": 12.0, "carbs": 40.0}
+    ]
+
+
+def test_post_meals_accepts_whole_analyze_response(client):
+    response = client.post(
+        "/meals",
+        json={"success": True, "cached": False, "data": ANALYSIS, "eaten_at": "2024-06-04T12:00:00Z"},
+        headers={"X-User-Id": "alice"},
+    )
+    assert response.status_code == 201, response.get_json()
+    assert response.get_json()["meal"]["total_nutrition"]["carbs"] == 40.0
+
+
+def test_analyze_save_rejects_bad_options_before_analyzing(client, monkeypatch):
+    calls = []
+    monkeypatch.setattr(app_module, "analyze_image_with_gpt_vision", lambda image: calls.append(image))
+    for query in ("save=1&eaten_at=yesterday", "save=1&event_id=999999"):
+        response = client.post(
+            f"/analyze?{query}",
+            data={"file": (BytesIO(png_bytes()), "soup.png")},
+            content_type="multipart/form-data",
+        )
+        assert response.get_json()["success"] is False
+    assert calls == []
+
+
+def test_validate_meal_fields():
+    from meal_history import InvalidMeal, validate_meal_fields
+
+    assert validate_meal_fields("2024-06-03T19:00:00Z", 7) == ("2024-06-03T19:00:00Z", "7")
+    eaten_at, event_id = validate_meal_fields()
+    assert eaten_at.endswith("Z") and event_id is None
+    with pytest.raises(InvalidMeal):
+        validate_meal_fields("not a time")
@@ -0,0 +1,96 @@
+import math
+import random
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from nutrients import (  # noqa: E402
+    MACRO_KEYS,
+    NUTRIENT_INDEX,
+    NUTRIENT_KEYS,
+    FoodNutrition,
+    meal_totals,
+    scale_portions,
+    summarize_items,
+    vector_from_food_nutrients,
+    vector_from_json,
+    vector_from_values,
+    vector_to_json,
+)
+
+
+def food(grams, estimated=False, **values):
+    return FoodNutrition(
+        name="food", description="", quantity=grams, unit="g", grams=grams,
+        per_100g=vector_from_values(values), estimated=estimated,
+    )
+
+
+def test_missing_nutrient_stays_unknown_only_while_every_item_lacks_it():
+    amounts = scale_portions([food(100, calories=50), food(200, calories=10)])
+    totals = meal_totals(amounts)
+    assert math.isnan(totals[NUTRIENT_INDEX["sodium"]])
+    assert totals[NUTRIENT_INDEX["calories"]] == pytest.approx(70.0)
+
+    # Once one item reports it, the total is that item's amount, not NaN
+    amounts = scale_portions([food(100, calories=50), food(200, calories=10, sodium=30)])
+    totals = meal_totals(amounts)
+    assert totals[NUTRIENT_INDEX["sodium"]] == pytest.approx(60.0)
+
+
+def test_macros_default_to_zero_rather_than_unknown():
+    totals = meal_totals(scale_portions([food(150, sodium=5)]))
+    for key in MACRO_KEYS:
+        assert totals[NUTRIENT_INDEX[key]] == 0.0
+
+
+def test_empty_meal_totals():
+    totals = meal_totals(scale_portions([]))
+    assert [totals[NUTRIENT_INDEX[key]] for key in MACRO_KEYS] == [0.0] * len(MACRO_KEYS)
+    assert math.isnan(totals[NUTRIENT_INDEX["iron"]])
+
+
+def test_batched_scaling_matches_scaling_each_item():
+    rng = random.Random(7)
+    items = []
+    for _ in range(25):
+        values = {key: rng.uniform(0, 500) for key in NUTRIENT_KEYS if rng.random() < 0.6}
+        items.append(food(rng.uniform(1, 400), estimated=rng.random() < 0.3, **values))
+
+    amounts = scale_portions(items)
+    assert amounts.shape == (len(items), len(NUTRIENT_KEYS))
+    for item, row in zip(items, amounts):
+        expected = item.per_100g * item.grams / 100.0
+        if item.estimated:
+            expected = np.round(expected, 1)
+        np.testing.assert_allclose(row, expected, equal_nan=True)
+        np.testing.assert_allclose(item.amounts(), row, equal_nan=True)
+
+    expected_totals = np.array([
+        np.nan if all(math.isnan(value) for value in column) else sum(v for v in column if not math.isnan(v))
+        for column in amounts.T
+    ])
+    np.testing.assert_allclose(meal_totals(amounts), expected_totals, equal_nan=True)
+
+
+def test_summarize_items_reports_unknown_as_none():
+    item_dicts, total_nutrition, total_nutrients = summarize_items([food(50, calories=200, fiber=4)])
+    assert total_nutrition == {"calories": 100.0, "proteins": 0.0, "fats": 0.0, "carbs": 0.0}
+    assert total_nutrients["fiber"] == pytest.approx(2.0)
+    assert total_nutrients["sodium"] is None
+    assert item_dicts[0]["calories"] == 100.0
+    assert item_dicts[0]["nutrients"]["sodium"] is None
+
+
+def test_vector_json_round_trip_and_schema_check():
+    vector = vector_from_food_nutrients([
+        {"nutrientId": 2047, "value": 120},  # Atwater energy, used when 1008 is missing
+        {"nutrientId": 1003, "value": 3.5},
+        {"nutrientId": 1093, "value": None},
+        {"nutrientId": 9999, "value": 1},
+    ])
+    assert vector[NUTRIENT_INDEX["calories"]] == 120
+    assert math.isnan(vector[NUTRIENT_INDEX["sodium"]])
+    np.testing.assert_array_equal(vector_from_json(vector_to_json(vector)), vector)
+    assert vector_from_json(dict(vector_to_json(vector), schema=0)) is None
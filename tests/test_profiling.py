@@ -0,0 +1,56 @@
+import os
+import time
+
+import pytest
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("USDA_API_KEY", "test")
+
+import app as app_module  # noqa: E402
+import profiling  # noqa: E402
+from profiling import ProfileStore, RequestProfiler, sign_profile_request, verify_profile_signature  # noqa: E402
+
+SECRET = "s3cret"
+
+
+@pytest.fixture
+def profiler(tmp_path, monkeypatch):
+    profiler = RequestProfiler(ProfileStore(str(tmp_path)), secret=SECRET)
+    monkeypatch.setattr(profiling, "_profiler", profiler)
+    return profiler
+
+
+def test_signature_is_bound_to_path_and_time():
+    now = time.time()
+    header = sign_profile_request(SECRET, "/analyze", now)
+    assert verify_profile_signature(SECRET, header, "/analyze", now)
+    assert not verify_profile_signature(SECRET, header, "/analyze/batch", now)
+    assert not verify_profile_signature("other", header, "/analyze", now)
+    assert not verify_profile_signature(SECRET, header, "/analyze", now + profiling.SIGNATURE_MAX_AGE + 1)
+    # The old two-part form carries no nonce
+    timestamp, _, rest = header.partition(":")
+    assert not verify_profile_signature(SECRET, f"{timestamp}:{rest.partition(':')[2]}", "/analyze", now)
+
+
+def test_signed_header_is_single_use(profiler):
+    header = sign_profile_request(SECRET, "/analyze")
+    assert profiler.trigger(header, "/analyze") == "signed"
+    assert profiler.trigger(header, "/analyze") is None
+    assert profiler.trigger(sign_profile_request(SECRET, "/analyze"), "/analyze") == "signed"
+
+
+def test_streamed_response_is_profiled_until_sent(profiler):
+    client = app_module.app.test_client()
+    response = client.post(
+        "/analyze/stream",
+        headers={"X-Profile": sign_profile_request(SECRET, "/analyze/stream")},
+        data={},
+    )
+    assert b"event: error" in response.get_data()
+    response.close()
+
+    profile_id = response.headers["X-Profile-Id"]
+    [summary] = profiler.store.list()
+    assert summary["id"] == profile_id
+    assert summary["path"] == "/analyze/stream"
+    assert summary["status"] == 200
@@ -0,0 +1,59 @@
+import json
+
+from streaming_json import FoodItemStreamParser
+
+REPLY = json.dumps({
+    "meal_description": "Pasta with \"pesto\" {homemade} and a [side] salad",
+    "plate_size": "food_items",
+    "food_items": [
+        {"name": "pasta \\ \"penne\"", "portion_size": "200g", "notes": "}{ ][ , :"},
+        {"name": "pesto", "details": {"basil": [1, 2, {"leaves": "{}"}], "oil": {"type": "olive"}}},
+        {"name": "salad", "extras": [], "flags": {}},
+    ],
+    "confidence": {"food_items": [{"name": "not an item"}]},
+}, indent=2)
+
+
+def feed_all(parser, chunks):
+    items = []
+    for chunk in chunks:
+        items.extend(parser.feed(chunk))
+    return items
+
+
+def test_items_match_json_loads_at_every_split():
+    expected = json.loads(REPLY)["food_items"]
+    for split in range(len(REPLY) + 1):
+        parser = FoodItemStreamParser()
+        assert feed_all(parser, [REPLY[:split], REPLY[split:]]) == expected, f"split at {split}"
+        assert parser.text == REPLY
+
+
+def test_items_arrive_one_character_at_a_time():
+    parser = FoodItemStreamParser()
+    seen = []
+    for index, char in enumerate(REPLY):
+        for item in parser.feed(char):
+            seen.append(item)
+            # Each item is handed back as soon as its closing brace arrives
+            assert REPLY[index] == "}"
+    assert seen == json.loads(REPLY)["food_items"]
+
+
+def test_reply_wrapped_in_prose_and_code_fence():
+    text = "Here is the analysis [JSON]:\n```json\n" + REPLY + "\n```\nLet me know {if} you need more."
+    assert feed_all(FoodItemStreamParser(), text) == json.loads(REPLY)["food_items"]
+
+
+def test_truncated_stream_returns_only_completed_items():
+    cut = REPLY.index('"salad"')
+    parser = FoodItemStreamParser()
+    items = feed_all(parser, REPLY[:cut])
+    assert items == json.loads(REPLY)["food_items"][:2]
+
+
+def test_reply_without_food_items():
+    text = json.dumps({"meal_description": "Just water", "items": [{"name": "water"}], "nested": {"food_items": [{"a": 1}]}})
+    parser = FoodItemStreamParser()
+    assert feed_all(parser, text) == []
+    assert parser.text == text